@@ -0,0 +1,134 @@
+import numpy as np
+import struct
+
+# ==============================================================================
+# AUDIO I/O: DTYPE-AWARE WAV EXPORT
+# 16/24-bit PCM (rounded, optionally TPDF-dithered), or 32-bit float (no
+# quantization at all). Dither is off by default so exports are reproducible.
+# Samples are floats in [-1, 1]; any float dtype is accepted.
+# ==============================================================================
+
+WAV_FORMATS = {
+    # name: (bytes per sample, WAV format tag)
+    "int16": (2, 1),
+    "int24": (3, 1),
+    "float32": (4, 3)
+}
+
+def quantize(data, bits=16, dither=False, rng=None):
+    """
+    Float [-1, 1] -> integer PCM codes (int32 array).
+    TPDF dither (sum of two uniform LSB/2 noises) decorrelates the rounding
+    error from the signal, instead of the truncation distortion of astype().
+    """
+    full_scale = 2 ** (bits - 1) - 1
+    scaled = np.asarray(data, dtype=np.float64) * full_scale
+    if dither:
+        rng = rng or np.random.default_rng()
+        scaled += rng.uniform(-0.5, 0.5, len(scaled)) + rng.uniform(-0.5, 0.5, len(scaled))
+    return np.clip(np.round(scaled), -full_scale - 1, full_scale).astype(np.int32)
+
+def encode_frames(data, fmt="int16", dither=False, rng=None):
+    """Encodes one mono block to little-endian WAV frame bytes."""
+    if fmt == "float32":
+        return np.asarray(data, dtype="<f4").tobytes()
+    if fmt == "int16":
+        return quantize(data, 16, dither, rng).astype("<i2").tobytes()
+    if fmt == "int24":
+        # Keep the low 3 bytes of each little-endian int32
+        codes = quantize(data, 24, dither, rng).astype("<i4")
+        return codes.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    raise ValueError(f"Unknown WAV format '{fmt}'. Use one of {list(WAV_FORMATS)}")
+
+class WavWriter:
+    """
+    Incremental mono WAV writer. The header is written up front with
+    placeholder sizes and patched on close(), so blocks can be streamed.
+    """
+    def __init__(self, filename, sr=44100, fmt="int16", dither=False, seed=None):
+        if fmt not in WAV_FORMATS:
+            raise ValueError(f"Unknown WAV format '{fmt}'. Use one of {list(WAV_FORMATS)}")
+        self.filename = filename
+        self.sr = sr
+        self.fmt = fmt
+        self.dither = dither
+        self.rng = np.random.default_rng(seed)
+        self.sample_width, self.format_tag = WAV_FORMATS[fmt]
+        self.n_frames = 0
+        self.file = open(filename, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        is_float = self.format_tag == 3
+        fmt_chunk = struct.pack("<HHIIHH", self.format_tag, 1, self.sr,
+                                self.sr * self.sample_width, self.sample_width,
+                                self.sample_width * 8)
+        if is_float:
+            fmt_chunk += struct.pack("<H", 0) # cbSize: non-PCM formats need it
+
+        data_size = self.n_frames * self.sample_width
+        header = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt_chunk)) + fmt_chunk
+        if is_float:
+            header += b"fact" + struct.pack("<II", 4, self.n_frames)
+        header += b"data" + struct.pack("<I", data_size)
+        pad = data_size % 2
+        self.file.write(b"RIFF" + struct.pack("<I", len(header) + data_size + pad) + header)
+
+    def write(self, block):
+        self.file.write(encode_frames(block, self.fmt, self.dither, self.rng))
+        self.n_frames += len(block)
+
+    def close(self):
+        if self.file.closed:
+            return
+        # Pad odd-sized data chunks (RIFF words are 2 bytes)
+        if (self.n_frames * self.sample_width) % 2:
+            self.file.write(b"\x00")
+        self.file.seek(0)
+        self._write_header()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_wav(filename, data, sr=44100, fmt="int16", dither=False, seed=None):
+    """One-shot version of WavWriter for a full buffer."""
+    with WavWriter(filename, sr, fmt, dither, seed) as writer:
+        writer.write(data)
+
+# --- SELF-TEST: quantization error against its theoretical bounds ---
+
+def check_quantization(n_samples=200_000, seed=0):
+    """
+    Asserts the int16/int24 error, in LSBs: plain rounding stays within
+    +-0.5 with RMS sqrt(1/12); TPDF dither within +-1.5 with RMS 0.5.
+    Also checks the int24 byte packing and that exports are reproducible.
+    """
+    signal = np.random.default_rng(seed).uniform(-0.99, 0.99, n_samples)
+    for fmt, bits in (("int16", 16), ("int24", 24)):
+        lsb = 1.0 / (2 ** (bits - 1) - 1)
+        for dither, limit, rms_expected in ((False, 0.5, np.sqrt(1 / 12)), (True, 1.5, 0.5)):
+            codes = quantize(signal, bits, dither, np.random.default_rng(seed))
+            error = codes - signal / lsb
+            rms = np.sqrt(np.mean(error ** 2))
+            assert np.max(np.abs(error)) <= limit + 1e-6, f"{fmt} dither={dither}: error beyond {limit} LSB"
+            assert abs(np.mean(error)) < 0.01, f"{fmt} dither={dither}: biased rounding"
+            assert abs(rms - rms_expected) < 0.01, f"{fmt} dither={dither}: RMS {rms:.3f} LSB"
+            print(f"   [{fmt}, dither={dither}] max {np.max(np.abs(error)):.3f} LSB, RMS {rms:.3f} LSB")
+
+            # Same input + same seed -> same bytes
+            frames = encode_frames(signal, fmt, dither, np.random.default_rng(seed))
+            assert frames == encode_frames(signal, fmt, dither, np.random.default_rng(seed))
+
+    # int24 frames decode back to the quantized codes
+    raw = np.frombuffer(encode_frames(signal, "int24"), dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+    decoded = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+    decoded = np.where(decoded >= 1 << 23, decoded - (1 << 24), decoded)
+    assert np.array_equal(decoded, quantize(signal, 24)), "int24 packing"
+    print("[CHECK OK] int16/int24 quantization within bounds, exports reproducible.")
+
+if __name__ == "__main__":
+    check_quantization()
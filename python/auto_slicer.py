@@ -1,35 +1,305 @@
 from pydub import AudioSegment
 from pydub.silence import split_on_silence
+import numpy as np
+import subprocess
+import sys
 import os
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
-INPUT_AUDIO = "dataset/harvard_audio_direct/extracted_audio.mp3" 
+INPUT_AUDIO = "dataset/harvard_audio_direct/extracted_audio.mp3"
 OUTPUT_DIR = "dataset/processed_tracks"
 
+# Slicing parameters (same meaning as pydub's split_on_silence)
+MIN_SILENCE_LEN = 2000   # ms: must be silent for 2 seconds
+SILENCE_THRESH = -32     # dBFS: adjust if tape hiss is loud
+KEEP_SILENCE = 100       # ms of silence kept on each side of a track
+MIN_TRACK_LEN = 30000    # ms: shorter chunks are noise, not songs
+
+# Streaming decoder
+SAMPLE_RATE = 44100
+CHANNELS = 2
+FRAME_MS = 10            # RMS resolution of the silence detector
+BLOCK_SECONDS = 10       # audio decoded per read
+
+# Export stage
+EXPORT_FORMAT = "mp3"    # "mp3", or lossless "wav" (no encoding at all) / "flac"
+EXPORT_WORKERS = os.cpu_count()
+EXPORT_FORMATS = ("mp3", "wav", "flac")
+
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def slice_audio():
+def decode_blocks(path, sr=SAMPLE_RATE, channels=CHANNELS, block_seconds=BLOCK_SECONDS):
+    """
+    Decodes any file ffmpeg can read into int16 blocks of shape (n, channels),
+    through a pipe, so the tape is never fully in memory.
+    """
+    cmd = [AudioSegment.converter, "-v", "error", "-i", path,
+           "-f", "s16le", "-ac", str(channels), "-ar", str(sr), "-"]
+    frame_bytes = 2 * channels
+    block_bytes = int(block_seconds * sr) * frame_bytes
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            data = data[:len(data) - len(data) % frame_bytes]
+            yield np.frombuffer(data, dtype="<i2").reshape(-1, channels)
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path} (exit code {proc.returncode})")
+
+class StreamingSlicer:
+    """
+    split_on_silence() over a stream of blocks.
+    A window of min_silence_len is silent when its RMS is below silence_thresh
+    (dBFS, like pydub); every frame inside a silent window is silence and the
+    rest is music. pydub slides the window by 1 ms, this slides it by one
+    FRAME_MS frame, using per-frame mean squares and a cumulative sum.
+
+    Windows reach min_silence_len into the future, so a frame's label is only
+    final once the window starting at it has been seen; tracks are returned
+    from feed() as soon as the silence after them is confirmed. Only the open
+    track plus one window of audio is buffered, in a growable array that is
+    appended to in place (amortized O(1) per sample, however long the track).
+    """
+    def __init__(self, sr=SAMPLE_RATE, min_silence_len=MIN_SILENCE_LEN, silence_thresh=SILENCE_THRESH,
+                 keep_silence=KEEP_SILENCE, frame_ms=FRAME_MS):
+        self.sr = sr
+        self.frame_len = int(sr * frame_ms / 1000)
+        self.win = max(1, int(round(min_silence_len / frame_ms)))
+        self.keep = int(sr * keep_silence / 1000)
+        # dBFS threshold as a mean square of int16 samples
+        self.thresh_ms = (2 ** 15) ** 2 * 10 ** (silence_thresh / 10)
+
+        self.buffer = None         # buffer[head:tail] holds the samples from audio_start on
+        self.head = 0
+        self.tail = 0
+        self.audio_start = 0
+        self.n_samples = 0
+        self.energy = np.zeros(0)  # frame mean squares, starting at frame energy_start
+        self.energy_start = 0
+        self.n_frames = 0          # complete frames seen
+        self.last_silent = -self.win  # start of the latest silent window
+        self.finalized = 0         # frames before this have a final label
+        self.prev_silent = True    # label of frame finalized - 1 (audio starts "after silence")
+        self.track_start = None    # first frame of the open track
+        self.n_tracks = 0
+
+    @property
+    def audio(self):
+        return None if self.buffer is None else self.buffer[self.head:self.tail]
+
+    def _append(self, block):
+        n = len(block)
+        if self.buffer is None:
+            self.buffer = np.empty((max(2 * n, 1),) + block.shape[1:], dtype=block.dtype)
+        elif self.tail + n > len(self.buffer):
+            live = self.tail - self.head
+            if live + n > len(self.buffer) // 2:
+                # Double, so the next copy is at least as many samples away
+                grown = np.empty((2 * (live + n),) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+                grown[:live] = self.buffer[self.head:self.tail]
+                self.buffer = grown
+            else:
+                # Plenty of room once the trimmed samples are reclaimed
+                self.buffer[:live] = self.buffer[self.head:self.tail]
+            self.head, self.tail = 0, live
+        self.buffer[self.tail:self.tail + n] = block
+        self.tail += n
+
+    def feed(self, block):
+        """Adds one (n, channels) int16 block; returns the tracks it completed."""
+        self._append(block)
+        self.n_samples += len(block)
+
+        new_frames = self.n_samples // self.frame_len - self.n_frames
+        if new_frames > 0:
+            first = self.n_frames * self.frame_len - self.audio_start
+            frames = self.audio[first:first + new_frames * self.frame_len].astype(np.float64)
+            ms = np.mean(frames.reshape(new_frames, -1) ** 2, axis=1)
+            self.energy = np.concatenate([self.energy, ms])
+            self.n_frames += new_frames
+
+        # Evaluate every window that is now complete
+        last_start = self.n_frames - self.win
+        if last_start < self.finalized:
+            return []
+        cumulative = np.concatenate([[0.0], np.cumsum(self.energy)])
+        starts = np.arange(self.finalized, last_start + 1)
+        rel = starts - self.energy_start
+        window_ms = (cumulative[rel + self.win] - cumulative[rel]) / self.win
+        silent_starts = starts[window_ms < self.thresh_ms]
+
+        tracks = self._label(starts, silent_starts)
+        self.energy = self.energy[last_start + 1 - self.energy_start:]
+        self.energy_start = last_start + 1
+        self._trim()
+        return tracks
+
+    def flush(self):
+        """End of stream: labels the remaining frames and closes the last track."""
+        if self.audio is None:
+            return []
+        # The trailing partial frame counts as one more frame
+        end_frame = -(-self.n_samples // self.frame_len)
+        tracks = self._label(np.arange(self.finalized, end_frame), np.zeros(0, dtype=np.intp))
+        if self.track_start is not None:
+            tracks.append(self._cut(self.track_start * self.frame_len, self.n_samples))
+            self.track_start = None
+        self.buffer = None
+        return tracks
+
+    def _label(self, frames, silent_starts):
+        """Finalizes 'frames' (consecutive) and opens/closes tracks at label changes."""
+        if len(frames) == 0:
+            return []
+        # A frame is silent if the latest silent window starting at or before it still covers it
+        starts = np.concatenate([[self.last_silent], silent_starts])
+        covering = starts[np.searchsorted(starts, frames, side="right") - 1]
+        silent = frames - covering < self.win
+        if len(silent_starts):
+            self.last_silent = silent_starts[-1]
+
+        tracks = []
+        changes = np.flatnonzero(silent != np.concatenate([[self.prev_silent], silent[:-1]]))
+        for i in changes:
+            frame = frames[i]
+            if silent[i]:
+                tracks.append(self._cut(self.track_start * self.frame_len,
+                                        min(frame * self.frame_len, self.n_samples)))
+                self.track_start = None
+            else:
+                self.track_start = frame
+
+        self.prev_silent = silent[-1]
+        self.finalized = frames[-1] + 1
+        return tracks
+
+    def _cut(self, start, end):
+        """(track number, start seconds, samples) with keep_silence on both sides."""
+        self.n_tracks += 1
+        start = max(0, start - self.keep)
+        end = min(self.n_samples, end + self.keep)
+        samples = self.audio[start - self.audio_start:end - self.audio_start].copy()
+        return self.n_tracks, start / self.sr, samples
+
+    def _trim(self):
+        # Keep what a track (open, or starting at the next unlabeled frame) may still need
+        first_needed = self.track_start if self.track_start is not None else self.finalized
+        drop = max(0, first_needed * self.frame_len - self.keep - self.audio_start)
+        if drop:
+            self.head += drop
+            self.audio_start += drop
+
+def stream_tracks(path, sr=SAMPLE_RATE, channels=CHANNELS, **slicer_args):
+    """Yields (track number, start seconds, int16 samples) as each track closes."""
+    slicer = StreamingSlicer(sr, **slicer_args)
+    for block in decode_blocks(path, sr, channels):
+        yield from slicer.feed(block)
+    yield from slicer.flush()
+
+def export_track(samples, out_file, sr=SAMPLE_RATE, fmt="mp3"):
+    """
+    Writes one track and returns (out_file, seconds spent).
+    WAV is the decoded PCM written as-is; mp3/flac go through ffmpeg.
+    """
+    start = time.perf_counter()
+    if fmt == "wav":
+        with wave.open(out_file, "wb") as wav:
+            wav.setnchannels(samples.shape[1])
+            wav.setsampwidth(2)
+            wav.setframerate(sr)
+            wav.writeframes(samples.astype("<i2", copy=False).tobytes())
+    elif fmt in EXPORT_FORMATS:
+        segment = AudioSegment(samples.tobytes(), frame_rate=sr, sample_width=2, channels=samples.shape[1])
+        segment.export(out_file, format=fmt)
+    else:
+        raise ValueError(f"Unknown export format '{fmt}'. Use one of {list(EXPORT_FORMATS)}")
+    return out_file, time.perf_counter() - start
+
+def slice_audio(input_audio=INPUT_AUDIO, output_dir=OUTPUT_DIR, fmt=EXPORT_FORMAT, workers=EXPORT_WORKERS):
+    """
+    Streaming version: decodes the tape block by block and hands each track to
+    an export pool as soon as the silence after it is confirmed, so slicing and
+    encoding overlap. Encoding runs in ffmpeg processes, so threads are enough
+    to keep 'workers' encoders busy. At most 2 * workers tracks are in flight;
+    memory stays bounded by a few tracks, not the whole tape.
+    """
+    print(f"Streaming {input_audio} -> {fmt} on {workers} export workers...")
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    min_samples = MIN_TRACK_LEN * SAMPLE_RATE // 1000
+    n_found = 0
+    exported = []
+    failed = []
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            out_file = pending.pop(future)
+            try:
+                _, seconds = future.result()
+                print(f"   [DONE] {out_file} ({seconds:.1f}s)")
+                exported.append(out_file)
+            except Exception as e:
+                print(f"   [ERROR] {out_file}: {e}")
+                failed.append(out_file)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for number, start_sec, samples in stream_tracks(input_audio):
+            n_found += 1
+            # Filter out tiny chunks (noise) less than 30 seconds
+            if len(samples) < min_samples:
+                continue
+
+            out_file = os.path.join(output_dir, f"track_{number}.{fmt}")
+            print(f"Exporting {out_file} ({start_sec / 60:.1f} min in, {len(samples) / SAMPLE_RATE:.0f}s)...")
+            pending[pool.submit(export_track, samples, out_file, SAMPLE_RATE, fmt)] = out_file
+
+            # Backpressure: the slicer waits while the encoders are saturated
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        collect(wait(pending)[0])
+
+    print(f"Found {n_found} potential tracks, exported {len(exported)} "
+          f"({len(failed)} failed) in {time.perf_counter() - started:.1f}s.")
+    return exported
+
+def slice_audio_in_memory():
+    """Original pydub version: decodes the whole tape and scans it at 1 ms steps."""
     print(f"Loading {INPUT_AUDIO} (this might take a moment)...")
     sound = AudioSegment.from_mp3(INPUT_AUDIO)
-    
+
     print("Detecting songs based on silence...")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     # Adjust min_silence_len (ms) and silence_thresh (dB) based on the recording noise
     chunks = split_on_silence(
-        sound, 
-        min_silence_len=2000, # Must be silent for 2 seconds
-        silence_thresh=-32    # Silence threshold (adjust if tape hiss is loud)
+        sound,
+        min_silence_len=MIN_SILENCE_LEN,
+        silence_thresh=SILENCE_THRESH,
+        keep_silence=KEEP_SILENCE
     )
 
     print(f"Found {len(chunks)} potential tracks.")
 
     for i, chunk in enumerate(chunks):
         # Filter out tiny chunks (noise) less than 30 seconds
-        if len(chunk) < 30000:
+        if len(chunk) < MIN_TRACK_LEN:
             continue
-            
+
         out_file = os.path.join(OUTPUT_DIR, f"track_{i+1}.mp3")
         print(f"Exporting {out_file}...")
         chunk.export(out_file, format="mp3")
 
 if __name__ == "__main__":
-    slice_audio()
\ No newline at end of file
+    if "--in-memory" in sys.argv:
+        slice_audio_in_memory()
+    else:
+        fmt = next((f for f in EXPORT_FORMATS if f"--{f}" in sys.argv), EXPORT_FORMAT)
+        args = [a for a in sys.argv[1:] if not a.startswith("--")]
+        slice_audio(fmt=fmt, workers=int(args[0]) if args else EXPORT_WORKERS)
@@ -0,0 +1,341 @@
+import hashlib
+import sqlite3
+import time
+import csv
+import os
+import re
+import sys
+
+# ==============================================================================
+# CATALOG STORE (INDEXED, SQLITE)
+# One-time ingest of the Harvard finding-aid export (harvard_somali_data.csv)
+# into a local database: IDs, titles, dates, series, plus full-text search.
+# Re-ingesting only touches rows whose content changed, and the download
+# status lives next to the catalog, so "what is left to fetch" is one query.
+# ==============================================================================
+
+CATALOG_FILE = "harvard_somali_data.csv"
+CATALOG_DB = "dataset/catalog.sqlite"
+HEADER_START = "Database Number"   # the export has collection metadata above the header
+ID_PATTERN = re.compile(r"(mus\d+c\d+)_")
+
+# CSV header -> column name
+COLUMNS = {
+    "Database Number": "id",
+    "Component Title": "title",
+    "Component Date": "date",
+    "Start Year": "start_year",
+    "End Year": "end_year",
+    "Component identifier": "identifier",
+    "Container info": "container",
+    "Component type": "type",
+    "Component creator": "creator",
+    "Digital content link": "link",
+    "Access Note": "access_note",
+    "Physical description": "physical",
+    "Level 1": "series",
+    "Level 2": "parent"
+}
+# Free-text columns indexed for search
+SEARCH_COLUMNS = ("title", "creator", "container", "access_note", "physical", "parent")
+
+def safe_title(title, limit=40):
+    """Filesystem-safe short title, as used in the downloaded file names."""
+    cleaned = re.sub(r"[^\w\s-]", "", title or "")[:limit].strip().replace(" ", "_")
+    return cleaned or "Audio_Track"
+
+def read_export(path=CATALOG_FILE):
+    """
+    Parses the finding-aid export: returns (collection metadata dict, rows).
+    Each row is a dict keyed by the COLUMNS names, in file order.
+    """
+    with open(path, "r", encoding="utf-8", errors="ignore", newline="") as f:
+        reader = csv.reader(f)
+        collection = {}
+        for line in reader:
+            if line and line[0] == HEADER_START:
+                header = [COLUMNS.get(name.strip()) for name in line]
+                break
+            if len(line) >= 2:
+                collection[line[0]] = line[1]
+        else:
+            raise ValueError(f"{path}: no '{HEADER_START}' header row")
+
+        rows = []
+        for line in reader:
+            if not line or not line[0].strip():
+                continue
+            # Trailing cells beyond the header (stray commas) are dropped
+            row = {name: value.strip() for name, value in zip(header, line) if name}
+            rows.append(row)
+    return collection, rows
+
+def row_hash(row):
+    return hashlib.sha1("\x1f".join(row.get(name, "") for name in COLUMNS.values()).encode()).hexdigest()
+
+class CatalogStore:
+    """
+    items:     one row per catalog component, indexed by series / parent / type
+    items_fts: FTS5 index over the free-text columns
+    downloads: which components already have an audio file on disk
+    meta:      hash of the last ingested export, collection metadata
+    """
+    def __init__(self, path=CATALOG_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f"{name} TEXT" for name in COLUMNS.values() if name != "id")
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS items (
+                id TEXT PRIMARY KEY,
+                {columns},
+                position INTEGER NOT NULL,
+                row_hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS items_series ON items (series, position);
+            CREATE INDEX IF NOT EXISTS items_parent ON items (parent, position);
+            CREATE INDEX IF NOT EXISTS items_type ON items (type);
+            CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5 (
+                id UNINDEXED, {", ".join(SEARCH_COLUMNS)}
+            );
+            CREATE TABLE IF NOT EXISTS downloads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                downloaded_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );""")
+        self.db.commit()
+
+    # --- Ingest ---
+
+    def ingest(self, csv_path=CATALOG_FILE, force=False):
+        """
+        Loads the export into the store. Unchanged exports are skipped by file
+        hash; otherwise only new, changed and removed rows are written.
+        Returns {"added", "updated", "removed", "unchanged"} counts.
+        """
+        with open(csv_path, "rb") as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+        counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        if not force and self._meta("file_hash") == file_hash:
+            counts["unchanged"] = self.count()
+            return counts
+
+        collection, rows = read_export(csv_path)
+        known = dict(self.db.execute("SELECT id, row_hash FROM items"))
+        names = list(COLUMNS.values())
+        seen = set()
+
+        with self.db:
+            for position, row in enumerate(rows):
+                item_id = row["id"]
+                if item_id in seen:
+                    continue # duplicated row in the export: first one wins
+                seen.add(item_id)
+                digest = row_hash(row)
+                old = known.get(item_id)
+                if old == digest:
+                    # Content unchanged, but keep the file order up to date
+                    self.db.execute("UPDATE items SET position = ? WHERE id = ?", (position, item_id))
+                    counts["unchanged"] += 1
+                    continue
+
+                values = [row.get(name, "") for name in names]
+                self.db.execute(
+                    f"INSERT OR REPLACE INTO items ({', '.join(names)}, position, row_hash) "
+                    f"VALUES ({', '.join('?' * len(names))}, ?, ?)",
+                    values + [position, digest])
+                self.db.execute("DELETE FROM items_fts WHERE id = ?", (item_id,))
+                self.db.execute(
+                    f"INSERT INTO items_fts (id, {', '.join(SEARCH_COLUMNS)}) "
+                    f"VALUES (?, {', '.join('?' * len(SEARCH_COLUMNS))})",
+                    [item_id] + [row.get(name, "") for name in SEARCH_COLUMNS])
+                counts["added" if old is None else "updated"] += 1
+
+            for item_id in set(known) - seen:
+                self.db.execute("DELETE FROM items WHERE id = ?", (item_id,))
+                self.db.execute("DELETE FROM items_fts WHERE id = ?", (item_id,))
+                counts["removed"] += 1
+
+            for key, value in collection.items():
+                self._set_meta(f"collection:{key}", value)
+            self._set_meta("file_hash", file_hash)
+            self._set_meta("ingested_at", str(time.time()))
+        return counts
+
+    def _meta(self, key):
+        found = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return found[0] if found else None
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    # --- Queries ---
+
+    def _select(self, where="", params=(), join=""):
+        cursor = self.db.execute(
+            f"SELECT items.* FROM items {join} {where} ORDER BY items.position", params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, found)) for found in cursor]
+
+    def get(self, item_id):
+        found = self._select("WHERE items.id = ?", (item_id,))
+        return found[0] if found else None
+
+    def items(self, series=None, parent=None, item_type=None):
+        """Components in file order, optionally filtered by series (Level 1), parent (Level 2) and type."""
+        clauses, params = self._filters(series, parent, item_type)
+        return self._select(f"WHERE {' AND '.join(clauses)}" if clauses else "", params)
+
+    def pending(self, series=None, parent=None, item_type=None):
+        """Like items(), but only components with no downloaded audio yet."""
+        clauses, params = self._filters(series, parent, item_type)
+        clauses.append("downloads.id IS NULL")
+        return self._select(f"WHERE {' AND '.join(clauses)}", params,
+                            join="LEFT JOIN downloads ON downloads.id = items.id")
+
+    @staticmethod
+    def _filters(series, parent, item_type):
+        clauses, params = [], []
+        for column, value in (("series", series), ("parent", parent), ("type", item_type)):
+            if value is not None:
+                clauses.append(f"items.{column} = ?")
+                params.append(value)
+        return clauses, params
+
+    def search(self, text, limit=50):
+        """Full-text search (FTS5 query syntax) over titles, creators and descriptions, best match first."""
+        cursor = self.db.execute(
+            "SELECT id FROM items_fts WHERE items_fts MATCH ? ORDER BY rank LIMIT ?", (text, limit))
+        return [self.get(item_id) for (item_id,) in cursor.fetchall()]
+
+    def series(self):
+        """(series, item count) pairs."""
+        return self.db.execute(
+            "SELECT series, COUNT(*) FROM items WHERE series != '' GROUP BY series ORDER BY MIN(position)"
+        ).fetchall()
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    # --- Download status ---
+
+    def mark_downloaded(self, item_id, filename):
+        self.db.execute("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?)",
+                        (item_id, filename, time.time()))
+        self.db.commit()
+
+    def sync_downloads(self, output_dir):
+        """
+        Matches the '<id>_<title>.<ext>' files in output_dir to the catalog:
+        new files are recorded, records whose file is gone are dropped.
+        Returns the number of downloaded components.
+        """
+        on_disk = {}
+        if os.path.isdir(output_dir):
+            for name in os.listdir(output_dir):
+                match = ID_PATTERN.match(name)
+                if match and not name.endswith(".part"):
+                    on_disk[match.group(1)] = os.path.join(output_dir, name)
+
+        with self.db:
+            recorded = dict(self.db.execute("SELECT id, filename FROM downloads"))
+            for item_id, filename in recorded.items():
+                if os.path.dirname(filename) == output_dir and item_id not in on_disk:
+                    self.db.execute("DELETE FROM downloads WHERE id = ?", (item_id,))
+            now = time.time()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?)",
+                [(item_id, filename, now) for item_id, filename in on_disk.items()
+                 if recorded.get(item_id) != filename])
+        return self.db.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def stats(self):
+        downloaded = self.db.execute(
+            "SELECT COUNT(*) FROM downloads JOIN items ON items.id = downloads.id").fetchone()[0]
+        return {
+            "items": self.count(),
+            "series": len(self.series()),
+            "downloaded": downloaded
+        }
+
+    def __repr__(self):
+        s = self.stats()
+        return (f"CatalogStore({self.path}, items={s['items']}, series={s['series']}, "
+                f"downloaded={s['downloaded']})")
+
+# --- BENCHMARK: rescanning the CSV vs. the indexed store ---
+
+def benchmark(csv_path=CATALOG_FILE, repeats=200):
+    """Times the old per-lookup regex scan of the raw CSV against indexed queries."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CatalogStore(os.path.join(tmp, "catalog.sqlite"))
+        start = time.perf_counter()
+        counts = store.ingest(csv_path)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        store.ingest(csv_path)
+        again = time.perf_counter() - start
+        start = time.perf_counter()
+        store.ingest(csv_path, force=True)
+        forced = time.perf_counter() - start
+
+        ids = [item["id"] for item in store.items()]
+        targets = [ids[i * len(ids) // repeats] for i in range(repeats)]
+
+        def scan(item_id):
+            with open(csv_path, "r", encoding="utf-8", errors="ignore") as f:
+                for line in f:
+                    match = re.search(r"(mus00044c\d+)", line)
+                    if match and match.group(1) == item_id:
+                        return line
+
+        start = time.perf_counter()
+        for item_id in targets:
+            scan(item_id)
+        scan_s = (time.perf_counter() - start) / repeats
+        start = time.perf_counter()
+        for item_id in targets:
+            store.get(item_id)
+        get_s = (time.perf_counter() - start) / repeats
+
+        series = store.series()[0][0]
+        start = time.perf_counter()
+        for _ in range(repeats):
+            pending = store.pending(series=series)
+        pending_s = (time.perf_counter() - start) / repeats
+        store.close()
+
+    print(f"Ingest: {sum(counts.values())} rows in {first * 1e3:.1f}ms, "
+          f"unchanged re-ingest {again * 1e3:.2f}ms, forced row-diff {forced * 1e3:.1f}ms")
+    print(f"Lookup by ID: CSV scan {scan_s * 1e3:.2f}ms, indexed {get_s * 1e6:.0f}us "
+          f"({scan_s / get_s:.0f}x)")
+    print(f"Pending in series '{series}': {len(pending)} items in {pending_s * 1e3:.2f}ms")
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark()
+        sys.exit(0)
+
+    store = CatalogStore()
+    counts = store.ingest(force="--force" in sys.argv)
+    print(f"Ingested {CATALOG_FILE}: {counts['added']} added, {counts['updated']} updated, "
+          f"{counts['removed']} removed, {counts['unchanged']} unchanged.")
+    print(store)
+    for name, n in store.series():
+        print(f"   {name}: {n} items")
+
+    if "--search" in sys.argv:
+        text = sys.argv[sys.argv.index("--search") + 1]
+        for item in store.search(text):
+            print(f"   {item['id']} | {item['title']} ({item['parent'] or item['series']})")
+    store.close()
@@ -1,6 +1,9 @@
 import numpy as np
-from scipy.io import wavfile
 import random
+import sys
+import time
+from pluck_cache import PluckCache
+from audio_io import write_wav
 
 # ==============================================================================
 # PROJECT: PROCEDURAL OUD ENGINE (PHYSICS-BASED MODELING)
@@ -13,29 +16,70 @@ class OudSynthesizer:
     A Karplus-Strong physical model implementation using only NumPy.
     Simulates the physics of a plucked string instrument (Somali Oud).
     """
-    def __init__(self, sample_rate=44100):
+    ENGINES = ("loop", "block")
+
+    def __init__(self, sample_rate=44100, engine="block", cache=None, seed=None, dtype=np.float64):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine '{engine}'. Use one of {self.ENGINES}")
         self.sr = sample_rate
         self.decay_factor = 0.996  # High decay = metallic/string sound
+        self.engine = engine
+        # Optional PluckCache: each distinct (freq, duration) is plucked once
+        self.cache = cache
+        # Excitation noise source (global NumPy RNG unless a seed is given)
+        self.seed = seed
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        # Sample dtype of every rendered buffer (float32 halves memory)
+        self.dtype = np.dtype(dtype)
         
     def generate_string_pluck(self, freq, duration_sec):
         """
         Simulates a string pluck using a ring buffer (Delay Line).
         P = SampleRate / Frequency
+        Dispatches to the per-sample 'loop' engine or the NumPy 'block' engine.
+        """
+        if self.cache is not None:
+            key = self._cache_key(freq, duration_sec)
+            return self.cache.get_or_render(key, lambda: self._render_pluck(freq, duration_sec))
+        return self._render_pluck(freq, duration_sec)
+
+    def _cache_key(self, freq, duration_sec):
+        return (self.dtype.name,) + self.cache.make_key(freq, duration_sec, 1.0, self.seed)
+
+    def delay_length(self, freq):
+        """
+        Delay line length N = int(SampleRate / Frequency).
+        Needs N >= 2: above Nyquist (sr / 2) the ring buffer would be a
+        single sample whose 'next' sample is itself.
+        """
+        N = int(self.sr / freq)
+        if N < 2:
+            raise ValueError(f"Frequency {freq} Hz is above Nyquist ({self.sr / 2} Hz)")
+        return N
+
+    def _render_pluck(self, freq, duration_sec):
+        if self.engine == "block":
+            return self._pluck_block(freq, duration_sec)
+        return self._pluck_loop(freq, duration_sec)
+
+    def _pluck_loop(self, freq, duration_sec):
+        """
+        Reference engine: one Python iteration per output sample.
         """
         if freq == 0: # Rest
-            return np.zeros(int(self.sr * duration_sec))
+            return np.zeros(int(self.sr * duration_sec), dtype=self.dtype)
 
         # 1. Calculate Delay Line Length (The Physics of Pitch)
-        N = int(self.sr / freq)
+        N = self.delay_length(freq)
         
         # 2. Excitation (The Pluck)
         # Initialize ring buffer with white noise (energy burst)
-        ring_buffer = np.random.uniform(-1, 1, N)
+        ring_buffer = self.rng.uniform(-1, 1, N).astype(self.dtype, copy=False)
         
         # 3. Simulation Loop (Karplus-Strong Algorithm)
         # Output length
         n_samples = int(self.sr * duration_sec)
-        output = np.zeros(n_samples)
+        output = np.zeros(n_samples, dtype=self.dtype)
         
         # Pointer for ring buffer
         ptr = 0
@@ -58,15 +102,186 @@ class OudSynthesizer:
             
         return output
 
+    def _pluck_block(self, freq, duration_sec):
+        """
+        Block engine: computes one full period (N samples) per NumPy step.
+        The ring buffer loop is equivalent to the recursion
+            y[n] = 0.5 * (y[n-N] + y[n-N+1]) * decay
+        so each period only depends on the previous one, except the last
+        sample which also needs the first sample of the current period.
+        Same operations in the same order -> bit-identical to '_pluck_loop'
+        for the same RNG state.
+        """
+        if freq == 0: # Rest
+            return np.zeros(int(self.sr * duration_sec), dtype=self.dtype)
+
+        N = self.delay_length(freq)
+        ring_buffer = self.rng.uniform(-1, 1, N).astype(self.dtype, copy=False)
+
+        n_samples = int(self.sr * duration_sec)
+        return self._ks_block(ring_buffer[np.newaxis, :], n_samples)[0]
+
+    def _ks_block(self, seeds, n_samples):
+        """
+        Runs the block recursion for several strings sharing one delay length.
+        seeds: (n_strings, N) initial ring buffers, N >= 2 (see delay_length).
+        Returns (n_strings, n_samples).
+        """
+        N = seeds.shape[1]
+        if N < 2:
+            raise ValueError(f"Delay line of {N} sample(s): frequency above Nyquist")
+        n_periods = max(1, -(-n_samples // N)) # ceil, keep room for the seed
+        output = np.empty((seeds.shape[0], n_periods * N), dtype=self.dtype)
+        output[:, :N] = seeds
+
+        for k in range(1, n_periods):
+            prev = output[:, (k - 1) * N:k * N]
+            curr = output[:, k * N:(k + 1) * N]
+            curr[:, :-1] = 0.5 * (prev[:, :-1] + prev[:, 1:]) * self.decay_factor
+            curr[:, -1] = 0.5 * (prev[:, -1] + curr[:, 0]) * self.decay_factor
+
+        return output[:, :n_samples]
+
+    def render_batch(self, freqs, durations, onsets):
+        """
+        Renders many plucks into one preallocated buffer.
+        freqs (Hz), durations (sec) and onsets (sec) are parallel sequences.
+        - Overlapping notes are summed (plucks keep ringing under the next note).
+        - Rests (freq 0) cost nothing.
+        - Notes with the same delay line length are synthesized together,
+          one row each, in a single block recursion.
+        Noise is drawn in note order, so the output matches calling
+        generate_string_pluck note by note with the same RNG state.
+        With a cache attached, each distinct (freq, duration) is looked up
+        once; only the misses are synthesized, still grouped by delay length
+        (repeats inside one batch therefore do not show up as cache hits).
+        """
+        freqs = np.asarray(freqs, dtype=float)
+        durations = np.broadcast_to(np.asarray(durations, dtype=float), freqs.shape)
+        onsets = np.broadcast_to(np.asarray(onsets, dtype=float), freqs.shape)
+
+        lengths = (self.sr * durations).astype(int)
+        starts = np.round(onsets * self.sr).astype(int)
+        total = int(np.max(starts + lengths)) if len(freqs) else 0
+        output = np.zeros(total, dtype=self.dtype)
+
+        voiced = np.flatnonzero(freqs != 0)
+        if len(voiced) == 0:
+            return output
+
+        if self.cache is None:
+            for g, pluck in self._pluck_groups(freqs[voiced], lengths[voiced]):
+                note = voiced[g]
+                output[starts[note]:starts[note] + lengths[note]] += pluck
+            return output
+
+        # Distinct notes in order of first appearance -> every note using them
+        notes_by_key = {}
+        for note in voiced:
+            notes_by_key.setdefault(self._cache_key(freqs[note], durations[note]), []).append(note)
+
+        waves = {}
+        misses = []
+        for key, notes in notes_by_key.items():
+            waves[key] = self.cache.get(key)
+            if waves[key] is None:
+                misses.append(key)
+
+        # Render all misses together, then hand each one to the cache
+        first = np.array([notes_by_key[key][0] for key in misses], dtype=int)
+        if len(first):
+            for m, pluck in self._pluck_groups(freqs[first], lengths[first]):
+                waves[misses[m]] = self.cache.put(misses[m], pluck.copy())
+
+        for key, notes in notes_by_key.items():
+            for note in notes:
+                output[starts[note]:starts[note] + lengths[note]] += waves[key]
+        return output
+
+    def _pluck_groups(self, freqs, lengths):
+        """
+        Plucks several voiced notes, yielding (index, samples) per note.
+        Notes with the same delay line length share one block recursion.
+        """
+        # One RNG call for every excitation, split back per note
+        delays = (self.sr / freqs).astype(int)
+        if delays.min() < 2:
+            raise ValueError(f"Frequency {freqs.max()} Hz is above Nyquist ({self.sr / 2} Hz)")
+        noise = self.rng.uniform(-1, 1, int(delays.sum())).astype(self.dtype, copy=False)
+        offsets = np.concatenate(([0], np.cumsum(delays)))
+
+        for N in np.unique(delays):
+            group = np.flatnonzero(delays == N)
+            seeds = np.stack([noise[offsets[g]:offsets[g] + N] for g in group])
+            plucks = self._ks_block(seeds, int(lengths[group].max()))
+
+            for row, g in enumerate(group):
+                yield g, plucks[row, :lengths[g]]
+
+class KarplusStrongVoice:
+    """
+    One sounding string for live playback. Keeps the next N samples of the
+    delay line as state, so it can be rendered a few samples at a time and
+    still match the offline pluck sample for sample.
+    """
+    def __init__(self, synth, freq, n_samples):
+        self.synth = synth
+        N = synth.delay_length(freq)
+        self.state = synth.rng.uniform(-1, 1, N).astype(synth.dtype, copy=False)
+        self.remaining = n_samples
+
+    @property
+    def finished(self):
+        return self.remaining <= 0
+
+    def render(self, n):
+        """Returns up to n samples (fewer when the note ends)."""
+        m = min(n, self.remaining)
+        N = len(self.state)
+        extended = self.synth._ks_block(self.state[np.newaxis, :], m + N)[0]
+        self.state = extended[m:].copy()
+        self.remaining -= m
+        return extended[:m]
+
 class DhaantoSequencer:
     """
     Custom sequencer handling the 'Camel Gait' (Galloping Swing).
     Unlike Western 4/4 quantization, this applies a micro-timing offset.
     """
-    def __init__(self, synth, bpm=110):
+    # Pentatonic Scale (Approximating Oud Maqam)
+    # Root, b2 (approx), 4, 5, b7
+    SCALE_FREQS = {
+        0: 0,       # Rest
+        1: 146.83,  # D3 (Root)
+        2: 174.61,  # F3 (Minor 3rd)
+        3: 196.00,  # G3 (4th)
+        4: 220.00,  # A3 (5th)
+        5: 261.63,  # C4 (Minor 7th)
+        6: 293.66   # D4 (Octave)
+    }
+
+    def __init__(self, synth, bpm=110, swing_ratio=0.60):
         self.synth = synth
         self.bpm = bpm
-        self.beat_dur = 60 / bpm
+        self.swing_ratio = swing_ratio # The "Gallop" Step share of each beat
+        self.sustain = 1.0 # Live mode: note length in steps (> 1 lets plucks ring over)
+        # Live playback state (see start_live)
+        self.pattern = []
+        self.max_voices = 4
+        self.frame_budget = None
+        self.step = 0
+        self.samples_to_next_step = 0
+        self.voices = []
+        self.stats = {"frames": 0, "notes": 0, "voices_dropped": 0, "budget_overruns": 0}
+
+    @property
+    def beat_dur(self):
+        # Derived, so changing bpm mid-performance takes effect on the next note
+        return 60 / self.bpm
+
+    @beat_dur.setter
+    def beat_dur(self, seconds):
+        self.bpm = 60 / seconds
         
     def apply_somali_swing(self, note_type, note_index):
         """
@@ -79,10 +294,10 @@ class DhaantoSequencer:
         elif note_type == "eighth":
             # If it's the DOWN beat (1, 2, 3, 4) -> Longer
             if note_index % 2 == 0:
-                swing_ratio = 0.60 # The "Gallop" Step
+                swing_ratio = self.swing_ratio # The "Gallop" Step
             # If it's the UP beat (The 'and') -> Shorter
             else:
-                swing_ratio = 0.40 # The Catch Step
+                swing_ratio = 1 - self.swing_ratio # The Catch Step
                 
             return self.beat_dur * swing_ratio * 2 # *2 because beat_dur is quarter
 
@@ -90,36 +305,193 @@ class DhaantoSequencer:
         """
         Renders a sequence of notes using the scale and swing logic.
         """
-        # Pentatonic Scale (Approximating Oud Maqam)
-        # Root, b2 (approx), 4, 5, b7
-        freqs = {
-            0: 0,       # Rest
-            1: 146.83,  # D3 (Root)
-            2: 174.61,  # F3 (Minor 3rd)
-            3: 196.00,  # G3 (4th)
-            4: 220.00,  # A3 (5th)
-            5: 261.63,  # C4 (Minor 7th)
-            6: 293.66   # D4 (Octave)
-        }
+        freqs = self.SCALE_FREQS
         
-        audio_buffer = []
-        
-        for idx, scale_degree in enumerate(melody_indices):
-            freq = freqs.get(scale_degree, 0)
-            
-            # Apply Dhaanto Swing Logic
-            duration = self.apply_somali_swing("eighth", idx)
-            
-            # Synthesize
-            pluck = self.synth.generate_string_pluck(freq, duration)
-            audio_buffer.append(pluck)
-            
-        return np.concatenate(audio_buffer)
+        note_freqs = [freqs.get(scale_degree, 0) for scale_degree in melody_indices]
+
+        # Apply Dhaanto Swing Logic
+        durations = [self.apply_somali_swing("eighth", idx) for idx in range(len(melody_indices))]
+
+        # Back-to-back notes: each onset is the sum of the previous note lengths
+        lengths = [int(self.synth.sr * d) for d in durations]
+        onsets = np.concatenate(([0], np.cumsum(lengths)[:-1])) / self.synth.sr
+
+        # Synthesize
+        return self.synth.render_batch(note_freqs, durations, onsets)
+
+    # --- LIVE PLAYBACK ---
+
+    def start_live(self, pattern, max_voices=4, frame_budget=None):
+        """
+        Arms the sequencer for frame-by-frame rendering of a looping pattern.
+        bpm, swing_ratio, sustain and the pattern (set_pattern) can change at
+        any time; changes apply from the next note.
+        frame_budget: max seconds of compute per frame. When exceeded, the
+        remaining (oldest) voices are killed, like voice stealing.
+        An empty pattern plays silence until a new one is set.
+        """
+        self.pattern = list(pattern)
+        self.max_voices = max_voices
+        self.frame_budget = frame_budget
+        self.step = 0
+        self.samples_to_next_step = 0
+        self.voices = []
+        self.stats = {"frames": 0, "notes": 0, "voices_dropped": 0, "budget_overruns": 0}
+
+    def set_pattern(self, pattern):
+        self.pattern = list(pattern)
+        self.step %= max(1, len(self.pattern))
+
+    def _trigger_next_step(self):
+        degree = self.pattern[self.step % len(self.pattern)] if self.pattern else 0 # empty = rest
+        # At least one sample per step, or an extreme bpm/swing would never advance
+        n_samples = max(1, int(self.synth.sr * self.apply_somali_swing("eighth", self.step)))
+        freq = self.SCALE_FREQS.get(degree, 0)
+
+        if freq != 0:
+            note_samples = int(n_samples * self.sustain)
+            self.voices.append(KarplusStrongVoice(self.synth, freq, note_samples))
+            self.stats["notes"] += 1
+            # Voice cap: steal the oldest strings first
+            while len(self.voices) > self.max_voices:
+                self.voices.pop(0)
+                self.stats["voices_dropped"] += 1
+
+        self.samples_to_next_step = n_samples
+        self.step = (self.step + 1) % max(1, len(self.pattern))
+
+    def render_frame(self, frame_size=256):
+        """
+        Renders the next frame_size samples of the running pattern.
+        """
+        deadline = None
+        if self.frame_budget is not None:
+            deadline = time.perf_counter() + self.frame_budget
+
+        out = np.zeros(frame_size, dtype=self.synth.dtype)
+        filled = 0
+        while filled < frame_size:
+            if self.samples_to_next_step == 0:
+                self._trigger_next_step()
+
+            chunk = min(frame_size - filled, self.samples_to_next_step)
+            # Newest voices first, so a blown budget kills the oldest tails.
+            # The newest voice is always rendered, even over budget.
+            rendered = []
+            for voice in reversed(self.voices):
+                if rendered and deadline is not None and time.perf_counter() > deadline:
+                    self.stats["budget_overruns"] += 1
+                    self.stats["voices_dropped"] += len(self.voices) - len(rendered)
+                    break
+                samples = voice.render(chunk)
+                out[filled:filled + len(samples)] += samples
+                rendered.append(voice)
+
+            self.voices = [v for v in reversed(rendered) if not v.finished]
+            self.samples_to_next_step -= chunk
+            filled += chunk
+
+        self.stats["frames"] += 1
+        return out
+
+    def audio_callback(self, outdata, frames, time_info=None, status=None):
+        """
+        Callback in the sounddevice/PortAudio style: fills outdata[:, 0].
+        """
+        outdata[:, 0] = self.render_frame(frames)
+
+class NullAudioSink:
+    """
+    Stands in for a sound card: pulls frames from a callback on a fixed clock
+    and records how long each callback took. A callback slower than one frame
+    period is an underrun (the device would have played silence).
+    """
+    def __init__(self, callback, frame_size=256, sample_rate=44100, realtime=False):
+        self.callback = callback
+        self.frame_size = frame_size
+        self.sr = sample_rate
+        self.realtime = realtime # Sleep between frames like a real device
+        self.frame_period = frame_size / sample_rate
+        self.latencies = []
+        self.underruns = 0
+
+    def run(self, seconds):
+        outdata = np.zeros((self.frame_size, 1))
+        n_frames = int(seconds / self.frame_period)
+        next_deadline = time.perf_counter()
+
+        for _ in range(n_frames):
+            start = time.perf_counter()
+            self.callback(outdata, self.frame_size, None, None)
+            elapsed = time.perf_counter() - start
+
+            self.latencies.append(elapsed)
+            if elapsed > self.frame_period:
+                self.underruns += 1
+
+            if self.realtime:
+                next_deadline += self.frame_period
+                time.sleep(max(0.0, next_deadline - time.perf_counter()))
+
+        return self.report()
+
+    def report(self):
+        lat_ms = np.array(self.latencies) * 1000
+        stats = {
+            "frames": len(lat_ms),
+            "underruns": self.underruns,
+            "frame_period_ms": self.frame_period * 1000,
+            "mean_ms": float(np.mean(lat_ms)) if len(lat_ms) else 0.0,
+            "p99_ms": float(np.percentile(lat_ms, 99)) if len(lat_ms) else 0.0,
+            "max_ms": float(np.max(lat_ms)) if len(lat_ms) else 0.0
+        }
+        print(f"   Frames: {stats['frames']}, underruns: {stats['underruns']}, "
+              f"callback mean/p99/max: {stats['mean_ms']:.3f}/{stats['p99_ms']:.3f}/"
+              f"{stats['max_ms']:.3f} ms (period {stats['frame_period_ms']:.2f} ms)")
+        return stats
+
+# --- BENCHMARK ---
+def benchmark_engines(freq=146.83, duration_sec=2.0, seed=0):
+    """
+    Renders the same pluck with both engines and reports samples/sec.
+    Also checks the block engine against the reference loop.
+    """
+    results = {}
+    for engine in OudSynthesizer.ENGINES:
+        synth = OudSynthesizer(sample_rate=44100, engine=engine)
+        np.random.seed(seed)
+        start = time.perf_counter()
+        results[engine] = synth.generate_string_pluck(freq, duration_sec)
+        elapsed = time.perf_counter() - start
+        rate = len(results[engine]) / elapsed
+        print(f"   [{engine:>5}] {rate:,.0f} samples/sec ({elapsed * 1000:.1f} ms)")
+
+    max_err = np.max(np.abs(results["loop"] - results["block"]))
+    print(f"   Max abs difference (loop vs block): {max_err}")
+    return max_err
 
 # --- EXECUTION ---
 if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        print("Benchmarking Karplus-Strong engines...")
+        benchmark_engines()
+        sys.exit(0)
+
+    if "--live" in sys.argv:
+        print("Live mode (null sink): 256-sample frames, tempo change halfway...")
+        seq = DhaantoSequencer(OudSynthesizer(sample_rate=44100), bpm=108)
+        seq.start_live([1, 1, 4, 3, 1, 0, 5, 4], frame_budget=0.5 * 256 / 44100)
+        sink = NullAudioSink(seq.audio_callback, frame_size=256)
+        sink.run(5.0)
+        seq.bpm, seq.swing_ratio, seq.sustain = 126, 0.66, 3.0
+        seq.set_pattern([1, 1, 6, 5, 4, 3, 1, 0])
+        sink.run(5.0)
+        print(f"   Sequencer: {seq.stats}")
+        sys.exit(0)
+
     print("Initializing Oud Physics Engine...")
-    oud = OudSynthesizer(sample_rate=44100)
+    cache = PluckCache(max_bytes=32 * 1024 * 1024)
+    oud = OudSynthesizer(sample_rate=44100, cache=cache, seed=108)
     seq = DhaantoSequencer(oud, bpm=108)
     
     # A typical Dhaanto repeating phrase (8 notes per bar)
@@ -128,8 +500,9 @@ if __name__ == "__main__":
     
     print("Synthesizing Dhaanto Rhythm with Micro-timing...")
     wave_data = seq.render_measure(pattern)
+    print(f"   Pluck cache: {cache}")
     
     # Normalize and Save
     wave_data = wave_data / np.max(np.abs(wave_data))
-    wavfile.write("dhaanto_simulation.wav", 44100, (wave_data * 32767).astype(np.int16))
+    write_wav("dhaanto_simulation.wav", wave_data, 44100, "int16")
     print("Done. Generated 'dhaanto_simulation.wav'")
\ No newline at end of file
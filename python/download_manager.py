@@ -0,0 +1,316 @@
+import requests
+import subprocess
+import threading
+import random
+import time
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# ==============================================================================
+# DOWNLOAD MANAGER
+# Shared by harvard_scraper.py, harvard_direct_downloader.py and yt.py.
+# Every download goes to '<file>.part' and is renamed into place only once
+# complete, so a file that exists is always whole. Interrupted downloads
+# resume from the .part file; transient failures retry with backoff.
+# ==============================================================================
+
+DOWNLOAD_WORKERS = 4
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0      # seconds before the first retry, doubled every attempt
+BACKOFF_MAX = 60.0
+CHUNK_SIZE = 1 << 16
+YTDLP = ("yt-dlp",)
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+# yt-dlp exits with 1 for every failure; these stderr fragments mark the transient ones
+TRANSIENT_MESSAGES = ("timed out", "connection reset", "connection refused", "connection aborted",
+                      "temporary failure in name resolution", "remote end closed", "incompleteread",
+                      "http error 408", "http error 429", "http error 500", "http error 502",
+                      "http error 503", "http error 504")
+
+class DownloadError(Exception):
+    """A failure that retrying will not fix (e.g. HTTP 404, missing downloader binary)."""
+
+class TransientError(Exception):
+    """A failure worth retrying (e.g. dropped connection, HTTP 503)."""
+
+# Network hiccups are retried; anything else (bad URL, missing binary,
+# permissions, a downloader that wrote somewhere unexpected) fails at once
+RETRYABLE = (TransientError, requests.ConnectionError, requests.Timeout,
+             requests.exceptions.ChunkedEncodingError, ConnectionError, TimeoutError)
+
+class DownloadManager:
+    """
+    Bounded pool of download workers.
+      mode="http":    plain GET with Range requests to resume the .part file
+      mode="command": external downloader (yt-dlp by default), called as
+                      command + [url, "-o", <file>.part] + args
+    With filename=None the command names the output itself (e.g. a yt-dlp
+    "%(title)s" template passed in args); no .part/rename is done then.
+    """
+    def __init__(self, workers=DOWNLOAD_WORKERS, retries=MAX_RETRIES, backoff=BACKOFF_BASE,
+                 max_backoff=BACKOFF_MAX, command=YTDLP, timeout=30):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.command = list(command)
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+        self.results = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+
+    def submit(self, url, filename, mode="command", args=(), headers=None):
+        """Queues one download; the Future resolves to its result dict (it never raises)."""
+        future = self.pool.submit(self._run, url, filename, mode, list(args), headers or {})
+        self.futures.append(future)
+        return future
+
+    def _session(self):
+        # requests sessions are not shared between threads
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def _run(self, url, filename, mode, args, headers):
+        result = {"url": url, "filename": filename, "ok": False, "skipped": False,
+                  "bytes": 0, "size": 0, "seconds": 0.0, "attempts": 0, "error": None}
+        name = os.path.basename(filename) if filename else url
+
+        if filename and os.path.exists(filename):
+            print(f"   [EXISTS] Skipping {name}.")
+            result.update(ok=True, skipped=True, size=os.path.getsize(filename))
+            return self._record(result)
+
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            result["attempts"] = attempt + 1
+            try:
+                if mode == "http":
+                    self._fetch_http(url, filename + ".part", headers, result)
+                elif mode == "command":
+                    self._fetch_command(url, filename, args)
+                else:
+                    raise DownloadError(f"Unknown download mode '{mode}'")
+
+                if filename:
+                    os.replace(filename + ".part", filename)
+                    result["size"] = os.path.getsize(filename)
+                    if mode != "http":
+                        result["bytes"] = result["size"] # the command does not report its transfer
+                result["ok"] = True
+                break
+            except RETRYABLE as e:
+                result["error"] = str(e)
+                if attempt == self.retries:
+                    break
+                # Exponential backoff with jitter, so failed workers do not retry in lockstep
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"   [RETRY {attempt + 1}/{self.retries}] {name} in {delay:.1f}s: {e}")
+                time.sleep(delay)
+            except (DownloadError, requests.RequestException, subprocess.SubprocessError, OSError) as e:
+                result["error"] = str(e)
+                break
+
+        result["seconds"] = time.perf_counter() - start
+        if result["ok"]:
+            result["error"] = None
+            rate = result["bytes"] / max(result["seconds"], 1e-9) / 1e6
+            print(f"   [SUCCESS] {name} ({result['bytes'] / 1e6:.1f} MB at {rate:.2f} MB/s, "
+                  f"{result['attempts']} attempt(s))")
+        else:
+            print(f"   [ERROR] {name}: {result['error']}")
+        return self._record(result)
+
+    def _fetch_http(self, url, part, headers, result):
+        """
+        Downloads (the rest of) url into 'part'; returns the bytes transferred.
+        They are also added to result["bytes"] as they arrive, so the bytes of
+        an attempt cut short still count, and a resumed .part file does not.
+        """
+        have = os.path.getsize(part) if os.path.exists(part) else 0
+        request_headers = dict(headers)
+        if have:
+            request_headers["Range"] = f"bytes={have}-"
+
+        with self._session().get(url, headers=request_headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416 and have:
+                return 0 # the .part file is already complete
+            if response.status_code in RETRY_STATUS:
+                raise TransientError(f"HTTP {response.status_code} for {url}")
+            if response.status_code >= 400:
+                raise DownloadError(f"HTTP {response.status_code} for {url}")
+
+            # 206: the server honoured the Range; 200: it sent everything again
+            resumed = response.status_code == 206
+            expected = response.headers.get("Content-Length")
+            transferred = 0
+            with open(part, "ab" if resumed else "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    transferred += len(chunk)
+                    result["bytes"] += len(chunk)
+
+        if expected is not None and transferred < int(expected):
+            raise TransientError(f"connection closed after {transferred} of {expected} bytes")
+        return transferred
+
+    def _fetch_command(self, url, filename, args):
+        cmd = self.command + [url]
+        if filename:
+            cmd += ["-o", filename + ".part"]
+        try:
+            # stderr is kept to tell transient failures from permanent ones
+            proc = subprocess.run(cmd + args, stderr=subprocess.PIPE, text=True, errors="replace")
+        except (FileNotFoundError, PermissionError) as e:
+            raise DownloadError(f"cannot run {cmd[0]}: {e}")
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            message = f"{os.path.basename(cmd[0])} exited with {proc.returncode}" + (f": {lines[-1]}" if lines else "")
+            if any(marker in proc.stderr.lower() for marker in TRANSIENT_MESSAGES):
+                raise TransientError(message)
+            raise DownloadError(message)
+
+    def _record(self, result):
+        with self.lock:
+            self.results.append(result)
+        return result
+
+    def wait(self):
+        """Blocks until every submitted download is finished; returns their results."""
+        return [future.result() for future in self.futures]
+
+    def report(self):
+        with self.lock:
+            results = list(self.results)
+        done = [r for r in results if r["ok"] and not r["skipped"]]
+        failed = [r for r in results if not r["ok"]]
+        total_bytes = sum(r["bytes"] for r in done)
+        elapsed = time.perf_counter() - self.started
+        print(f"Downloads: {len(done)} done, {len(results) - len(done) - len(failed)} skipped, "
+              f"{len(failed)} failed | {total_bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+              f"({total_bytes / max(elapsed, 1e-9) / 1e6:.2f} MB/s overall)")
+        for r in failed:
+            print(f"   [FAILED] {r['url']}: {r['error']}")
+        return results
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --- SELF-TEST: local HTTP server + fake downloader command ---
+
+def selftest():
+    """
+    Checks retries, resume, atomic rename and permanent failures against a
+    local HTTP server, and the command mode against a fake yt-dlp.
+    """
+    import tempfile
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    payload = bytes(random.Random(0).getrandbits(8) for _ in range(300_000))
+    hits = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            hits[self.path] = hits.get(self.path, 0) + 1
+            if self.path == "/missing":
+                self.send_error(404)
+                return
+            if self.path == "/flaky" and hits[self.path] <= 2:
+                self.send_error(503)
+                return
+
+            start = 0
+            if self.headers.get("Range"):
+                start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+                self.send_response(206)
+            else:
+                self.send_response(200)
+            body = payload[start:]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.path == "/cut" and hits[self.path] == 1:
+                # Die halfway through: the retry must resume, not restart
+                self.wfile.write(body[:len(body) // 2])
+                self.wfile.flush()
+                self.connection.shutdown(2)
+                return
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Fake yt-dlp: a transient error on its first call, then writes the URL
+        # into the -o file; "unsupported" URLs fail for good, "elsewhere" ones
+        # are written under another name (so the rename cannot find them)
+        fake = os.path.join(tmp, "fake_ytdlp.py")
+        with open(fake, "w") as f:
+            f.write("import sys, os\n"
+                    "url, out = sys.argv[1], sys.argv[3]\n"
+                    "if 'unsupported' in url:\n"
+                    "    sys.exit('ERROR: Unsupported URL: ' + url)\n"
+                    "if 'elsewhere' in url:\n"
+                    "    out += '.mp4'\n"
+                    "flag = out + '.tried'\n"
+                    "if not os.path.exists(flag):\n"
+                    "    open(flag, 'w').close()\n"
+                    "    sys.exit('ERROR: Unable to download: HTTP Error 503: Service Unavailable')\n"
+                    "open(out, 'w').write(url)\n")
+
+        path = lambda name: os.path.join(tmp, name)
+        with open(path("resume.bin.part"), "wb") as f:
+            f.write(payload[:100_000]) # left over from an earlier run
+        with DownloadManager(workers=4, backoff=0.01, command=[sys.executable, fake]) as manager:
+            ok = manager.submit(f"{base}/ok", path("ok.bin"), mode="http")
+            flaky = manager.submit(f"{base}/flaky", path("flaky.bin"), mode="http")
+            cut = manager.submit(f"{base}/cut", path("cut.bin"), mode="http")
+            resume = manager.submit(f"{base}/resume", path("resume.bin"), mode="http")
+            missing = manager.submit(f"{base}/missing", path("missing.bin"), mode="http")
+            command = manager.submit("https://example.org/stream", path("stream.mp3"))
+            unsupported = manager.submit("https://example.org/unsupported", path("unsupported.mp3"))
+            elsewhere = manager.submit("https://example.org/elsewhere", path("elsewhere.mp3"))
+            results = manager.wait()
+            again = manager.submit(f"{base}/ok", path("ok.bin"), mode="http").result()
+            manager.report()
+        server.shutdown()
+
+        with DownloadManager(workers=1, backoff=0.01, command=[os.path.join(tmp, "no-such-ytdlp")]) as manager:
+            no_binary = manager.submit("https://example.org/stream", path("never.mp3")).result()
+
+        for name in ("ok.bin", "flaky.bin", "cut.bin", "resume.bin"):
+            with open(path(name), "rb") as f:
+                assert f.read() == payload, f"{name} corrupted"
+        assert flaky.result()["attempts"] == 3, "503s were not retried"
+        assert cut.result()["attempts"] == 2 and cut.result()["bytes"] == len(payload), "cut download not resumed"
+        assert resume.result()["bytes"] == len(payload) - 100_000, "resumed bytes counted as fetched"
+        assert resume.result()["size"] == len(payload)
+        assert hits["/cut"] == 2
+        assert not missing.result()["ok"] and missing.result()["attempts"] == 1, "404 must not be retried"
+        assert not os.path.exists(path("missing.bin"))
+        assert command.result()["ok"] and command.result()["attempts"] == 2, "transient exit not retried"
+        assert not unsupported.result()["ok"] and unsupported.result()["attempts"] == 1, "permanent exit retried"
+        assert "Unsupported URL" in unsupported.result()["error"]
+        assert not elsewhere.result()["ok"] and elsewhere.result()["attempts"] == 2, "failed rename retried"
+        assert not no_binary["ok"] and no_binary["attempts"] == 1, "missing binary retried"
+        assert open(path("stream.mp3")).read() == "https://example.org/stream"
+        assert again["skipped"], "finished files must be skipped"
+        assert not [n for n in os.listdir(tmp) if n.endswith(".part")], "leftover .part files"
+    print(f"[SELFTEST OK] {len(results) + 1} downloads: retry, resume, rename, 404, command mode "
+          f"and permanent command failures behave.")
+
+if __name__ == "__main__":
+    selftest()
@@ -0,0 +1,192 @@
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+from math import gcd
+
+# ==============================================================================
+# EFFECTS BUS (BLOCK-BASED, CONSTANT MEMORY)
+# Every effect keeps its own state between blocks and works on preallocated
+# buffers, so a long mix never needs a full-length copy per effect.
+# ==============================================================================
+
+def load_impulse_response(path, sr=44100):
+    """
+    Loads an impulse response WAV as mono float, resampled to 'sr' and
+    normalized to unit energy so swapping rooms does not change loudness.
+    """
+    ir_sr, ir = wavfile.read(path)
+
+    # Integer PCM -> float in [-1, 1]; 8-bit WAV is unsigned, centered on 128
+    if ir.dtype == np.uint8:
+        ir = (ir.astype(np.float64) - 128.0) / 128.0
+    elif np.issubdtype(ir.dtype, np.integer):
+        ir = ir / float(np.iinfo(ir.dtype).max)
+    ir = ir.astype(np.float64)
+
+    if ir.ndim > 1:
+        ir = ir.mean(axis=1)
+
+    if ir_sr != sr:
+        g = gcd(sr, ir_sr)
+        ir = resample_poly(ir, sr // g, ir_sr // g)
+
+    energy = np.sqrt(np.sum(ir ** 2))
+    if energy > 0:
+        ir = ir / energy
+    return ir
+
+class DelayLine:
+    """
+    Shared history buffer: [last max_delay samples | current block].
+    Subclasses read delayed samples from 'self.buffer' inside process().
+    """
+    def __init__(self, max_delay, block_size, dtype=np.float64):
+        self.max_delay = max_delay
+        self.buffer = np.zeros(max_delay + block_size, dtype=dtype)
+
+    def _load(self, block):
+        n = len(block)
+        if self.max_delay + n > len(self.buffer):
+            grown = np.zeros(self.max_delay + n, dtype=self.buffer.dtype)
+            grown[:self.max_delay] = self.buffer[:self.max_delay]
+            self.buffer = grown
+        self.buffer[self.max_delay:self.max_delay + n] = block
+        return n
+
+    @property
+    def tail_length(self):
+        """Samples of output still owed after the input stops."""
+        return self.max_delay
+
+    def _advance(self, n):
+        # Keep the newest max_delay samples as history for the next block
+        self.buffer[:self.max_delay] = self.buffer[n:n + self.max_delay]
+
+class MultiTapDelay(DelayLine):
+    """
+    Feed-forward echoes: out = x + sum(gain * x[n - delay]).
+    taps: list of (delay_ms, gain).
+    """
+    def __init__(self, taps, sr=44100, block_size=44100, dtype=np.float64):
+        self.taps = [(int(delay_ms * sr / 1000), gain) for delay_ms, gain in taps]
+        super().__init__(max(d for d, _ in self.taps), block_size, dtype)
+
+    def process(self, block):
+        n = self._load(block)
+        out = None
+        for delay, gain in self.taps:
+            start = self.max_delay - delay
+            echo = self.buffer[start:start + n] * gain
+            out = block + echo if out is None else out + echo
+        self._advance(n)
+        return out
+
+class Chorus(DelayLine):
+    """
+    Single-voice chorus: a short delay swept by a sine LFO, read with
+    linear interpolation. The LFO phase carries over between blocks.
+    """
+    def __init__(self, sr=44100, rate_hz=0.8, depth_ms=2.0, base_ms=15.0, mix=0.4, block_size=44100,
+                 dtype=np.float64):
+        self.sr = sr
+        self.rate_hz = rate_hz
+        self.depth = depth_ms * sr / 1000
+        self.base = base_ms * sr / 1000
+        self.mix = mix
+        self.phase = 0.0
+        super().__init__(int(np.ceil(self.base + self.depth)) + 2, block_size, dtype)
+
+    def process(self, block):
+        n = self._load(block)
+        t = np.arange(n)
+
+        lfo = np.sin(2 * np.pi * (self.phase + t * self.rate_hz / self.sr))
+        read_pos = self.max_delay + t - (self.base + self.depth * lfo)
+        idx = read_pos.astype(np.intp)
+        frac = (read_pos - idx).astype(self.buffer.dtype, copy=False)
+        wet = self.buffer[idx] + frac * (self.buffer[idx + 1] - self.buffer[idx])
+
+        self.phase = (self.phase + n * self.rate_hz / self.sr) % 1.0
+        self._advance(n)
+        return block * (1 - self.mix) + wet * self.mix
+
+class ConvolutionReverb:
+    """
+    FFT overlap-add convolution with a fixed impulse response.
+    The IR spectrum is computed once; 'tail' holds the part of earlier
+    blocks' reverb that has not been played yet (len(ir) - 1 samples).
+    Cost per block is one rfft/irfft pair of size >= block + len(ir) - 1.
+    """
+    def __init__(self, ir, block_size=44100, wet=0.3, dry=1.0, dtype=np.float64):
+        self.ir_len = len(ir)
+        self.block_size = block_size
+        self.wet = wet
+        self.dry = dry
+        self.fft_size = 1 << int(np.ceil(np.log2(block_size + self.ir_len - 1)))
+        # float32 IR -> complex64 spectrum, so the whole FFT path stays single precision
+        self.ir_fft = np.fft.rfft(np.asarray(ir, dtype=dtype), self.fft_size)
+        self.frame = np.zeros(self.fft_size, dtype=dtype)
+        self.tail = np.zeros(self.fft_size, dtype=dtype)
+
+    @property
+    def tail_length(self):
+        return self.ir_len - 1
+
+    def process(self, block):
+        n = len(block)
+        if n > self.block_size:
+            raise ValueError(f"Block of {n} samples exceeds block_size={self.block_size}")
+
+        self.frame[:n] = block
+        self.frame[n:] = 0.0
+        self.tail += np.fft.irfft(np.fft.rfft(self.frame) * self.ir_fft, self.fft_size)
+
+        out = block * self.dry + self.tail[:n] * self.wet
+
+        # Slide the pending reverb forward by one block
+        self.tail[:-n] = self.tail[n:]
+        self.tail[-n:] = 0.0
+        return out
+
+class EffectsBus:
+    """
+    Chains effects in series. Each effect exposes process(block) -> block.
+    """
+    def __init__(self, effects=None):
+        self.effects = list(effects or [])
+
+    def add(self, effect):
+        self.effects.append(effect)
+        return self
+
+    def process(self, block):
+        for effect in self.effects:
+            block = effect.process(block)
+        return block
+
+    @property
+    def tail_length(self):
+        # In series, every effect rings out on top of the previous one's tail
+        return sum(effect.tail_length for effect in self.effects)
+
+    def process_stream(self, blocks):
+        for block in blocks:
+            yield self.process(block)
+
+    def process_inplace(self, signal, block_size=44100):
+        """
+        Runs a full-length signal through the bus without extra full-length copies.
+        The output keeps the input length: echoes and reverb still ringing at
+        the end stay in the effects' state until flush() is called.
+        """
+        for start in range(0, len(signal), block_size):
+            signal[start:start + block_size] = self.process(signal[start:start + block_size])
+        return signal
+
+    def flush(self, block_size=44100, dtype=np.float64):
+        """Feeds silence through the chain and returns the remaining tail_length samples."""
+        n_tail = self.tail_length
+        tail = np.zeros(n_tail, dtype=dtype)
+        for start in range(0, n_tail, block_size):
+            tail[start:start + block_size] = self.process(tail[start:start + block_size])
+        return tail
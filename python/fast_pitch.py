@@ -0,0 +1,141 @@
+import numpy as np
+
+# ==============================================================================
+# FAST PITCH ESTIMATORS (NUMPY ONLY)
+# Cheaper alternatives to librosa.pyin for generate_sheet_music.py.
+# Frames are laid out like librosa (centered, zero padded), so f0 arrays from
+# every backend share pyin's frame grid, and only frames inside onset
+# segments are evaluated at all.
+# ==============================================================================
+
+PITCH_BACKENDS = ("pyin", "yin", "autocorr")
+
+FRAME_LENGTH = 2048
+SILENCE_DB = -60.0      # frames quieter than this are unvoiced, whatever the estimator says
+
+def segment_frames(onset_times, n_frames, sr, hop_length=512, max_note_frames=None):
+    """
+    Indices of the frames a note needs: those between consecutive onsets
+    (what align_notes() takes the median over). max_note_frames keeps only
+    the first N frames of each note, trading long sustains for speed.
+    """
+    if len(onset_times) < 2:
+        return np.zeros(0, dtype=np.intp)
+
+    bounds = np.ceil(np.asarray(onset_times) * sr / hop_length).astype(np.intp)
+    bounds = np.clip(bounds, 0, n_frames)
+    starts, stops = bounds[:-1], bounds[1:]
+    if max_note_frames is not None:
+        stops = np.minimum(stops, starts + max_note_frames)
+
+    lengths = np.maximum(stops - starts, 0)
+    # Concatenated aranges without a Python loop: start of each run + offset inside it
+    run_ids = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.unique(starts[run_ids] + offsets)
+
+def frame_signal(y, frame_idx, frame_length=FRAME_LENGTH, hop_length=512):
+    """(len(frame_idx), frame_length) matrix of centered frames, librosa center=True style."""
+    pad = frame_length // 2
+    y_padded = np.pad(np.asarray(y, dtype=np.float64), (pad, pad + frame_length))
+    windows = np.lib.stride_tricks.sliding_window_view(y_padded, frame_length)
+    return windows[np.asarray(frame_idx) * hop_length]
+
+def _lag_terms(frames, max_lag):
+    """
+    For every frame, over a window of w = frame_length - max_lag - 1 samples:
+      acf[tau]    = sum_j x[j] * x[j + tau]        (one rfft/irfft pair per frame)
+      energy[tau] = sum_j x[j + tau] ** 2           (cumulative sums)
+    """
+    n = frames.shape[1]
+    w = n - max_lag - 1
+    n_fft = 1 << int(np.ceil(np.log2(n + w)))
+    spectrum = np.fft.rfft(frames, n_fft, axis=1)
+    head = np.fft.rfft(frames[:, :w], n_fft, axis=1)
+    acf = np.fft.irfft(np.conj(head) * spectrum, n_fft, axis=1)[:, :max_lag + 2]
+
+    power = np.concatenate([np.zeros((len(frames), 1)), np.cumsum(frames ** 2, axis=1)], axis=1)
+    lags = np.arange(max_lag + 2)
+    energy = power[:, lags + w] - power[:, lags]
+    return acf, energy, w
+
+def _parabolic(curve, idx):
+    """Sub-sample position of the extremum at integer lag idx (one per row)."""
+    rows = np.arange(len(curve))
+    left, mid, right = curve[rows, idx - 1], curve[rows, idx], curve[rows, idx + 1]
+    denom = left - 2 * mid + right
+    shift = np.where(np.abs(denom) > 1e-12, 0.5 * (left - right) / np.where(denom == 0, 1, denom), 0.0)
+    return idx + np.clip(shift, -1, 1)
+
+def _lag_range(sr, fmin, fmax):
+    return max(2, int(np.floor(sr / fmax))), int(np.ceil(sr / fmin))
+
+def _silent(energy, w):
+    rms_db = 10 * np.log10(energy[:, 0] / w + 1e-20)
+    return rms_db < SILENCE_DB
+
+def yin_frames(frames, sr, fmin, fmax, threshold=0.15):
+    """
+    Plain YIN (de Cheveigne & Kawahara), vectorized over frames:
+    cumulative-mean-normalized difference, first trough under 'threshold',
+    parabolic refinement. Frames with no trough under the threshold are unvoiced.
+    """
+    min_lag, max_lag = _lag_range(sr, fmin, fmax)
+    acf, energy, w = _lag_terms(frames, max_lag)
+
+    diff = energy[:, :1] + energy - 2 * acf
+    diff[:, 0] = 0.0
+    running_mean = np.cumsum(diff[:, 1:], axis=1) / np.arange(1, diff.shape[1])
+    cmnd = np.ones_like(diff)
+    cmnd[:, 1:] = diff[:, 1:] / np.maximum(running_mean, 1e-12)
+
+    lags = slice(min_lag, max_lag + 1)
+    c = cmnd[:, lags]
+    prev, nxt = cmnd[:, min_lag - 1:max_lag], cmnd[:, min_lag + 1:max_lag + 2]
+    candidates = (c < threshold) & (c <= prev) & (c <= nxt)
+
+    voiced = candidates.any(axis=1) & ~_silent(energy, w)
+    tau = min_lag + np.argmax(candidates, axis=1)
+    f0 = sr / _parabolic(cmnd, tau)
+    return np.where(voiced, f0, np.nan)
+
+def autocorr_frames(frames, sr, fmin, fmax, voicing=0.5, octave_tolerance=0.9):
+    """
+    Normalized cross-correlation pitch (RAPT-style NCCF), vectorized over frames.
+    Picks the shortest lag whose peak is within octave_tolerance of the best one,
+    which avoids the usual period-doubling errors of a plain argmax.
+    """
+    min_lag, max_lag = _lag_range(sr, fmin, fmax)
+    acf, energy, w = _lag_terms(frames, max_lag)
+    nccf = acf / np.sqrt(np.maximum(energy[:, :1] * energy, 1e-20))
+
+    c = nccf[:, min_lag:max_lag + 1]
+    prev, nxt = nccf[:, min_lag - 1:max_lag], nccf[:, min_lag + 1:max_lag + 2]
+    peaks = (c >= prev) & (c >= nxt)
+    best = np.max(np.where(peaks, c, -1.0), axis=1)
+    good = peaks & (c >= octave_tolerance * best[:, None])
+
+    voiced = (best >= voicing) & ~_silent(energy, w)
+    tau = min_lag + np.argmax(good, axis=1)
+    f0 = sr / _parabolic(nccf, tau)
+    return np.where(voiced, f0, np.nan)
+
+def estimate_f0(y, sr, fmin, fmax, onset_times, backend="yin", hop_length=512,
+                frame_length=FRAME_LENGTH, max_note_frames=None, batch_frames=2048):
+    """
+    f0 on pyin's frame grid (1 + len(y) // hop_length frames), NaN outside
+    onset segments. Frames are processed in batches to bound memory.
+    """
+    estimators = {"yin": yin_frames, "autocorr": autocorr_frames}
+    if backend not in estimators:
+        raise ValueError(f"Unknown fast pitch backend '{backend}'. Use one of {list(estimators)}")
+
+    n_frames = 1 + len(y) // hop_length
+    f0 = np.full(n_frames, np.nan)
+    frame_idx = segment_frames(onset_times, n_frames, sr, hop_length, max_note_frames)
+
+    for start in range(0, len(frame_idx), batch_frames):
+        idx = frame_idx[start:start + batch_frames]
+        frames = frame_signal(y, idx, frame_length, hop_length)
+        f0[idx] = estimators[backend](frames, sr, fmin, fmax)
+    return f0
@@ -1,100 +1,511 @@
 import numpy as np
 import librosa
 from qaraami_mir import QaraamiExtractor
+from transcription_cache import TranscriptionCache, TRANSCRIPTION_CACHE_DIR
+from fast_pitch import PITCH_BACKENDS, estimate_f0
 import os
 import glob
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # DEMUCS OUTPUT FOLDER
 INPUT_STEMS_DIR = "dataset/separated_oud/htdemucs"
+SHEET_MUSIC_DIR = "dataset/sheet_music"
 
+# Everything that changes the transcription; part of the cache keys
+ANALYSIS_PARAMS = {
+    "sr": 22050,
+    "duration": None,        # None = whole file in chunks; a number loads only that many seconds
+    "chunk_seconds": 30,     # core length of each analysis window
+    "chunk_overlap": 2.0,    # seconds of context on each side of a window
+    "fmin": 70,              # D2
+    "fmax": 400,             # G4
+    "onset_backtrack": True,
+    "pitch_backend": "pyin", # "pyin" (best), "yin" or "autocorr" (fast, onset segments only)
+    "max_note_frames": None, # fast backends: only look at the first N frames of each note
+    "min_pitch": 60          # Hz, drops bass rumble
+}
 
-def extract_smart_notes(y, sr):
+# Shared by onset_detect and pyin so chunk results land on one global frame grid
+HOP_LENGTH = 512
+
+
+def detect_onsets(y, sr, params=ANALYSIS_PARAMS):
+    print("   -> Detecting Onsets (Plucks)...")
+    return onsets_from_envelope(onset_envelope(y, sr), sr, params)
+
+
+def onset_envelope(y, sr):
+    """Onset strength per HOP_LENGTH frame (what onset_detect peak-picks)."""
+    return librosa.onset.onset_strength(y=y, sr=sr, hop_length=HOP_LENGTH)
+
+
+def onsets_from_envelope(envelope, sr, params=ANALYSIS_PARAMS):
     """
-    Uses Onset Detection to find actual musical notes, ignoring noise.
+    Normalizes the envelope, picks its peaks and backtracks them, as
+    onset_detect does. Running it once over the joined envelope of all chunks
+    keeps normalization and peak picking global, like the unchunked analysis.
     """
-    print("   -> Detecting Onsets (Plucks)...")
+    onset_frames = librosa.onset.onset_detect(onset_envelope=envelope, sr=sr, hop_length=HOP_LENGTH,
+                                              backtrack=params["onset_backtrack"])
+    return librosa.frames_to_time(onset_frames, sr=sr, hop_length=HOP_LENGTH)
 
-    onset_frames = librosa.onset.onset_detect(y=y, sr=sr, backtrack=True)
-    onset_times = librosa.frames_to_time(onset_frames, sr=sr)
 
-    print("   -> Detecting Pitch (F0)...")
-    # 2. Extract Pitch for the whole file
+def track_pitch(y, sr, params=ANALYSIS_PARAMS, onset_times=None):
+    """
+    Returns (f0, times) for the whole file.
+    The fast backends need onset_times: they only evaluate frames inside notes.
+    """
+    backend = params["pitch_backend"]
+    print(f"   -> Detecting Pitch (F0, {backend})...")
     # fmin=70 (D2) to fmax=400 (G4) covers the Oud range
-    f0, voiced_flag, voiced_probs = librosa.pyin(y, fmin=70, fmax=400, sr=sr)
-    times = librosa.times_like(f0, sr=sr)
+    if backend == "pyin":
+        f0, voiced_flag, voiced_probs = librosa.pyin(y, fmin=params["fmin"], fmax=params["fmax"], sr=sr,
+                                                     hop_length=HOP_LENGTH)
+    elif backend in PITCH_BACKENDS:
+        if onset_times is None:
+            onset_times = detect_onsets(y, sr, params)
+        f0 = estimate_f0(y, sr, params["fmin"], params["fmax"], onset_times, backend,
+                         HOP_LENGTH, max_note_frames=params["max_note_frames"])
+    else:
+        raise ValueError(f"Unknown pitch backend '{backend}'. Use one of {list(PITCH_BACKENDS)}")
+    return f0, librosa.times_like(f0, sr=sr, hop_length=HOP_LENGTH)
+
+
+def align_note_arrays(onset_times, f0, times, min_pitch=ANALYSIS_PARAMS["min_pitch"]):
+    """
+    Align Pitch to Onsets, all notes at once.
+    Note i spans the f0 frames between onset i and onset i+1; its pitch is the
+    median of the voiced (non-NaN) frames, which removes vibrato and sliding noise.
+    Medians come from one sort of (note id, pitch) over every voiced frame, so the
+    cost is a single O(frames log frames) pass instead of a Python loop per onset.
+    Returns a columnar note table: {"onset", "pitch", "duration"} arrays.
+    """
+    onset_times = np.asarray(onset_times, dtype=np.float64)
+    empty = {"onset": np.zeros(0), "pitch": np.zeros(0), "duration": np.zeros(0)}
+    if len(onset_times) < 2:
+        return empty
 
-    notes_events = []
+    # Frame range of every note: [bounds[i], bounds[i+1])
+    bounds = np.searchsorted(times, onset_times)
+    frames = np.arange(bounds[0], bounds[-1])
+    frames = frames[~np.isnan(f0[frames])]
+    note_id = np.searchsorted(bounds, frames, side="right") - 1
 
-    # 3. Align Pitch to Onsets
-    # We look at the time BETWEEN two onsets to determine the note
-    for i in range(len(onset_times) - 1):
-        start_t = onset_times[i]
-        end_t = onset_times[i+1]
-        duration = end_t - start_t
+    # Sorted by note, then by pitch: each note's voiced frames form one sorted run
+    order = np.lexsort((f0[frames], note_id))
+    sorted_pitch = f0[frames][order]
+    counts = np.bincount(note_id, minlength=len(onset_times) - 1)
+    run_start = np.cumsum(counts) - counts
 
-        # Find indices in the F0 array that correspond to this time slice
-        idx_start = np.searchsorted(times, start_t)
-        idx_end = np.searchsorted(times, end_t)
+    has_pitch = np.flatnonzero(counts > 0)
+    lo = run_start[has_pitch] + (counts[has_pitch] - 1) // 2
+    hi = run_start[has_pitch] + counts[has_pitch] // 2
+    # Same as np.median: middle value, or the mean of the two middle values
+    median_pitch = (sorted_pitch[lo] + sorted_pitch[hi]) / 2
 
-        # Get all pitch readings for this one note
-        pitch_segment = f0[idx_start:idx_end]
+    # Filter out obvious errors (e.g., extremely low bass rumble)
+    keep = median_pitch > min_pitch
+    notes = has_pitch[keep]
+    return {
+        "onset": onset_times[notes],
+        "pitch": median_pitch[keep],
+        "duration": onset_times[notes + 1] - onset_times[notes]
+    }
 
-        # Filter out silence (NaNs)
-        clean_segment = pitch_segment[~np.isnan(pitch_segment)]
 
-        if len(clean_segment) > 0:
-            # TAKE THE MEDIAN: This removes vibrato and sliding noise
-            median_pitch = np.median(clean_segment)
+def align_notes(onset_times, f0, times, min_pitch=ANALYSIS_PARAMS["min_pitch"]):
+    """align_note_arrays() as a list of {'pitch', 'duration'} dicts."""
+    table = align_note_arrays(onset_times, f0, times, min_pitch)
+    return [{'pitch': p, 'duration': d} for p, d in zip(table["pitch"], table["duration"])]
+
+
+def extract_smart_notes(y, sr, params=ANALYSIS_PARAMS):
+    """
+    Uses Onset Detection to find actual musical notes, ignoring noise.
+    """
+    onset_times = detect_onsets(y, sr, params)
+    f0, times = track_pitch(y, sr, params, onset_times)
+    return align_notes(onset_times, f0, times, params["min_pitch"])
 
-            # Filter out obvious errors (e.g., extremely low bass rumble)
-            if median_pitch > 60:
-                notes_events.append({
-                    'pitch': median_pitch,
-                    'duration': duration
-                })
 
-    return notes_events
+def analyze_chunk(audio_path, start, stop, params=ANALYSIS_PARAMS, stages=("envelope", "f0"),
+                  onset_times=None):
+    """
+    Onset envelope and/or f0 for samples [start, stop) of the file (at params["sr"]).
+    The window is padded with chunk_overlap seconds of context on both sides,
+    so spectral frames and pyin's Viterbi path are not cut off at the seams;
+    only frames that fall inside the core range are kept.
+    start/stop are multiples of HOP_LENGTH, so kept frames sit on the global grid.
+    The fast pitch backends need the (global) onset_times of the track.
+    """
+    sr = params["sr"]
+    pad = int(np.ceil(params["chunk_overlap"] * sr / HOP_LENGTH)) * HOP_LENGTH
+    win_start = max(0, start - pad)
+    y, _ = librosa.load(audio_path, sr=sr, offset=win_start / sr,
+                        duration=(stop + pad - win_start) / sr)
+
+    def core(values):
+        frames = win_start // HOP_LENGTH + np.arange(len(values))
+        keep = frames >= start // HOP_LENGTH
+        if stop < params.get("total_samples", np.inf):
+            keep &= frames < stop // HOP_LENGTH
+        return values[keep]
+
+    out = {}
+    if "envelope" in stages:
+        out["envelope"] = core(onset_envelope(y, sr))
+    if "f0" in stages:
+        window_onsets = None
+        if onset_times is not None:
+            window_onsets = onset_times[(onset_times >= win_start / sr) & (onset_times < (stop + pad) / sr)]
+            window_onsets = window_onsets - win_start / sr
+        f0, _ = track_pitch(y, sr, params, window_onsets)
+        out["f0"] = core(f0)
+    return out
+
+
+def _analyze_chunk_job(job):
+    return analyze_chunk(*job)
+
+
+def analyze_audio(audio_path, params=ANALYSIS_PARAMS, stages=("onsets", "f0"), chunk_workers=1):
+    """
+    Runs the requested analysis stages over a stem.
+    With duration=None the whole recording is processed in overlapping chunks,
+    so memory stays bounded by one chunk per worker, and the chunks can be spread
+    over 'chunk_workers' processes. Otherwise the first 'duration' seconds are
+    analyzed in one go.
+    Chunks only return their slice of the onset envelope; normalization and
+    peak picking run once over the whole envelope, as in the unchunked path.
+    (The per-window 80 dB floor of onset_strength is the one local step left;
+    check_chunking() measures the difference on a real file.)
+    Returns a dict with audio_seconds plus onset_times and/or f0/times.
+    """
+    sr = params["sr"]
+
+    if params["duration"] is not None:
+        y, sr = librosa.load(audio_path, sr=sr, duration=params["duration"])
+        out = {"audio_seconds": np.float64(len(y) / sr)}
+        onset_times = None
+        if "onsets" in stages or params["pitch_backend"] != "pyin":
+            onset_times = detect_onsets(y, sr, params)
+        if "onsets" in stages:
+            out["onset_times"] = onset_times
+        if "f0" in stages:
+            out["f0"], out["times"] = track_pitch(y, sr, params, onset_times)
+        return out
+
+    total = int(np.ceil(librosa.get_duration(path=audio_path) * sr))
+    chunk = max(1, int(params["chunk_seconds"] * sr) // HOP_LENGTH) * HOP_LENGTH
+    chunk_params = dict(params, total_samples=total)
+    bounds = [(start, min(start + chunk, total)) for start in range(0, total, chunk)]
+    print(f"   -> Analyzing {total / sr:.0f}s in {len(bounds)} chunks...")
+
+    def run(chunk_stages, onset_times=None):
+        jobs = [(audio_path, start, stop, chunk_params, chunk_stages, onset_times) for start, stop in bounds]
+        if chunk_workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=chunk_workers) as pool:
+                return list(pool.map(_analyze_chunk_job, jobs))
+        return [_analyze_chunk_job(job) for job in jobs]
+
+    fast_f0 = "f0" in stages and params["pitch_backend"] != "pyin"
+    # Pass 1: envelope (+ pyin, which does not need onsets); pass 2: fast f0 given the onsets
+    first = (["envelope"] if "onsets" in stages or fast_f0 else []) + (["f0"] if "f0" in stages and not fast_f0 else [])
+    parts = run(tuple(first))
+
+    out = {"audio_seconds": np.float64(total / sr)}
+    onset_times = None
+    if "envelope" in first:
+        print("   -> Detecting Onsets (Plucks)...")
+        onset_times = onsets_from_envelope(np.concatenate([p["envelope"] for p in parts]), sr, params)
+    if "onsets" in stages:
+        out["onset_times"] = onset_times
+    if "f0" in stages:
+        if fast_f0:
+            parts = run(("f0",), onset_times)
+        out["f0"] = np.concatenate([p["f0"] for p in parts])
+        out["times"] = librosa.frames_to_time(np.arange(len(out["f0"])), sr=sr, hop_length=HOP_LENGTH)
+    return out
+
+
+def check_chunking(audio_path, params=ANALYSIS_PARAMS, chunk_seconds=10, tolerance_frames=1, min_match=0.98):
+    """
+    Compares chunked onsets against one full-track onset_detect on a real file.
+    Asserts that at least 'min_match' of the onsets of each side have a
+    partner on the other within 'tolerance_frames' hops.
+    """
+    sr = params["sr"]
+    y, _ = librosa.load(audio_path, sr=sr)
+    full = detect_onsets(y, sr, params)
+    chunked = analyze_audio(audio_path, dict(params, duration=None, chunk_seconds=chunk_seconds),
+                            stages=("onsets",))["onset_times"]
 
+    tolerance = tolerance_frames * HOP_LENGTH / sr + 1e-9
+    def matched(a, b):
+        if len(a) == 0:
+            return 1.0
+        if len(b) == 0:
+            return 0.0
+        idx = np.clip(np.searchsorted(b, a), 1, len(b) - 1)
+        nearest = np.minimum(np.abs(a - b[idx - 1]), np.abs(a - b[idx]))
+        return float(np.mean(nearest <= tolerance))
 
-def transcribe_collection():
+    recall, precision = matched(full, chunked), matched(chunked, full)
+    print(f"   Full track: {len(full)} onsets, chunked ({chunk_seconds}s): {len(chunked)}; "
+          f"matched {recall:.1%} / {precision:.1%} within {tolerance_frames} frame(s)")
+    assert recall >= min_match and precision >= min_match, "chunked onsets drift from the full-track result"
+    print("[CHECK OK] chunked onset detection matches the full-track analysis.")
+    return recall, precision
+
+
+def extract_notes_cached(audio_path, cache, params=ANALYSIS_PARAMS, chunk_workers=1):
+    """
+    extract_smart_notes() with every stage memoized in a TranscriptionCache.
+    Stage chain:  load(sr, duration, chunking) -> onsets(backtrack)  \
+                                               -> f0(fmin, fmax, backend) -> notes(min_pitch)
+    The audio is only decoded if the onset or f0 stage actually has to run.
+    Returns (note_table, info) where info holds audio_seconds, the names of
+    the stages served from cache, and the keys the export stage chains on.
+    """
+    content_hash = cache.file_hash(audio_path)
+    load_key = cache.stage_key(content_hash, "load", {k: params[k] for k in ("sr", "duration", "chunk_seconds", "chunk_overlap")})
+    onset_key = cache.stage_key(load_key, "onsets", {"backtrack": params["onset_backtrack"]})
+    # The fast backends only look inside onset segments, so their f0 also depends on the onsets
+    f0_parents = load_key if params["pitch_backend"] == "pyin" else [load_key, onset_key]
+    f0_key = cache.stage_key(f0_parents, "f0",
+                             {k: params[k] for k in ("fmin", "fmax", "pitch_backend", "max_note_frames")})
+    notes_key = cache.stage_key([onset_key, f0_key], "notes", {"min_pitch": params["min_pitch"]})
+    cached_stages = []
+
+    notes = cache.load(content_hash, "notes", notes_key)
+    if notes is not None:
+        cached_stages.append("notes")
+    else:
+        onsets = cache.load(content_hash, "onsets", onset_key)
+        pitch = cache.load(content_hash, "f0", f0_key)
+
+        stages = [name for name, hit in (("onsets", onsets), ("f0", pitch)) if hit is None]
+        cached_stages += [name for name in ("onsets", "f0") if name not in stages]
+        if stages:
+            fresh = analyze_audio(audio_path, params, stages, chunk_workers)
+            if onsets is None:
+                onsets = {"onset_times": fresh["onset_times"], "audio_seconds": fresh["audio_seconds"]}
+                cache.save(content_hash, "onsets", onset_key, **onsets)
+            if pitch is None:
+                pitch = {"f0": fresh["f0"], "times": fresh["times"]}
+                cache.save(content_hash, "f0", f0_key, **pitch)
+
+        notes = align_note_arrays(onsets["onset_times"], pitch["f0"], pitch["times"], params["min_pitch"])
+        notes["audio_seconds"] = onsets["audio_seconds"]
+        cache.save(content_hash, "notes", notes_key, **notes)
+
+    info = {
+        "audio_seconds": float(notes["audio_seconds"]),
+        "cached": cached_stages,
+        "content_hash": content_hash,
+        "notes_key": notes_key
+    }
+    return notes, info
+
+
+def transcribe_track(audio_path, output_dir=SHEET_MUSIC_DIR, cache_dir=TRANSCRIPTION_CACHE_DIR,
+                     params=ANALYSIS_PARAMS, chunk_workers=1):
+    """
+    Transcribes one stem and writes its MusicXML.
+    cache_dir=None disables the transcription cache.
+    chunk_workers > 1 spreads the chunks of a long recording over processes.
+    Never raises: failures come back as a result with an 'error' message,
+    so one bad track cannot take down a whole batch.
+    """
+    print(f"--- Processing: {audio_path} ---")
+    start = time.perf_counter()
+    result = {"path": audio_path, "notes": 0, "audio_seconds": 0.0, "xml": None, "error": None,
+              "cached": []}
+
+    try:
+        extractor = QaraamiExtractor()
+
+        if cache_dir is None:
+            # Run the new "Smart" extraction
+            analysis = analyze_audio(audio_path, params, chunk_workers=chunk_workers)
+            result["audio_seconds"] = float(analysis["audio_seconds"])
+            notes = align_note_arrays(analysis["onset_times"], analysis["f0"], analysis["times"],
+                                      params["min_pitch"])
+        else:
+            cache = TranscriptionCache(cache_dir)
+            notes, info = extract_notes_cached(audio_path, cache, params, chunk_workers)
+            result["audio_seconds"] = info["audio_seconds"]
+            result["cached"] = info["cached"]
+        result["notes"] = len(notes["pitch"])
+
+        print(f"   -> Found {result['notes']} distinct notes.")
+
+        if result["notes"] > 0:
+            track_name = audio_path.split(os.sep)[-2]
+            os.makedirs(output_dir, exist_ok=True)
+            xml_filename = f"{output_dir}/{track_name}.musicxml"
+
+            # Export is the last stage: skip it if this exact note set was already written there
+            if cache_dir is not None:
+                export_key = cache.stage_key(info["notes_key"], "export", {"xml": xml_filename})
+                if (os.path.exists(xml_filename)
+                        and cache.load(info["content_hash"], "export", export_key) is not None):
+                    result["cached"].append("export")
+                    result["xml"] = xml_filename
+
+            if result["xml"] is None:
+                # Analyze using your MIR tool (V2 Logic)
+                analysis = extractor.columns_to_notes(
+                    extractor.analyze_note_arrays(notes["pitch"], notes["duration"]))
+                extractor.export_musicxml(analysis, xml_filename)
+                result["xml"] = xml_filename
+                if cache_dir is not None:
+                    cache.save(info["content_hash"], "export", export_key, notes=np.int64(result["notes"]))
+        else:
+            print(
+                "   [SKIP] No clear notes detected (Audio might be silent).")
+
+    except Exception as e:
+        print(f"   [ERROR] Failed to process track: {e}")
+        result["error"] = str(e)
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def report_progress(done, total, result, started):
+    elapsed = time.perf_counter() - started
+    status = "ERROR" if result["error"] else "OK"
+    cached = f", cached: {'+'.join(result['cached'])}" if result.get("cached") else ""
+    print(f"[{done}/{total}] {status} {result['path']} "
+          f"({result['notes']} notes, {result['seconds']:.1f}s{cached}) | "
+          f"{done / elapsed * 60:.1f} tracks/min")
+
+
+def transcribe_collection(workers=1, cache_dir=TRANSCRIPTION_CACHE_DIR, chunk_workers=None):
+    """
+    Transcribes every Demucs 'other.wav' stem.
+    workers > 1 spreads tracks over a process pool (pyin is CPU-bound);
+    each worker writes its XML as soon as its track is done.
+    Unchanged stems are served from the transcription cache (cache_dir=None disables it).
+    In serial mode the chunks of each recording are spread over 'chunk_workers'
+    processes instead (default: all cores), so one long tape still uses the machine.
+    """
     # Find the 'other.wav' files recursively
     oud_tracks = glob.glob(f"{INPUT_STEMS_DIR}/**/other.wav", recursive=True)
 
     if not oud_tracks:
         print(
             f"No 'other.wav' files found in {INPUT_STEMS_DIR}. Did you run Demucs?")
-        return
+        return []
 
-    extractor = QaraamiExtractor()
+    started = time.perf_counter()
+    results = []
 
-    for audio_path in oud_tracks:
-        print(f"--- Processing: {audio_path} ---")
+    if workers <= 1:
+        for audio_path in oud_tracks:
+            results.append(transcribe_track(audio_path, cache_dir=cache_dir,
+                                            chunk_workers=chunk_workers or os.cpu_count()))
+            report_progress(len(results), len(oud_tracks), results[-1], started)
+    else:
+        print(f"Transcribing {len(oud_tracks)} tracks on {workers} workers...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(transcribe_track, path, cache_dir=cache_dir): path for path in oud_tracks}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process itself died (e.g. out of memory)
+                    result = {"path": futures[future], "notes": 0, "audio_seconds": 0.0,
+                              "xml": None, "error": str(e), "seconds": 0.0, "cached": []}
+                results.append(result)
+                report_progress(len(results), len(oud_tracks), result, started)
 
-        try:
-            # Load first 60 seconds (enough for a portfolio demo)
-            y, sr = librosa.load(audio_path, sr=22050, duration=60)
+    elapsed = time.perf_counter() - started
+    failed = [r for r in results if r["error"]]
+    audio_total = sum(r["audio_seconds"] for r in results)
+    print(f"\nDone: {len(results) - len(failed)} ok, {len(failed)} failed in {elapsed:.1f}s "
+          f"({audio_total / max(elapsed, 1e-9):.1f}x realtime)")
+    for r in failed:
+        print(f"   [FAILED] {r['path']}: {r['error']}")
+    return results
 
-            # Run the new "Smart" extraction
-            note_events = extract_smart_notes(y, sr)
 
-            print(f"   -> Found {len(note_events)} distinct notes.")
+def compare_pitch_backends(pattern=None, seconds=60, max_tracks=5, params=ANALYSIS_PARAMS):
+    """
+    Scores the fast backends against pyin on the first 'seconds' of each stem.
+      voicing:  frames inside notes where both agree on voiced/unvoiced
+      raw acc:  frames voiced in both, within 50 cents of pyin
+      note acc: notes whose median pitch is within 50 cents of pyin's median
+    Runtime is reported as seconds per minute of audio (onset detection excluded).
+    """
+    pattern = pattern or f"{INPUT_STEMS_DIR}/**/other.wav"
+    tracks = sorted(glob.glob(pattern, recursive=True))[:max_tracks]
+    if not tracks:
+        print(f"No tracks match {pattern}.")
+        return {}
 
-            if len(note_events) > 0:
-                # Analyze using your MIR tool (V2 Logic)
-                analysis = extractor.analyze_note_events(note_events)
+    print(f"--- PITCH BACKENDS vs pyin on {len(tracks)} tracks ({seconds}s each) ---")
+    totals = {b: {"seconds": 0.0, "voicing": [], "raw": [], "notes": []} for b in PITCH_BACKENDS}
+    audio_minutes = 0.0
 
-                track_name = audio_path.split(os.sep)[-2]
-                os.makedirs("dataset/sheet_music", exist_ok=True)
-                xml_filename = f"dataset/sheet_music/{track_name}.musicxml"
+    for path in tracks:
+        y, sr = librosa.load(path, sr=params["sr"], duration=seconds)
+        audio_minutes += len(y) / sr / 60
+        onset_times = detect_onsets(y, sr, params)
 
-                extractor.export_musicxml(analysis, xml_filename)
-            else:
-                print(
-                    "   [SKIP] No clear notes detected (Audio might be silent).")
+        f0s = {}
+        for backend in PITCH_BACKENDS:
+            start = time.perf_counter()
+            f0s[backend], times = track_pitch(y, sr, dict(params, pitch_backend=backend), onset_times)
+            totals[backend]["seconds"] += time.perf_counter() - start
 
-        except Exception as e:
-            print(f"   [ERROR] Failed to process track: {e}")
+        ref = f0s["pyin"]
+        bounds = np.searchsorted(times, onset_times)
+        in_notes = np.zeros(len(ref), dtype=bool)
+        if len(bounds) > 1:
+            in_notes[bounds[0]:bounds[-1]] = True
+
+        for backend in PITCH_BACKENDS[1:]:
+            est = f0s[backend]
+            both = in_notes & ~np.isnan(ref) & ~np.isnan(est)
+            cents = np.abs(1200 * np.log2(est[both] / ref[both]))
+            totals[backend]["voicing"].append(np.mean(np.isnan(ref[in_notes]) == np.isnan(est[in_notes])))
+            totals[backend]["raw"].append(np.mean(cents < 50) if both.any() else np.nan)
+
+            hits = []
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                r, e = ref[lo:hi], est[lo:hi]
+                if np.isnan(r).all() or np.isnan(e).all():
+                    continue
+                hits.append(abs(1200 * np.log2(np.nanmedian(e) / np.nanmedian(r))) < 50)
+            totals[backend]["notes"].append(np.mean(hits) if hits else np.nan)
+
+    print(f"{'backend':<10} {'s / audio-min':>14} {'speedup':>8} {'voicing':>8} {'raw acc':>8} {'note acc':>9}")
+    pyin_rate = totals["pyin"]["seconds"] / audio_minutes
+    for backend in PITCH_BACKENDS:
+        t = totals[backend]
+        rate = t["seconds"] / audio_minutes
+        if backend == "pyin":
+            print(f"{backend:<10} {rate:>14.2f} {1.0:>7.1f}x {'ref':>8} {'ref':>8} {'ref':>9}")
+        else:
+            print(f"{backend:<10} {rate:>14.2f} {pyin_rate / rate:>7.1f}x "
+                  f"{np.nanmean(t['voicing']):>8.1%} {np.nanmean(t['raw']):>8.1%} "
+                  f"{np.nanmean(t['notes']):>9.1%}")
+    return totals
 
 
 if __name__ == "__main__":
-    transcribe_collection()
+    if "--compare-backends" in sys.argv:
+        compare_pitch_backends()
+        sys.exit()
+    if "--check-chunking" in sys.argv:
+        check_chunking(sys.argv[sys.argv.index("--check-chunking") + 1])
+        sys.exit()
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    n_workers = int(args[0]) if args else os.cpu_count()
+    use_cache = "--no-cache" not in sys.argv
+    transcribe_collection(workers=n_workers, cache_dir=TRANSCRIPTION_CACHE_DIR if use_cache else None)
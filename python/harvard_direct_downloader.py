@@ -1,8 +1,8 @@
 import requests
 from bs4 import BeautifulSoup
-import subprocess
 import os
 import re
+from download_manager import DownloadManager
 
 # --- CONFIGURATION ---
 TARGET_URL = "https://nrs.lib.harvard.edu/urn-3:fhcl.loeb:33901487"
@@ -10,26 +10,22 @@ OUTPUT_DIR = "dataset/harvard_audio_direct"
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def download_stream(url, filename):
+STREAM_ARGS = [
+    "--user-agent", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "--referer", "https://nrs.lib.harvard.edu/",
+    "--no-check-certificate",
+    "--quiet", "--no-warnings"
+]
+
+def download_stream(url, filename, manager=None):
+    """Downloads through the shared manager: retried on failure, renamed into place when whole."""
     print(f"   Downloading to: {filename}")
-    cmd = [
-        "yt-dlp",
-        url,
-        "-o", filename,
- 
-        "--user-agent", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "--referer", "https://nrs.lib.harvard.edu/",
-        "--no-check-certificate", 
-        "--quiet", "--no-warnings"
-    ]
-    try:
-        subprocess.run(cmd, check=True)
-        print(f"   [SUCCESS] Saved.")
-    except subprocess.CalledProcessError:
-        print(f"   [FAILED] Download error.")
-        
-        
-        
+    if manager is None:
+        with DownloadManager(workers=1) as manager:
+            return manager.submit(url, filename, args=STREAM_ARGS).result()
+    return manager.submit(url, filename, args=STREAM_ARGS)
+
+
 def parse_harvard_page(url):
     print(f"--- ANALYZING HARVARD LINK ---")
     
@@ -1,14 +1,31 @@
 import requests
 from bs4 import BeautifulSoup
-import subprocess
+import asyncio
+import aiohttp
 import os
+import sys
 import time
-import re
+from urllib.parse import urlsplit
+from resolution_cache import ResolutionCache, RESOLUTION_DB
+from download_manager import DownloadManager
+from catalog_store import CatalogStore, CATALOG_DB, safe_title
 
 # --- CONFIGURATION ---
 INPUT_FILE = 'harvard_somali_data.csv'
 OUTPUT_DIR = 'dataset/audio_files'
 
+CATALOG_URL = "https://id.lib.harvard.edu/ead/c/{component_id}/catalog"
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+NRS_MARKERS = ('nrs.harvard.edu', 'nrs.lib.harvard.edu')
+MEDIA_MARKERS = ('mps.lib.harvard.edu', 'sds')
+
+# Crawler politeness
+CONCURRENCY = 8          # requests in flight overall
+RATE_PER_HOST = 2.0      # requests per second per host (token bucket refill)
+BURST = 4                # token bucket size
+DOWNLOAD_WORKERS = 2
+YTDLP_ARGS = ["--quiet", "--no-warnings"]
+
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # --- 1. NETWORK FUNCTIONS ---
@@ -22,117 +39,418 @@ def resolve_nrs_link(nrs_url):
         final_url = response.url
 
         # Check if the final destination is the Media Server (MPS/SDS)
-        if 'mps.lib.harvard.edu' in final_url or 'sds' in final_url:
+        if any(marker in final_url for marker in MEDIA_MARKERS):
             return final_url
         return None
-    except:
+    except requests.RequestException:
         return None
 
 
 def get_audio_url(component_id):
     """
     Scrapes the catalog page for ANY link that looks like a digital object.
+    Blocking version, kept for one-off lookups; the crawl uses AsyncCrawler.
     """
     # Try the finding aid URL
-    catalog_url = f"https://id.lib.harvard.edu/ead/c/{component_id}/catalog"
+    catalog_url = CATALOG_URL.format(component_id=component_id)
 
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(catalog_url, headers=headers, timeout=10)
+        response = requests.get(catalog_url, headers=HEADERS, timeout=10)
 
         if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
+            unresolved = set()
+            for kind, href in find_audio_links(response.content):
+                if kind in ("nrs", "listen-nrs"):
+                    url = None if href in unresolved else resolve_nrs_link(href)
+                    unresolved.add(href)
+                else:
+                    url = href
+                if url or kind == "listen-nrs":
+                    return url
 
-            all_links = soup.find_all('a', href=True)
+        return None
+    except requests.RequestException:
+        return None
 
-            for link in all_links:
-                href = link['href']
 
-                # Check for NRS links
-                if 'nrs.harvard.edu' in href:
-                    resolved = resolve_nrs_link(href)
-                    if resolved:
-                        return resolved
+def find_audio_links(html):
+    """
+    Candidate audio links of a catalog page, in the order they should be tried:
+      ("nrs", href)         NRS link; use it if it resolves to the media server
+      ("direct", href)      direct MPS/SDS link (rare but possible)
+      ("listen-nrs", href)  "Listen" link through NRS; final answer even if unresolved
+      ("listen", href)      any other "Listen" link; final answer
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    candidates = []
 
-                # Check for direct MPS/SDS links (rare but possible)
-                if 'mps.lib.harvard.edu' in href:
-                    return href
+    for link in soup.find_all('a', href=True):
+        href = link['href']
 
-                # Check for "Listen" text specifically
-                if link.string and "Listen" in link.string:
-                    if 'nrs' in href:
-                        return resolve_nrs_link(href)
-                    return href
+        # Check for NRS links
+        if any(marker in href for marker in NRS_MARKERS):
+            candidates.append(("nrs", href))
 
-        return None
-    except Exception as e:
-        # print(f"Debug: {e}")
-        return None
+        # Check for direct MPS/SDS links
+        if 'mps.lib.harvard.edu' in href:
+            candidates.append(("direct", href))
 
+        # Check for "Listen" text specifically
+        elif link.string and "Listen" in link.string:
+            candidates.append(("listen-nrs" if 'nrs' in href else "listen", href))
 
-def download_audio(url, filename):
-    if os.path.exists(filename):
-        print(f"   [EXISTS] Skipping.")
-        return
+    return candidates
 
-    # Use yt-dlp to handle the stream
-    cmd = [
-        "yt-dlp",
-        url,
-        "-o", filename,
-        "--quiet", "--no-warnings"
-    ]
-
-    try:
-        subprocess.run(cmd, check=True)
-        print(f"   [SUCCESS] Downloaded: {os.path.basename(filename)}")
-    except:
-        print(f"   [ERROR] Download failed.")
-
-# --- 2. PARSER LOOP ---
 
+def download_audio(url, filename, manager=None):
+    """
+    Queues the stream on 'manager' and returns its Future; without a manager
+    it downloads right away and returns the result. yt-dlp handles the stream.
+    """
+    if manager is None:
+        with DownloadManager(workers=1) as manager:
+            return manager.submit(url, filename, args=YTDLP_ARGS).result()
+    return manager.submit(url, filename, args=YTDLP_ARGS)
 
-print(f"--- PARSING HARVARD ARCHIVE (NRS RESOLVER MODE) ---")
+# --- 2. ASYNC CRAWLER ---
 
-track_count = 0
 
-with open(INPUT_FILE, 'r', encoding='utf-8', errors='ignore') as f:
-    for line in f:
-        # 1. Regex to find ID
-        id_match = re.search(r'(mus00044c\d+)', line)
+class TokenBucket:
+    """
+    Politeness limiter: 'rate' tokens per second, at most 'burst' saved up.
+    Each request takes one token and waits when the bucket is empty.
+    """
+    def __init__(self, rate=RATE_PER_HOST, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncCrawler:
+    """
+    Resolves catalog IDs to audio URLs concurrently over one pooled HTTP session.
+    'concurrency' bounds requests in flight; every host gets its own TokenBucket,
+    so the catalog and the NRS resolver are each paced at rate_per_host.
+    With a ResolutionCache, fresh results skip the network entirely and stale
+    ones are revalidated with a conditional request.
+    """
+    def __init__(self, concurrency=CONCURRENCY, rate_per_host=RATE_PER_HOST, burst=BURST,
+                 catalog_url=CATALOG_URL, timeout=10, cache=None):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.catalog_url = catalog_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.buckets = {}
+        self.requests = 0
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _request(self, method, url, headers=None):
+        """
+        Returns (status, final url, body or None, validators).
+        Network errors count as status None.
+        """
+        host = urlsplit(url).netloc
+        bucket = self.buckets.setdefault(host, TokenBucket(self.rate_per_host, self.burst))
+        await bucket.acquire()
+        async with self.semaphore:
+            self.requests += 1
+            try:
+                async with self.session.request(method, url, allow_redirects=True,
+                                                headers=headers) as response:
+                    body = await response.read() if method == "GET" else None
+                    validators = {"etag": response.headers.get("ETag"),
+                                  "last_modified": response.headers.get("Last-Modified")}
+                    return response.status, str(response.url), body, validators
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None, url, None, {}
+
+    @staticmethod
+    def _definitive(status):
+        # Only real answers are worth caching, not outages or throttling
+        return status is not None and status < 500 and status != 429
+
+    async def _cached(self, kind, key, fetch):
+        """
+        Cache wrapper: fetch(headers) -> (status, result, cacheable, validators).
+        A 304 confirms the cached result; anything not cacheable is not stored.
+        Returns (result, cacheable) so callers can tell a real "no" from an outage.
+        """
+        row, fresh = self.cache.lookup(kind, key) if self.cache else (None, False)
+        if fresh:
+            return row["url"], True
+
+        status, result, cacheable, validators = await fetch(ResolutionCache.conditional_headers(row))
+        if status == 304 and row is not None:
+            self.cache.touch(kind, key)
+            return row["url"], True
+        if self.cache and cacheable:
+            self.cache.store(kind, key, result, **validators)
+        return result, cacheable
+
+    async def _fetch_nrs(self, nrs_url, headers):
+        status, final_url, _, validators = await self._request("HEAD", nrs_url, headers)
+        # Check if the final destination is the Media Server (MPS/SDS)
+        resolved = final_url if any(marker in final_url for marker in MEDIA_MARKERS) else None
+        return status, resolved if status is not None else None, self._definitive(status), validators
+
+    async def resolve_nrs_link(self, nrs_url):
+        url, _ = await self._cached("nrs", nrs_url, lambda headers: self._fetch_nrs(nrs_url, headers))
+        return url
+
+    async def get_audio_url(self, component_id):
+        """Same search order as get_audio_url(), without blocking."""
+        async def fetch(headers):
+            page_url = self.catalog_url.format(component_id=component_id)
+            status, _, body, validators = await self._request("GET", page_url, headers)
+            if status != 200:
+                # 404 etc. is a cacheable "no audio"; 304 is handled by _cached
+                return status, None, self._definitive(status) and status != 304, validators
+
+            unresolved = set()
+            complete = True # False if an NRS lookup failed for a transient reason
+            for kind, href in find_audio_links(body):
+                if kind in ("nrs", "listen-nrs"):
+                    # A "Listen" NRS link is often the same href that just failed
+                    url, definitive = (None, True) if href in unresolved else await self._cached(
+                        "nrs", href, lambda headers, href=href: self._fetch_nrs(href, headers))
+                    complete &= definitive
+                    unresolved.add(href)
+                else:
+                    url = href
+                if url or kind == "listen-nrs":
+                    return status, url, complete, validators
+            return status, None, complete, validators
+
+        url, _ = await self._cached("catalog", component_id, fetch)
+        return url
+
+    async def crawl(self, items, found):
+        """
+        Resolves every (mus_id, title) in 'items' and puts (mus_id, title, url)
+        on the 'found' queue the moment it is known, so downloads start while
+        the crawl is still running. Returns the number of IDs checked.
+        """
+        async def check(mus_id, title):
+            audio_url = await self.get_audio_url(mus_id)
+            if audio_url:
+                print(f"   -> FOUND AUDIO: {mus_id} | {audio_url}")
+                await found.put((mus_id, title, audio_url))
 
-        if id_match:
-            mus_id = id_match.group(1)
+        items = list(items)
+        await asyncio.gather(*(check(mus_id, title) for mus_id, title in items))
+        return len(items)
 
-            # 2. Improved Title Extraction
 
-            clean_line = line.replace(mus_id, "").strip()
+async def download_worker(found, resolved, output_dir=OUTPUT_DIR, manager=None):
+    """
+    Drains the 'found' queue, handing each URL to the download manager
+    (which does not block: its own pool runs the downloads).
+    With manager=None the URLs are only collected (dry run).
+    """
+    while True:
+        entry = await found.get()
+        if entry is None:
+            return
+        mus_id, title, url = entry
+        resolved.append(url)
+        if manager is not None:
+            download_audio(url, os.path.join(output_dir, f"{mus_id}_{title}.mp3"), manager)
 
-            # Split by tabs first, take the longest segment usually being the title
-            parts = [p.strip() for p in re.split(
-                r'\t|,', clean_line) if len(p.strip()) > 3]
 
-            if parts:
-                raw_title = parts[0]
-                safe_title = re.sub(
-                    r'[^\w\s-]', '', raw_title)[:40].strip().replace(" ", "_")
-            else:
-                safe_title = "Audio_Track"
+async def crawl_and_download(items, output_dir=OUTPUT_DIR, manager=None, **crawler_args):
+    """
+    Runs the crawl and the downloads side by side; returns the audio URLs found.
+    Downloads keep running on 'manager' after the crawl; the caller waits on it.
+    """
+    found = asyncio.Queue()
+    resolved = []
+    worker = asyncio.create_task(download_worker(found, resolved, output_dir, manager))
 
-            print(f"Checking: {mus_id} | {safe_title}")
+    try:
+        async with AsyncCrawler(**crawler_args) as crawler:
+            started = time.perf_counter()
+            n_checked = await crawler.crawl(items, found)
+            elapsed = time.perf_counter() - started
+            print(f"Crawled {n_checked} IDs with {crawler.requests} requests in {elapsed:.1f}s.")
+            if crawler.cache:
+                print(f"   {crawler.cache}")
+    finally:
+        # Also on a failed crawl: hand off what was found, don't leave the worker pending
+        await found.put(None)
+        await worker
+    return resolved
+
+# --- 3. PARSER ---
+
+
+def read_catalog_items(input_file=INPUT_FILE, series=None, catalog=None):
+    """
+    (mus_id, safe_title) for every catalog component without downloaded audio,
+    from the indexed catalog store (re-ingested first if the export changed).
+    """
+    store = catalog or CatalogStore(CATALOG_DB)
+    store.ingest(input_file)
+    store.sync_downloads(OUTPUT_DIR)
+    items = [(item["id"], safe_title(item["title"])) for item in store.pending(series=series)]
+    if catalog is None:
+        store.close()
+    return items
 
-            # 3. Get Audio Link
-            audio_url = get_audio_url(mus_id)
+# --- 4. STUB SERVER SELF-TEST ---
 
-            if audio_url:
-                print(f"   -> FOUND AUDIO: {audio_url}")
-                filename = os.path.join(
-                    OUTPUT_DIR, f"{mus_id}_{safe_title}.mp3")
-                download_audio(audio_url, filename)
-                track_count += 1
-                time.sleep(1)
-            else:
-                pass
 
+async def selftest(n_items=40, rate_per_host=20.0):
+    """
+    Crawls a local stub of the catalog + NRS resolver and checks the results:
+    every 3rd ID has no page (404), every 5th a page without audio, the rest an
+    NRS link that redirects to an SDS URL. Also checks the per-host rate limit,
+    the hand-off to the download manager (with a fake yt-dlp), and the
+    resolution cache: a second crawl must not touch the network, and a
+    crawl with expired entries must revalidate them with 304s.
+    """
+    from aiohttp import web
+    import tempfile
+    import socket
+
+    def has_audio(i):
+        return i % 3 != 0 and i % 5 != 0
+
+    def etagged(request, etag, text):
+        if request.headers.get("If-None-Match") == etag:
+            raise web.HTTPNotModified()
+        return web.Response(text=text, content_type="text/html", headers={"ETag": etag})
+
+    async def catalog(request):
+        i = int(request.match_info["component_id"][len("mus00044c"):])
+        if i % 3 == 0:
+            raise web.HTTPNotFound()
+        if i % 5 == 0:
+            return etagged(request, f'"c{i}"', "<html><a href='/about'>About</a></html>")
+        nrs = f"http://127.0.0.1:{port}/nrs.harvard.edu/urn-3:{i}"
+        return etagged(request, f'"c{i}"', f"<html><a href='{nrs}'>Listen</a></html>")
+
+    async def nrs(request):
+        raise web.HTTPFound(f"/mps.lib.harvard.edu/sds/audio/{request.match_info['urn']}")
+
+    async def media(request):
+        return etagged(request, f'"m{request.match_info["urn"]}"', "audio")
+
+    app = web.Application()
+    app.router.add_get("/ead/c/{component_id}/catalog", catalog)
+    app.router.add_route("*", "/nrs.harvard.edu/urn-3:{urn}", nrs)
+    app.router.add_route("*", "/mps.lib.harvard.edu/sds/audio/{urn}", media)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # Bind the listening socket here so the free port is known up front
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    await web.SockSite(runner, sock).start()
+
+    items = [(f"mus00044c{i}", f"Title_{i}") for i in range(n_items)]
+    expected = sorted(f"http://127.0.0.1:{port}/mps.lib.harvard.edu/sds/audio/{i}"
+                      for i in range(n_items) if has_audio(i))
+    n_requests = n_items + len(expected)
+
+    async def crawl(cache, output_dir=OUTPUT_DIR, manager=None):
+        started = time.perf_counter()
+        resolved = await crawl_and_download(
+            items, output_dir, manager, rate_per_host=rate_per_host, burst=1,
+            catalog_url=f"http://127.0.0.1:{port}/ead/c/{{component_id}}/catalog", cache=cache)
+        assert sorted(resolved) == expected, "resolved URLs do not match the stub"
+        return time.perf_counter() - started
 
-print(f"\nDone. Processed {track_count} files.")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "resolutions.sqlite")
+            audio_dir = os.path.join(tmp, "audio")
+            os.makedirs(audio_dir)
+            # Fake yt-dlp: writes the URL it was given into the -o file
+            fake = os.path.join(tmp, "fake_ytdlp.py")
+            with open(fake, "w") as f:
+                f.write("import sys\nopen(sys.argv[3], 'w').write(sys.argv[1])\n")
+
+            cache = ResolutionCache(db)
+            with DownloadManager(workers=DOWNLOAD_WORKERS, command=[sys.executable, fake]) as manager:
+                elapsed = await crawl(cache, audio_dir, manager)
+                results = manager.wait()
+            # One host, burst 1: requests cannot start faster than rate_per_host
+            assert elapsed >= (n_requests - 1) / rate_per_host * 0.95, "rate limit not respected"
+            assert cache.misses == n_requests
+            cache.close()
+
+            # Every resolved URL was downloaded under its catalog ID, renamed into place
+            assert len(results) == len(expected) and all(r["ok"] for r in results), "downloads failed"
+            files = sorted(os.listdir(audio_dir))
+            assert not [name for name in files if name.endswith(".part")], "leftover .part files"
+            assert files == sorted(f"mus00044c{i}_Title_{i}.mp3" for i in range(n_items) if has_audio(i))
+            for name in files:
+                i = int(name.split("_")[0][len("mus00044c"):])
+                with open(os.path.join(audio_dir, name)) as f:
+                    assert f.read().endswith(f"/sds/audio/{i}"), f"{name} has the wrong content"
+
+            cache = ResolutionCache(db)
+            await crawl(cache)
+            assert cache.hits == n_items and cache.misses == 0, f"warm crawl hit the network: {cache}"
+            cache.close()
+
+            cache = ResolutionCache(db, ttl=0, negative_ttl=0)
+            await crawl(cache)
+            # Every page with an ETag comes back 304 (its NRS link is then not even needed)
+            n_404 = len(range(0, n_items, 3))
+            assert cache.revalidated == n_items - n_404, f"expected 304 revalidations: {cache}"
+            cache.close()
+    finally:
+        await runner.cleanup()
+
+    print(f"[SELFTEST OK] {len(expected)}/{n_items} IDs with audio, {n_requests} requests "
+          f"in {elapsed:.2f}s (limit {rate_per_host:.0f}/s), all downloaded; warm re-crawl "
+          f"fully cached, expired entries revalidated by 304")
+
+
+def main():
+    print(f"--- PARSING HARVARD ARCHIVE (ASYNC NRS RESOLVER MODE) ---")
+    series = sys.argv[sys.argv.index("--series") + 1] if "--series" in sys.argv else None
+    catalog = CatalogStore(CATALOG_DB)
+    items = read_catalog_items(series=series, catalog=catalog)
+    print(f"{len(items)} catalog IDs to check ({catalog}).")
+    cache = None if "--no-cache" in sys.argv else ResolutionCache(RESOLUTION_DB)
+    with DownloadManager(workers=DOWNLOAD_WORKERS) as manager:
+        resolved = asyncio.run(crawl_and_download(items, manager=manager, cache=cache))
+        manager.wait()
+        manager.report()
+    catalog.sync_downloads(OUTPUT_DIR)
+    catalog.close()
+    print(f"\nDone. Processed {len(resolved)} files.")
+
+
+if __name__ == "__main__":
+    if "--selftest" in sys.argv:
+        asyncio.run(selftest())
+    else:
+        main()
@@ -0,0 +1,271 @@
+import numpy as np
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import auto_slicer
+import run_demucs
+import generate_sheet_music
+
+# ==============================================================================
+# INGEST PIPELINE: SLICE -> SEPARATE -> TRANSCRIBE, ONE TRACK AT A TIME
+# Replaces running the three batch scripts back to back. Each track flows
+# through every stage as soon as it is sliced; bounded queues between stages
+# keep memory flat and make a slow stage throttle the ones before it.
+# ==============================================================================
+
+STATE_FILE = "dataset/pipeline_state.jsonl"
+QUEUE_SIZE = 2
+SEPARATE_WORKERS = 1     # each holds a full htdemucs model
+TRANSCRIBE_WORKERS = 2
+
+_DONE = object()         # end-of-stream marker passed down the queues
+
+class PipelineState:
+    """
+    Append-only JSONL record of finished (track, stage) pairs.
+    A line is only written after the stage's output is complete on disk,
+    so after a crash every recorded stage can be trusted and skipped.
+    """
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.done = set()
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # torn last line from a crash
+                    self.done.add((entry["track"], entry["stage"]))
+
+    def is_done(self, track, stage):
+        return (track, stage) in self.done
+
+    def mark(self, track, stage, **info):
+        with self.lock:
+            self.done.add((track, stage))
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(dict(track=track, stage=stage, time=time.time(), **info)) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+class StageMetrics:
+    """Latency (queue wait + service time) and throughput for one stage."""
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.service = []
+        self.waits = []
+        self.skipped = 0
+        self.failed = 0
+        self.first_start = None
+        self.last_end = None
+
+    def record(self, wait, service):
+        now = time.perf_counter()
+        with self.lock:
+            self.waits.append(wait)
+            self.service.append(service)
+            if self.first_start is None:
+                self.first_start = now - service
+            self.last_end = now
+
+    def summary(self):
+        n = len(self.service)
+        span = (self.last_end - self.first_start) if n else 0.0
+        return {
+            "stage": self.name,
+            "done": n,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "mean_s": float(np.mean(self.service)) if n else 0.0,
+            "p95_s": float(np.percentile(self.service, 95)) if n else 0.0,
+            "wait_s": float(np.mean(self.waits)) if n else 0.0,
+            "per_min": n / span * 60 if span > 0 else 0.0
+        }
+
+class Stage:
+    """
+    One pipeline stage: 'workers' dispatcher threads, each pulling a track from
+    the inbox, running 'fn' on the stage's process pool and pushing the result
+    to the outbox. A full outbox blocks the dispatcher, which is the backpressure.
+    fn(item) returns the next item, or raises to drop the track.
+    """
+    def __init__(self, name, fn, workers, inbox, outbox, state, skip=None, next_item=None,
+                 initializer=None, initargs=()):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.state = state
+        self.skip = skip              # item -> True if the stage's output can be reused
+        self.next_item = next_item    # item -> next item when skipping
+        self.metrics = StageMetrics(name)
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+        self.threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+                        for i in range(workers)]
+        self.remaining = workers
+        self.lock = threading.Lock()
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                self.inbox.put(_DONE) # let sibling threads see it too
+                break
+
+            track = item["track"]
+            if self.skip is not None and self.state.is_done(track, self.name) and self.skip(item):
+                with self.metrics.lock:
+                    self.metrics.skipped += 1
+                self.outbox.put(self.next_item(item))
+                continue
+
+            started = time.perf_counter()
+            wait = started - item["queued"]
+            try:
+                out = self.pool.submit(self.fn, item).result()
+            except Exception as e:
+                print(f"   [{self.name.upper()} ERROR] {track}: {e}")
+                with self.metrics.lock:
+                    self.metrics.failed += 1
+                continue
+            service = time.perf_counter() - started
+            self.metrics.record(wait, service)
+            self.state.mark(track, self.name, seconds=round(service, 3))
+            print(f"   [{self.name}] {track} ({service:.1f}s, waited {wait:.1f}s)")
+
+            out["queued"] = time.perf_counter()
+            self.outbox.put(out)
+
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.pool.shutdown()
+            self.outbox.put(_DONE)
+
+# --- Stage functions (run inside the worker processes) ---
+
+def separate_item(item):
+    run_demucs.separate_track(item["path"])
+    return _stems_item(item)
+
+def _stems_item(item):
+    stems = os.path.join(run_demucs.stem_dir(item["path"]), f"{run_demucs.STEM}.wav")
+    return dict(item, path=stems, queued=time.perf_counter())
+
+def transcribe_item(item):
+    result = generate_sheet_music.transcribe_track(item["path"])
+    if result["error"]:
+        raise RuntimeError(result["error"])
+    return dict(item, xml=result["xml"], notes=result["notes"])
+
+def _xml_exists(item):
+    track = os.path.basename(os.path.dirname(item["path"]))
+    return os.path.exists(f"{generate_sheet_music.SHEET_MUSIC_DIR}/{track}.musicxml")
+
+def run_pipeline(tape=auto_slicer.INPUT_AUDIO, separate_workers=SEPARATE_WORKERS,
+                 transcribe_workers=TRANSCRIBE_WORKERS, queue_size=QUEUE_SIZE, state_file=STATE_FILE):
+    """
+    Streams the tape through slicing (this thread), Demucs and transcription.
+    Track N is transcribed while track N+1 is separated and N+2 is sliced.
+    Re-running after a crash skips every (track, stage) already in state_file
+    whose output still exists, so only unfinished work is redone.
+    If slicing fails, the tracks already queued still run to the end and the
+    error is re-raised after the summary.
+    """
+    state = PipelineState(state_file)
+    to_separate = queue.Queue(maxsize=queue_size)
+    to_transcribe = queue.Queue(maxsize=queue_size)
+    finished = queue.Queue()
+
+    threads = max(1, (os.cpu_count() or 1) // (separate_workers + transcribe_workers))
+    separate = Stage("separate", separate_item, separate_workers, to_separate, to_transcribe, state,
+                     skip=lambda item: run_demucs.has_stems(item["path"]),
+                     next_item=_stems_item,
+                     initializer=run_demucs._init_worker,
+                     initargs=(run_demucs.MODEL_NAME, 0, None, threads)).start()
+    transcribe = Stage("transcribe", transcribe_item, transcribe_workers, to_transcribe, finished, state,
+                       skip=_xml_exists, next_item=lambda item: dict(item, queued=time.perf_counter())).start()
+
+    print(f"--- INGEST PIPELINE: {tape} ---")
+    started = time.perf_counter()
+    slicing = StageMetrics("slice")
+    min_samples = auto_slicer.MIN_TRACK_LEN * auto_slicer.SAMPLE_RATE // 1000
+    track_started = {}
+
+    # Slicing is sequential by nature (one tape), so it runs right here
+    failure = None
+    try:
+        t0 = time.perf_counter()
+        for number, start_sec, samples in auto_slicer.stream_tracks(tape):
+            if len(samples) < min_samples:
+                continue
+            track = f"track_{number}"
+            out_file = os.path.join(auto_slicer.OUTPUT_DIR, f"{track}.wav")
+
+            if state.is_done(track, "slice") and os.path.exists(out_file):
+                slicing.skipped += 1
+            else:
+                # Lossless: Demucs decodes it again right away, no point encoding
+                auto_slicer.export_track(samples, out_file, auto_slicer.SAMPLE_RATE, "wav")
+                slicing.record(0.0, time.perf_counter() - t0)
+                state.mark(track, "slice", start_sec=round(start_sec, 2))
+                print(f"   [slice] {track} ({len(samples) / auto_slicer.SAMPLE_RATE:.0f}s of audio)")
+
+            track_started[track] = time.perf_counter()
+            to_separate.put({"track": track, "path": out_file, "queued": time.perf_counter()})
+            t0 = time.perf_counter()
+    except Exception as e:
+        # Even if slicing dies, let the tracks already queued finish; re-raised below
+        print(f"   [ERROR] slicing stopped: {e}")
+        failure = e
+    finally:
+        to_separate.put(_DONE)
+
+    latencies = []
+    while True:
+        item = finished.get()
+        if item is _DONE:
+            break
+        latencies.append(time.perf_counter() - track_started[item["track"]])
+
+    elapsed = time.perf_counter() - started
+    print(f"\n--- PIPELINE DONE in {elapsed:.1f}s: {len(latencies)} tracks fully transcribed ---")
+    print(f"{'stage':<11} {'done':>5} {'skip':>5} {'fail':>5} {'mean s':>8} {'p95 s':>8} "
+          f"{'wait s':>8} {'/min':>6}")
+    summaries = [m.summary() for m in (slicing, separate.metrics, transcribe.metrics)]
+    for s in summaries:
+        print(f"{s['stage']:<11} {s['done']:>5} {s['skipped']:>5} {s['failed']:>5} {s['mean_s']:>8.1f} "
+              f"{s['p95_s']:>8.1f} {s['wait_s']:>8.1f} {s['per_min']:>6.1f}")
+    if latencies:
+        print(f"End-to-end latency per track: mean {np.mean(latencies):.1f}s, "
+              f"p95 {np.percentile(latencies, 95):.1f}s")
+    if failure is not None:
+        raise failure
+    return summaries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Slice -> separate -> transcribe, streamed per track.")
+    parser.add_argument("--tape", default=auto_slicer.INPUT_AUDIO)
+    parser.add_argument("--separate-workers", type=int, default=SEPARATE_WORKERS)
+    parser.add_argument("--transcribe-workers", type=int, default=TRANSCRIBE_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="tracks allowed to wait between two stages")
+    args = parser.parse_args()
+
+    run_pipeline(args.tape, args.separate_workers, args.transcribe_workers, args.queue_size)
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+# ==============================================================================
+# PLUCK CACHE (LRU MEMOIZATION FOR SYNTHESIZED NOTES)
+# Shared by dhaanto_oud_engine.py and qarami_masterpiece.py
+# ==============================================================================
+
+class PluckCache:
+    """
+    Memoizes rendered note waveforms keyed on (freq, duration, volume bucket, seed).
+    Entries are evicted least-recently-used first once the memory budget is hit.
+    Cached arrays are read-only: callers must copy before modifying them.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, volume_step=0.05):
+        self.max_bytes = max_bytes
+        self.volume_step = volume_step
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, freq, duration, volume=1.0, seed=None):
+        """
+        Rounds the float parameters so tiny float noise still hits the same entry.
+        """
+        volume_bucket = round(round(volume / self.volume_step) * self.volume_step, 6)
+        return (round(float(freq), 6), round(float(duration), 6), volume_bucket, seed)
+
+    def get(self, key):
+        """Cached waveform for 'key', or None on a miss."""
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, wave):
+        """
+        Stores a freshly rendered waveform and returns it (now read-only).
+        """
+        wave.setflags(write=False)
+
+        # Too big to ever fit: hand it back without caching
+        if wave.nbytes > self.max_bytes:
+            return wave
+
+        while self.current_bytes + wave.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+        self.entries[key] = wave
+        self.current_bytes += wave.nbytes
+        return wave
+
+    def get_or_render(self, key, render_fn):
+        """
+        Returns the cached waveform for 'key', calling render_fn() on a miss.
+        """
+        wave = self.get(key)
+        if wave is None:
+            wave = self.put(key, render_fn())
+        return wave
+
+    def clear(self):
+        """Drops every entry and starts the statistics over."""
+        self.entries.clear()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def __repr__(self):
+        s = self.stats()
+        return (f"PluckCache(hits={s['hits']}, misses={s['misses']}, "
+                f"evictions={s['evictions']}, entries={s['entries']}, "
+                f"{s['bytes'] / 1e6:.1f} MB, hit_rate={s['hit_rate']:.0%})")
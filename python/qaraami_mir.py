@@ -1,138 +1,214 @@
 import numpy as np
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from xml.sax.saxutils import escape, quoteattr
 
 class QaraamiExtractor:
     """
     V3: Fixed MusicXML Duration Logic so notes appear in MuseScore.
     """
+    # Rhythm classes: duration (sec) bin edges -> MusicXML type / duration
+    # We enforce a 'Divisions' value of 4 in the XML
+    # Quarter = 4, Eighth = 2, 16th = 1, Half = 8
+    RHYTHM_BINS = np.array([0.2, 0.4, 0.8])
+    RHYTHM_TYPES = np.array(["16th", "eighth", "quarter", "half"])
+    RHYTHM_DIVISIONS = np.array([1, 2, 4, 8])
+    MICROTONE_CENTS = 35 # Deviation beyond this is a neutral (quarter-tone) note
+
     def __init__(self):
         self.MICROTONE_THRESHOLDS = [150, 350] 
 
+    def analyze_note_arrays(self, pitches, durations=None):
+        """
+        Columnar version of analyze_note_events.
+        Input: pitch (Hz) and duration (sec) arrays, or one structured array
+        with 'pitch' and 'duration' fields.
+        Output: dict of equal-length arrays, one row per valid note
+        (rows with pitch <= 0 or NaN are dropped):
+          source_index, midi, cents_dev, microtonal, rhythm_class,
+          rhythm_type, xml_duration
+        """
+        if durations is None:
+            pitches, durations = pitches['pitch'], pitches['duration']
+        pitches = np.asarray(pitches, dtype=np.float64)
+        durations = np.asarray(durations, dtype=np.float64)
+
+        valid = np.flatnonzero(pitches > 0) # NaN compares False, so it drops too
+        freq = pitches[valid]
+
+        # Convert Hz to MIDI
+        midi_float = 69 + 12 * np.log2(freq / 440.0)
+        midi_int = np.round(midi_float).astype(int)
+
+        # Calculate deviation (Cents)
+        deviation = (midi_float - midi_int) * 100
+
+        # Calculate Rhythm Type
+        rhythm_class = np.digitize(durations[valid], self.RHYTHM_BINS)
+
+        return {
+            "source_index": valid,
+            "midi": midi_int,
+            "cents_dev": deviation,
+            "microtonal": np.abs(deviation) > self.MICROTONE_CENTS,
+            "rhythm_class": rhythm_class,
+            "rhythm_type": self.RHYTHM_TYPES[rhythm_class],
+            "xml_duration": self.RHYTHM_DIVISIONS[rhythm_class]
+        }
+
+    def columns_to_notes(self, columns):
+        """Columnar analysis -> list of note dicts (the export_musicxml format)."""
+        note_types = np.where(columns["microtonal"], "Microtonal_Neutral", "Standard")
+        return [
+            {
+                "midi": midi,
+                "cents_dev": cents,
+                "type": note_type,
+                "rhythm_type": rhythm_type,
+                "xml_duration": xml_duration
+            }
+            for midi, cents, note_type, rhythm_type, xml_duration in zip(
+                columns["midi"].tolist(), columns["cents_dev"].tolist(),
+                note_types.tolist(), columns["rhythm_type"].tolist(),
+                columns["xml_duration"].tolist())
+        ]
+
     def analyze_note_events(self, note_events):
         """
         Input: List of dictionaries [{'pitch': 146.8, 'duration': 0.5}, ...]
         Output: List of processed notes with MIDI and Microtone data.
+        Thin wrapper over analyze_note_arrays.
         """
-        processed_notes = []
-        
-        for event in note_events:
-            freq = event['pitch']
-            duration = event['duration']
-            
-            if freq <= 0 or np.isnan(freq): continue 
-
-            # Convert Hz to MIDI
-            midi_float = 69 + 12 * np.log2(freq / 440.0)
-            midi_int = int(round(midi_float))
-            
-            # Calculate deviation (Cents)
-            deviation = (midi_float - midi_int) * 100
-            
-            # Detect Microtone
-            note_type = "Standard"
-            if abs(deviation) > 35: 
-                note_type = "Microtonal_Neutral"
-            
-            # Calculate Rhythm Type
-            # We enforce a 'Divisions' value of 4 in the XML
-            # Quarter = 4, Eighth = 2, 16th = 1, Half = 8
-            xml_type = "quarter"
-            xml_duration = 4
-            
-            if duration < 0.2: 
-                xml_type = "16th"
-                xml_duration = 1
-            elif duration < 0.4: 
-                xml_type = "eighth"
-                xml_duration = 2
-            elif duration < 0.8: 
-                xml_type = "quarter"
-                xml_duration = 4
-            else: 
-                xml_type = "half"
-                xml_duration = 8
-
-            processed_notes.append({
-                "midi": midi_int,
-                "cents_dev": deviation,
-                "type": note_type,
-                "rhythm_type": xml_type,
-                "xml_duration": xml_duration
-            })
-            
-        return processed_notes
-
-    def export_musicxml(self, notes_data, filename="qaraami_sheet.xml"):
-        score = ET.Element("score-partwise", version="3.1")
-        part_list = ET.SubElement(score, "part-list")
-        score_part = ET.SubElement(part_list, "score-part", id="P1")
-        ET.SubElement(score_part, "part-name").text = "Somali Oud (AI)"
-        
-        part = ET.SubElement(score, "part", id="P1")
-        measure = ET.SubElement(part, "measure", number="1")
-        
-        # Setup Attributes
-        attributes = ET.SubElement(measure, "attributes")
-        divisions = ET.SubElement(attributes, "divisions")
-       
-        divisions.text = "4" 
-        
-        ET.SubElement(ET.SubElement(attributes, "key"), "fifths").text = "0"
-        
-        time = ET.SubElement(attributes, "time")
-        ET.SubElement(time, "beats").text = "4"
-        ET.SubElement(time, "beat-type").text = "4"
-        
-        clef = ET.SubElement(attributes, "clef")
-        ET.SubElement(clef, "sign").text = "G"
-        ET.SubElement(clef, "line").text = "2"
-
-        step_map = {0:'C', 1:'C', 2:'D', 3:'D', 4:'E', 5:'F', 6:'F', 7:'G', 8:'G', 9:'A', 10:'A', 11:'B'}
-        
-        current_measure_duration = 0
-        MAX_MEASURE_DURATION = 16 
-        measure_count = 1
-
-        for i, note_info in enumerate(notes_data):
-            if i > 500: break 
-            
-            if current_measure_duration + note_info['xml_duration'] > MAX_MEASURE_DURATION:
-                measure = ET.SubElement(part, "measure", number=str(measure_count + 1))
-                measure_count += 1
-                current_measure_duration = 0
-
-            note = ET.SubElement(measure, "note")
-            
-            # Pitch
-            pitch = ET.SubElement(note, "pitch")
-            midi_val = note_info['midi']
-            octave_val = (midi_val // 12) - 1
-            step_val = step_map.get(midi_val % 12, 'C')
-            
-            ET.SubElement(pitch, "step").text = step_val
-            ET.SubElement(pitch, "octave").text = str(octave_val)
-            
-            # Alter (Sharps/Flats)
-            remainder = midi_val % 12
-            if remainder in [1, 3, 6, 8, 10]:
-                ET.SubElement(pitch, "alter").text = "1" 
-                # (Optional: Add accidental display here if needed)
-            
-            # Microtones
-            if note_info['type'] == "Microtonal_Neutral":
-                alter = pitch.find("alter")
-                if alter is None: alter = ET.SubElement(pitch, "alter")
-                alter.text = f"{note_info['cents_dev'] / 100.0:.2f}" 
-            
-            # ---  DURATION ---
-       
-            ET.SubElement(note, "duration").text = str(note_info['xml_duration'])
-            ET.SubElement(note, "type").text = note_info['rhythm_type']
-            
-            current_measure_duration += note_info['xml_duration']
-
-        xmlstr = minidom.parseString(ET.tostring(score)).toprettyxml(indent="   ")
-        with open(filename, "w") as f:
-            f.write(xmlstr)
-        print(f"   [SUCCESS] XML Saved: {filename}")
\ No newline at end of file
+        pitches = np.array([event['pitch'] for event in note_events], dtype=np.float64)
+        durations = np.array([event['duration'] for event in note_events], dtype=np.float64)
+        return self.columns_to_notes(self.analyze_note_arrays(pitches, durations))
+
+    def export_musicxml(self, notes_data, filename="qaraami_sheet.xml", indent="   "):
+        """
+        Streams notes_data (any iterable of note dicts) to a MusicXML file.
+        No note cap and no in-memory document: see MusicXMLStreamWriter.
+        'filename' may also be an open text file handle.
+        """
+        with MusicXMLStreamWriter(filename, indent=indent) as writer:
+            for note_info in notes_data:
+                writer.write_note(note_info)
+        print(f"   [SUCCESS] XML Saved: {getattr(filename, 'name', filename)} ({writer.note_count} notes)")
+
+class MusicXMLStreamWriter:
+    """
+    Incremental MusicXML writer: each <note> goes straight to the file handle,
+    and a new <measure> opens whenever the next note would overflow 4/4.
+    Memory stays constant however long the recording is.
+    indent=None writes compact XML on one line.
+    """
+    STEP_MAP = {0:'C', 1:'C', 2:'D', 3:'D', 4:'E', 5:'F', 6:'F', 7:'G', 8:'G', 9:'A', 10:'A', 11:'B'}
+    SHARP_CLASSES = (1, 3, 6, 8, 10)
+    MAX_MEASURE_DURATION = 16 # 4/4 with 4 divisions per quarter
+
+    def __init__(self, target, part_name="Somali Oud (AI)", indent="   "):
+        if hasattr(target, "write"):
+            self.file, self.owns_file = target, False
+        else:
+            self.file, self.owns_file = open(target, "w"), True
+        self.indent = indent
+        self.newline = "\n" if indent is not None else ""
+        self.depth = 0
+        self.note_count = 0
+        self.measure_count = 0
+        self.current_measure_duration = 0
+
+        self._line('<?xml version="1.0" ?>')
+        self._open("score-partwise", version="3.1")
+        self._open("part-list")
+        self._open("score-part", id="P1")
+        self._leaf("part-name", part_name)
+        self._close("score-part")
+        self._close("part-list")
+        self._open("part", id="P1")
+        self._start_measure()
+
+        # Setup Attributes (first measure only)
+        self._open("attributes")
+        self._leaf("divisions", "4")
+        self._open("key")
+        self._leaf("fifths", "0")
+        self._close("key")
+        self._open("time")
+        self._leaf("beats", "4")
+        self._leaf("beat-type", "4")
+        self._close("time")
+        self._open("clef")
+        self._leaf("sign", "G")
+        self._leaf("line", "2")
+        self._close("clef")
+        self._close("attributes")
+
+    # --- Low-level output ---
+
+    def _line(self, text):
+        prefix = self.indent * self.depth if self.indent is not None else ""
+        self.file.write(prefix + text + self.newline)
+
+    def _open(self, tag, **attrs):
+        attr_text = "".join(f' {name}={quoteattr(str(value))}' for name, value in attrs.items())
+        self._line(f"<{tag}{attr_text}>")
+        self.depth += 1
+
+    def _close(self, tag):
+        self.depth -= 1
+        self._line(f"</{tag}>")
+
+    def _leaf(self, tag, text):
+        self._line(f"<{tag}>{escape(str(text))}</{tag}>")
+
+    def _start_measure(self):
+        self.measure_count += 1
+        self.current_measure_duration = 0
+        self._open("measure", number=self.measure_count)
+
+    # --- Public API ---
+
+    def write_note(self, note_info):
+        if self.current_measure_duration + note_info['xml_duration'] > self.MAX_MEASURE_DURATION:
+            self._close("measure")
+            self._start_measure()
+
+        midi_val = note_info['midi']
+        octave_val = (midi_val // 12) - 1
+        step_val = self.STEP_MAP.get(midi_val % 12, 'C')
+
+        # Alter (Sharps/Flats); microtones replace it with the cents offset
+        alter = None
+        if midi_val % 12 in self.SHARP_CLASSES:
+            alter = "1"
+        if note_info['type'] == "Microtonal_Neutral":
+            alter = f"{note_info['cents_dev'] / 100.0:.2f}"
+
+        self._open("note")
+        self._open("pitch")
+        self._leaf("step", step_val)
+        self._leaf("octave", octave_val)
+        if alter is not None:
+            self._leaf("alter", alter)
+        self._close("pitch")
+
+        # ---  DURATION ---
+        self._leaf("duration", note_info['xml_duration'])
+        self._leaf("type", note_info['rhythm_type'])
+        self._close("note")
+
+        self.current_measure_duration += note_info['xml_duration']
+        self.note_count += 1
+
+    def close(self):
+        if self.depth == 0:
+            return
+        self._close("measure")
+        self._close("part")
+        self._close("score-partwise")
+        if self.owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,14 +1,143 @@
 import numpy as np
-from scipy.io import wavfile
 import random
+import sys
+import time
+from pluck_cache import PluckCache
+from audio_io import WavWriter, write_wav, check_quantization, WAV_FORMATS
+from effects_bus import EffectsBus, MultiTapDelay, Chorus, ConvolutionReverb, load_impulse_response
 
 
 
 SR = 44100  # Sample Rate
 BPM = 120   # Classic Dhaanto Tempo
-BEAT_DUR = 90 / BPM
 TOTAL_MINUTES = 2.0
-TOTAL_SECONDS = TOTAL_MINUTES * 60
+PLUCK_CACHE_MB = 64  # Memory budget for repeated oud notes
+OSCILLATOR = "sin"   # "sin" (exact) or "wavetable" (table lookup, see below)
+DTYPE = "float64"    # Sample dtype for synthesis, mixing and FX ("float32" halves memory)
+EXPORT_FORMAT = "int16" # WAV sample format: "int16", "int24" or "float32"
+FLOAT32_MAX_ERROR = 1 / 32767 # float32 render must stay within one 16-bit LSB of float64
+FLOAT32_MIN_SNR_DB = 90.0
+WAVETABLE_SIZE = 4096 # Must be a power of 2
+
+# Oud harmonic mix shared by both strings: (harmonic, amplitude)
+OUD_HARMONICS = [(1, 0.6), (2, 0.3), (3, 0.1)]
+OUD_DETUNE = 1.002 # 0.2% variance
+
+REVERB_DELAY_MS = 250
+REVERB_DECAY = 0.4
+IR_WET = 0.3 # Convolution reverb level when an impulse response is given
+
+LIMITER_ATTACK_MS = 5     # Streaming limiter: gain ramps down this long before a peak
+LIMITER_RELEASE_MS = 150  # ... and recovers with this time constant after it
+
+# Structure Anchors (Low -> High -> Low): (progress limit, scale index)
+GRAVITY_CURVE = [
+    (0.2, 2),   # Intro: Low
+    (0.5, 5),   # Verse: Mid
+    (0.8, 9),   # Solo: High/Fast
+    (1.0, 2)    # Outro: Low
+]
+
+# Percussion pattern: hits are (beat, sound, gain) repeated every bar.
+# "swing" delays every off-beat ('and') hit by that many beats.
+# "variations" add hits only on bars where bar % every == variation["bar"].
+DHAANTO_PATTERN = {
+    "beats_per_bar": 4,
+    "swing": 0.0,
+    "hits": [
+        (0.0, "kick", 1.0),   # Kick on 1
+        (1.0, "clap", 1.0),   # Clap on 2 (The "Catch")
+        (2.0, "kick", 1.0),   # Kick on 3
+        (3.0, "clap", 1.0),   # Clap on 4
+        (3.5, "clap", 0.5)    # "Ghost" clap for swing (on the 'and' of 4)
+    ],
+    "variations": []
+}
+
+# Same groove with a pickup fill closing every 4-bar phrase (--fills)
+DHAANTO_PATTERN_WITH_FILLS = dict(DHAANTO_PATTERN, swing=0.05, variations=[
+    {"every": 4, "bar": 3, "hits": [(2.5, "clap", 0.4), (3.75, "clap", 0.6)]},
+    {"every": 8, "bar": 7, "hits": [(1.5, "kick", 0.7)]}
+])
+
+PLUCK_CACHE = PluckCache(max_bytes=PLUCK_CACHE_MB * 1024 * 1024)
+
+class RenderConfig:
+    """
+    Every parameter of one render. Functions take a config instead of reading
+    the module globals, so several renders can share one interpreter.
+    The globals above are only the defaults.
+    """
+    def __init__(self, sr=SR, bpm=BPM, total_minutes=TOTAL_MINUTES, seed=None,
+                 gravity_curve=GRAVITY_CURVE, block_size=None,
+                 filename="qaraami_masterpiece.wav", oscillator=OSCILLATOR,
+                 ir_path=None, chorus=False, drum_pattern=DHAANTO_PATTERN,
+                 dtype=DTYPE, export_format=EXPORT_FORMAT, dither=False):
+        if oscillator not in ("sin", "wavetable"):
+            raise ValueError(f"Unknown oscillator '{oscillator}'. Use 'sin' or 'wavetable'")
+        if export_format not in WAV_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}'. Use one of {list(WAV_FORMATS)}")
+        self.sr = sr
+        self.bpm = bpm
+        self.total_minutes = total_minutes
+        self.seed = seed
+        self.gravity_curve = list(gravity_curve)
+        self.block_size = block_size if block_size is not None else sr
+        self.filename = filename
+        self.oscillator = oscillator
+        # Oud effects: optional convolution reverb IR (WAV path) and chorus
+        self.ir_path = ir_path
+        self.chorus = chorus
+        self.drum_pattern = drum_pattern
+        # Sample dtype end to end; quantization only happens at export
+        self.dtype = np.dtype(dtype)
+        self.export_format = export_format
+        # TPDF dither at export; its noise is seeded from 'seed' (random without one)
+        self.dither = dither
+
+    @property
+    def beat_dur(self):
+        # Beat length in seconds, derived so bpm stays the single source
+        return 90 / self.bpm
+
+    @property
+    def total_seconds(self):
+        return self.total_minutes * 60
+
+    @property
+    def total_samples(self):
+        return int(self.sr * self.total_seconds)
+
+    def replace(self, **changes):
+        """
+        Returns a copy with some fields changed, built through __init__ so the
+        new values are validated and normalized (e.g. dtype strings).
+        """
+        return type(self)(**{**vars(self), **changes})
+
+    def make_rngs(self):
+        """
+        (python_rng, numpy_rng) for this render. Without a seed these are the
+        global 'random' / 'np.random' modules, as in the original script.
+        """
+        if self.seed is None:
+            return random, np.random
+        return random.Random(self.seed), np.random.RandomState(self.seed)
+
+    def __repr__(self):
+        return (f"RenderConfig(sr={self.sr}, bpm={self.bpm}, "
+                f"total_minutes={self.total_minutes}, seed={self.seed}, "
+                f"oscillator='{self.oscillator}', dtype={self.dtype}, "
+                f"filename='{self.filename}')")
+
+DEFAULT_CONFIG = RenderConfig()
+
+def get_gravity_target(progress, gravity_curve=GRAVITY_CURVE):
+    """Scale index the melody is pulled towards at this point of the piece."""
+    for limit, target_idx in gravity_curve:
+        if progress < limit:
+            return target_idx
+    return gravity_curve[-1][1]
 
 # --- HELPER: SAFE ADDITION ---
 def add_sound_safe(buffer, sound, start_pos):
@@ -31,12 +160,21 @@ def add_sound_safe(buffer, sound, start_pos):
 
 # --- 1. SOUND DESIGN ENGINES ---
 
-def generate_oud_pluck(freq, duration, volume=1.0):
+def generate_oud_pluck(freq, duration, volume=1.0, cfg=None):
     """
     Simulates a Somali Oud with dual strings (Chorus Effect).
+    The unit-volume waveform is cached, so repeated notes only pay for the gain.
     """
-    n_samples = int(SR * duration)
-    t = np.arange(n_samples) / SR
+    cfg = cfg or DEFAULT_CONFIG
+    render_fn = _render_oud_pluck_wavetable if cfg.oscillator == "wavetable" else _render_oud_pluck
+    key = (cfg.sr, cfg.oscillator, cfg.dtype.name) + PLUCK_CACHE.make_key(freq, duration)
+    sound = PLUCK_CACHE.get_or_render(key, lambda: render_fn(freq, duration, cfg.sr, cfg.dtype))
+    return sound * volume
+
+def _render_oud_pluck(freq, duration, sr=SR, dtype=np.float64):
+    freq = float(freq) # A NumPy float64 scalar would upcast float32 math
+    n_samples = int(sr * duration)
+    t = (np.arange(n_samples) / sr).astype(dtype, copy=False)
     
     # Physics: Exponential Decay (Pluck)
     envelope = np.exp(-4.0 * t) 
@@ -53,102 +191,218 @@ def generate_oud_pluck(freq, duration, volume=1.0):
     wave2 += 0.1 * np.sin(2 * np.pi * (freq * 3 * detune) * t)
 
     # Combine
-    sound = (wave1 + wave2) * 0.5 * envelope * volume
+    sound = (wave1 + wave2) * 0.5 * envelope
+    return sound
+
+# --- 1b. WAVETABLE FAST PATH ---
+# One period of the harmonic mix, plus a guard sample for interpolation.
+# Linear interpolation error per harmonic h is at most amp * (2*pi*h/SIZE)**2 / 8,
+# so the whole pluck stays within WAVETABLE_ERROR_BOUND of the sin version.
+
+_PHASE = 2 * np.pi * np.arange(WAVETABLE_SIZE + 1) / WAVETABLE_SIZE
+OUD_WAVETABLE = sum(amp * np.sin(h * _PHASE) for h, amp in OUD_HARMONICS)
+OUD_WAVETABLE_SLOPE = np.diff(OUD_WAVETABLE)
+WAVETABLE_ERROR_BOUND = sum(amp * (2 * np.pi * h / WAVETABLE_SIZE) ** 2 / 8
+                            for h, amp in OUD_HARMONICS)
+
+_ENVELOPE_TABLES = {}
+_WAVETABLES = {}
+
+def get_envelope(n_samples, sr=SR, dtype=np.float64):
+    """
+    exp(-4t) pluck envelope, computed once per sample rate/dtype and sliced.
+    The table only grows when a longer note than ever before comes in.
+    """
+    key = (sr, np.dtype(dtype).name)
+    table = _ENVELOPE_TABLES.get(key)
+    if table is None or len(table) < n_samples:
+        t = (np.arange(n_samples) / sr).astype(dtype, copy=False)
+        table = np.exp(-4.0 * t)
+        table.setflags(write=False)
+        _ENVELOPE_TABLES[key] = table
+    return table[:n_samples]
+
+def get_wavetable(dtype=np.float64):
+    """(table, slope) cast once per dtype."""
+    key = np.dtype(dtype).name
+    if key not in _WAVETABLES:
+        _WAVETABLES[key] = (OUD_WAVETABLE.astype(dtype), OUD_WAVETABLE_SLOPE.astype(dtype))
+    return _WAVETABLES[key]
+
+def wavetable_oscillator(freq, n_samples, sr=SR, dtype=np.float64):
+    """Reads OUD_WAVETABLE with a fractional phase increment of freq/sr."""
+    table, slope = get_wavetable(dtype)
+    # Phase stays float64: float32 would drift audibly on long notes
+    pos = np.arange(n_samples) * (freq / sr * WAVETABLE_SIZE)
+    idx = pos.astype(np.intp)
+    frac = (pos - idx).astype(dtype, copy=False)
+    idx &= WAVETABLE_SIZE - 1 # Wrap to one period (size is a power of 2)
+
+    out = np.take(slope, idx)
+    out *= frac
+    out += np.take(table, idx)
+    return out
+
+def _render_oud_pluck_wavetable(freq, duration, sr=SR, dtype=np.float64):
+    n_samples = int(sr * duration)
+    envelope = get_envelope(n_samples, sr, dtype)
+
+    # Both strings read the same table; string 2 is detuned (Chorus Effect)
+    wave1 = wavetable_oscillator(freq, n_samples, sr, dtype)
+    wave2 = wavetable_oscillator(freq * OUD_DETUNE, n_samples, sr, dtype)
+
+    sound = (wave1 + wave2) * 0.5 * envelope
     return sound
 
-def generate_drum_hit(type="kick"):
+def generate_drum_hit(type="kick", cfg=None, np_rng=np.random):
     """Procedural Percussion Synthesis"""
+    cfg = cfg or DEFAULT_CONFIG
+    sr = cfg.sr
     dur = 0.3
-    t = np.arange(int(SR * dur)) / SR
+    t = np.arange(int(sr * dur)) / sr
     
+    # Hits are tiny and rendered once, so synthesize in float64 and cast
     if type == "kick":
         # Pitch sweep 150Hz -> 50Hz
         freq_sweep = np.linspace(150, 50, len(t))
         wave = np.sin(2 * np.pi * freq_sweep * t)
         env = np.exp(-10 * t)
-        return wave * env * 0.8
+        return (wave * env * 0.8).astype(cfg.dtype, copy=False)
         
     elif type == "clap":
         # Filtered White Noise
-        noise = np.random.uniform(-1, 1, len(t))
+        noise = np_rng.uniform(-1, 1, len(t))
         env = np.exp(-20 * t) 
-        return noise * env * 0.4
+        return (noise * env * 0.4).astype(cfg.dtype, copy=False)
     
-    return np.zeros_like(t)
+    return np.zeros_like(t, dtype=cfg.dtype)
 
 # --- 2. RHYTHM SECTION (The Dhaanto Loop) ---
 
-def create_background_loop(total_len_samples):
-    print("   -> Synthesizing Dhaanto Percussion...")
-    buffer = np.zeros(total_len_samples)
-    
-    # 1 Bar = 4 Beats
-    bar_samples = int(BEAT_DUR * 4 * SR)
-    
-    # Create one bar of rhythm
-    one_bar = np.zeros(bar_samples)
-    
-    kick = generate_drum_hit("kick")
-    clap = generate_drum_hit("clap")
-    
-    # Kick on 1
-    add_sound_safe(one_bar, kick, 0)
-    
-    # Clap on 2 (The "Catch")
-    pos_2 = int(BEAT_DUR * 1 * SR)
-    add_sound_safe(one_bar, clap, pos_2)
+def make_drum_kit(cfg=None, np_rng=np.random):
+    """The sounds a pattern can reference, by name."""
+    return {
+        "kick": generate_drum_hit("kick", cfg),
+        "clap": generate_drum_hit("clap", cfg, np_rng)
+    }
+
+def compile_pattern(pattern, first_bar, last_bar, cfg=None):
+    """
+    Expands a pattern over bars [first_bar, last_bar) into impulse lists:
+    {sound: (positions, gains)}. Loops over hit templates, never over bars.
+    """
+    cfg = cfg or DEFAULT_CONFIG
+    sr, beat_dur = cfg.sr, cfg.beat_dur
+    bar_samples = int(beat_dur * pattern["beats_per_bar"] * sr)
+    bars = np.arange(first_bar, last_bar)
 
-    # Kick on 3
-    pos_3 = int(BEAT_DUR * 2 * SR)
-    add_sound_safe(one_bar, kick, pos_3)
+    templates = [(hit, bars) for hit in pattern["hits"]]
+    for variation in pattern.get("variations", []):
+        selected = bars[bars % variation["every"] == variation["bar"]]
+        templates += [(hit, selected) for hit in variation["hits"]]
 
-    # Clap on 4
-    pos_4 = int(BEAT_DUR * 3 * SR)
-    add_sound_safe(one_bar, clap, pos_4)
-    
-    # "Ghost" clap for swing (on the 'and' of 4)
+    impulses = {}
+    for (beat, sound, gain), hit_bars in templates:
+        if beat % 1 == 0.5:
+            beat += pattern.get("swing", 0.0)
+        positions = hit_bars * bar_samples + int(beat_dur * beat * sr)
+        old_pos, old_gains = impulses.get(sound, (np.zeros(0, dtype=int), np.zeros(0)))
+        impulses[sound] = (np.concatenate((old_pos, positions)),
+                           np.concatenate((old_gains, np.full(len(positions), gain))))
+    return impulses
+
+def render_pattern_cycle(pattern, kit, cfg=None):
+    """
+    Renders one full cycle of the pattern: lcm of the variation periods, in bars.
+    Every hit of the cycle is scattered in a single np.add.at call.
+    Returns (circular, intro): 'circular' has the tails of the last bars
+    wrapped onto the first ones (steady state); 'intro' is the very first
+    cycle with nothing ringing in from before the piece starts.
+    """
+    cfg = cfg or DEFAULT_CONFIG
+    bar_samples = int(cfg.beat_dur * pattern["beats_per_bar"] * cfg.sr)
+    n_bars = 1
+    for variation in pattern.get("variations", []):
+        n_bars = np.lcm(n_bars, variation["every"])
+    cycle_len = int(n_bars) * bar_samples
 
-    pos_swing = int(BEAT_DUR * 3.5 * SR)
-    add_sound_safe(one_bar, clap * 0.5, pos_swing)
+    positions, gains, sounds = [], [], []
+    for name, (hit_pos, hit_gains) in compile_pattern(pattern, 0, n_bars, cfg).items():
+        positions.append(hit_pos)
+        gains.append(hit_gains)
+        sounds += [kit[name]] * len(hit_pos)
 
-    # Loop this bar to fill the duration
-    current_pos = 0
-    while current_pos < total_len_samples:
-        add_sound_safe(buffer, one_bar, current_pos)
-        current_pos += bar_samples
-        
-    return buffer
+    # Pad every sound to the same length so all hits form one 2D scatter
+    max_len = max(len(sound) for sound in kit.values())
+    sound_bank = np.zeros((len(sounds), max_len), dtype=cfg.dtype)
+    for row, sound in enumerate(sounds):
+        sound_bank[row, :len(sound)] = sound
+
+    positions = np.concatenate(positions)
+    sound_bank *= np.concatenate(gains)[:, np.newaxis]
+    idx = positions[:, np.newaxis] + np.arange(max_len)
+
+    intro = np.zeros(cycle_len + max_len, dtype=cfg.dtype)
+    np.add.at(intro, idx, sound_bank)
+
+    # Fold everything past the cycle end back to its start
+    circular = intro[:cycle_len].copy()
+    overhang = intro[cycle_len:]
+    while len(overhang):
+        n = min(len(overhang), cycle_len)
+        circular[:n] += overhang[:n]
+        overhang = overhang[n:]
+    return circular, intro[:cycle_len]
+
+def render_percussion(pattern, kit, start, n_samples, cfg=None, cycle=None):
+    """
+    Renders samples [start, start + n_samples) of the looping pattern by
+    repeating the pre-rendered cycle; only the first cycle uses the intro.
+    Pass 'cycle' from render_pattern_cycle to reuse it across blocks.
+    """
+    circular, intro = cycle or render_pattern_cycle(pattern, kit, cfg)
+    cycle_len = len(circular)
+
+    # np.resize repeats the array, so rotate the cycle to start at 'start'
+    output = np.resize(np.roll(circular, -(start % cycle_len)), n_samples)
+    if start < cycle_len:
+        n_intro = min(n_samples, cycle_len - start)
+        output[:n_intro] = intro[start:start + n_intro]
+    return output
+
+def create_background_loop(total_len_samples, cfg=None, np_rng=np.random):
+    print("   -> Synthesizing Dhaanto Percussion...")
+    cfg = cfg or DEFAULT_CONFIG
+    kit = make_drum_kit(cfg, np_rng)
+    return render_percussion(cfg.drum_pattern, kit, 0, total_len_samples, cfg)
 
 # --- 3. MELODY COMPOSER (The "Brain") ---
 
-def compose_melody(total_len_samples):
-    print("   -> Composing Oud Improvisation...")
-    buffer = np.zeros(total_len_samples)
-    
+def compose_note_events(cfg=None, rng=random):
+    """
+    Yields the improvised melody as (start_samp, freq, duration_sec, loudness),
+    in time order. Rendering is left to the caller (full buffer or streaming).
+    """
+    cfg = cfg or DEFAULT_CONFIG
+    sr, beat_dur, total_seconds = cfg.sr, cfg.beat_dur, cfg.total_seconds
+
     # Qaraami Scale: A Minor Pentatonic
     scale = [52, 55, 57, 60, 62, 64, 67, 69, 72, 74, 76]
     
     current_idx = 4 
     current_time = 0.0
     
-    # Structure Anchors (Low -> High -> Low)
-    def get_gravity_target(progress):
-        if progress < 0.2: return 2   # Intro: Low
-        if progress < 0.5: return 5   # Verse: Mid
-        if progress < 0.8: return 9   # Solo: High/Fast
-        return 2                      # Outro: Low
-    
-    while current_time < TOTAL_SECONDS:
+    while current_time < total_seconds:
         
-        progress = current_time / TOTAL_SECONDS
-        target_idx = get_gravity_target(progress)
+        progress = current_time / total_seconds
+        target_idx = get_gravity_target(progress, cfg.gravity_curve)
         
         # Pitch Logic
         dist = target_idx - current_idx
         if abs(dist) > 3:
             step = 1 if dist > 0 else -1
         else:
-            step = random.choice([-1, -1, 0, 1, 1, 2, -2])
+            step = rng.choice([-1, -1, 0, 1, 1, 2, -2])
             
         current_idx += step
         current_idx = max(0, min(len(scale)-1, current_idx))
@@ -156,58 +410,80 @@ def compose_melody(total_len_samples):
         freq = 440.0 * (2 ** ((midi_note - 69) / 12))
         
         # Rhythm Logic
-        rhythm_choice = random.choices([0.5, 1.0, 1.5], weights=[50, 40, 10])[0]
+        rhythm_choice = rng.choices([0.5, 1.0, 1.5], weights=[50, 40, 10])[0]
         
         # Swing Logic
         swing_delay = 0.0
-        beat_pos = (current_time / BEAT_DUR) % 4
+        beat_pos = (current_time / beat_dur) % 4
         if rhythm_choice == 0.5 and (beat_pos % 1) > 0.4:
             swing_delay = 0.05 
             
         # Render Note
-        duration_sec = rhythm_choice * BEAT_DUR
+        duration_sec = rhythm_choice * beat_dur
         
-        if random.random() < 0.9: # 10% chance of silence
-            loudness = random.uniform(0.7, 1.0)
-            note_audio = generate_oud_pluck(freq, duration_sec * 1.5, loudness)
-            
-            start_samp = int((current_time + swing_delay) * SR)
-            add_sound_safe(buffer, note_audio, start_samp)
+        if rng.random() < 0.9: # 10% chance of silence
+            loudness = rng.uniform(0.7, 1.0)
+            start_samp = int((current_time + swing_delay) * sr)
+            yield start_samp, freq, duration_sec * 1.5, loudness
         
         current_time += duration_sec
 
+def compose_melody(total_len_samples, cfg=None, rng=random):
+    print("   -> Composing Oud Improvisation...")
+    cfg = cfg or DEFAULT_CONFIG
+    buffer = np.zeros(total_len_samples, dtype=cfg.dtype)
+
+    for start_samp, freq, duration_sec, loudness in compose_note_events(cfg, rng):
+        note_audio = generate_oud_pluck(freq, duration_sec, loudness, cfg)
+        add_sound_safe(buffer, note_audio, start_samp)
+
+    print(f"   -> Pluck cache: {PLUCK_CACHE}")
     return buffer
 
 # --- 4. MIXER & FX ---
 
-def apply_reverb(signal):
+def build_oud_bus(cfg=None):
+    """
+    Oud effects chain: the hall echo, then chorus and convolution reverb
+    when the config asks for them.
+    """
+    cfg = cfg or DEFAULT_CONFIG
+    bus = EffectsBus([MultiTapDelay([(REVERB_DELAY_MS, REVERB_DECAY)], cfg.sr, cfg.block_size, cfg.dtype)])
+    if cfg.chorus:
+        bus.add(Chorus(cfg.sr, block_size=cfg.block_size, dtype=cfg.dtype))
+    if cfg.ir_path:
+        ir = load_impulse_response(cfg.ir_path, cfg.sr)
+        bus.add(ConvolutionReverb(ir, cfg.block_size, wet=IR_WET, dtype=cfg.dtype))
+    return bus
+
+def apply_reverb(signal, cfg=None):
+    """
+    Runs the oud bus over the signal block by block, in place, and returns
+    it extended by the echo/reverb tail that rings past the last note.
+    """
     print("   -> Applying Hall Reverb...")
-    delay_ms = 250
-    decay = 0.4
-    delay_samples = int(delay_ms * SR / 1000)
-    
-    # Create the echo
-    echo = np.zeros_like(signal)
-    # Only shift if delay is smaller than signal
-    if len(signal) > delay_samples:
-        echo[delay_samples:] = signal[:-delay_samples]
-    
-    return signal + (echo * decay)
+    cfg = cfg or DEFAULT_CONFIG
+    bus = build_oud_bus(cfg)
+    bus.process_inplace(signal, cfg.block_size)
+    return np.concatenate((signal, bus.flush(cfg.block_size, cfg.dtype)))
 
-def main():
-    print(f"Generating {TOTAL_MINUTES} minute Qaraami Masterpiece...")
-    total_samples = int(SR * TOTAL_SECONDS)
+def main(cfg=None):
+    cfg = cfg or DEFAULT_CONFIG
+    print(f"Generating {cfg.total_minutes} minute Qaraami Masterpiece...")
+    total_samples = cfg.total_samples
+    rng, np_rng = cfg.make_rngs()
     
     # 1. Generate Layers
-    drums = create_background_loop(total_samples)
-    oud = compose_melody(total_samples)
+    drums = create_background_loop(total_samples, cfg, np_rng)
+    oud = compose_melody(total_samples, cfg, rng)
     
     # 2. Apply FX
-    oud_wet = apply_reverb(oud)
+    oud_wet = apply_reverb(oud, cfg)
     
     # 3. Mix
     print("   -> Mixing Tracks...")
-    final_mix = (drums * 1.0) + (oud_wet * 0.8)
+    final_mix = oud_wet * 0.8
+    final_mix[:len(drums)] += drums * 1.0
     
     # 4. Master
     max_val = np.max(np.abs(final_mix))
@@ -215,9 +491,272 @@ def main():
         final_mix = final_mix / max_val
     
     # 5. Export
-    filename = "qaraami_masterpiece.wav"
-    wavfile.write(filename, SR, (final_mix * 32767).astype(np.int16))
+    filename = cfg.filename
+    write_wav(filename, final_mix, cfg.sr, cfg.export_format, cfg.dither, cfg.seed)
+    print(f"DONE! File saved as: {filename}")
+
+# --- 5. STREAMING RENDER (Bounded Memory) ---
+
+def render_stream(cfg=None):
+    """
+    Generator version of main(): yields the un-normalized mix in blocks of
+    cfg.block_size samples. Only a few blocks of state are kept alive:
+    - one pre-rendered drum cycle, repeated per block
+    - oud carry: tails of notes that ring past the current block
+    - effects bus state: delay lines and the convolution reverb tail
+    After the last block the bus is flushed, so the piece rings out.
+    With the same seed the samples equal the full-buffer render.
+    """
+    cfg = cfg or DEFAULT_CONFIG
+    total_samples, block_size = cfg.total_samples, cfg.block_size
+    rng, np_rng = cfg.make_rngs()
+
+    kit = make_drum_kit(cfg, np_rng)
+    drum_cycle = render_pattern_cycle(cfg.drum_pattern, kit, cfg)
+    events = compose_note_events(cfg, rng)
+    next_event = next(events, None)
+
+    oud_bus = build_oud_bus(cfg)
+    oud_carry = np.zeros(0, dtype=cfg.dtype)
+
+    for block_start in range(0, total_samples, block_size):
+        block_len = min(block_size, total_samples - block_start)
+        block_end = block_start + block_len
+
+        # 1. Drums
+        drums = render_percussion(cfg.drum_pattern, kit, block_start, block_len, cfg, drum_cycle)
+
+        # 2. Oud: pending tails first, then every note starting in this block
+        oud = np.zeros(max(block_len, len(oud_carry)), dtype=cfg.dtype)
+        oud[:len(oud_carry)] += oud_carry
+
+        while next_event is not None and next_event[0] < block_end:
+            start_samp, freq, duration_sec, loudness = next_event
+            note_audio = generate_oud_pluck(freq, duration_sec, loudness, cfg)
+            # Never ring past the end of the piece
+            note_audio = note_audio[:max(0, total_samples - start_samp)]
+
+            offset = start_samp - block_start
+            if offset + len(note_audio) > len(oud):
+                oud = np.concatenate((oud, np.zeros(offset + len(note_audio) - len(oud), dtype=cfg.dtype)))
+            oud[offset:offset + len(note_audio)] += note_audio
+            next_event = next(events, None)
+
+        oud_carry = oud[block_len:].copy()
+        oud = oud[:block_len]
+
+        # 3. FX
+        oud_wet = oud_bus.process(oud)
+
+        # 4. Mix
+        yield (drums * 1.0) + (oud_wet * 0.8)
+
+    # 5. Ring-out: echoes and reverb still pending after the last note
+    tail = oud_bus.flush(block_size, cfg.dtype)
+    for start in range(0, len(tail), block_size):
+        yield tail[start:start + block_size] * 0.8
+
+def _sliding_max(x, width):
+    """y[i] = max(x[i:i + width]) for every full window, in O(n) (van Herk / Gil-Werman)."""
+    n = len(x) - width + 1
+    padded = np.concatenate((x, np.full(-len(x) % width, -np.inf)))
+    blocks = padded.reshape(-1, width)
+    prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:n], prefix[width - 1:width - 1 + n])
+
+def limit_stream(blocks, ceiling=1.0, sr=SR, attack_ms=LIMITER_ATTACK_MS, release_ms=LIMITER_RELEASE_MS,
+                 safety_clip=True):
+    """
+    Look-ahead peak limiter for single-pass renders.
+    Output runs one block behind the input, so each block's gain is computed
+    knowing the samples that follow it. The gain reduction is a per-sample
+    envelope: it ramps in linearly over 'attack_ms' and is fully applied by
+    the time the peak arrives, then recovers exponentially over 'release_ms'.
+    A peak closer to the start than 'attack_ms' is pre-rolled: the stream
+    starts already reduced. The final clip (safety_clip) only catches
+    rounding, not the program material (see check_limiter).
+    """
+    attack = max(1, int(sr * attack_ms / 1000))
+    log_release = -1.0 / max(1.0, sr * release_ms / 1000) # log of the per-sample recovery factor
+    history = None                 # held reduction of the last attack-1 output samples
+    last = 0.0                     # reduction on the last output sample
+
+    def limit(block, ahead):
+        nonlocal history, last
+        n = len(block)
+        ahead = np.concatenate((ahead[:attack - 1], np.zeros(max(0, attack - 1 - len(ahead)))))
+        peaks = np.abs(np.concatenate((block, ahead)).astype(np.float64))
+        needed = np.maximum(0.0, 1.0 - ceiling / np.maximum(peaks, 1e-300))
+        if history is None:
+            # Pre-roll: the attack-1 samples "before" t=0 already hold every
+            # peak within reach, so a peak at sample 0 is fully reduced too
+            history = np.maximum.accumulate(needed[:attack - 1])
+
+        # Hold every peak's reduction for 'attack' samples before it, then
+        # average over 'attack' samples: a linear ramp that peaks on the peak
+        held = np.concatenate((history, _sliding_max(needed, attack)))
+        sums = np.concatenate(([0.0], np.cumsum(held)))
+        ramped = (sums[attack:] - sums[:-attack]) / attack
+        history = held[len(held) - (attack - 1):]
+
+        # Release: reduction[i] = max(ramped[i], reduction[i-1] * r), solved in
+        # the log domain as a running maximum instead of a per-sample loop
+        k = np.arange(n)
+        with np.errstate(divide="ignore"):
+            log_red = np.log(ramped) - k * log_release
+            if last > 0:
+                log_red[0] = max(log_red[0], np.log(last) + log_release)
+        reduction = np.exp(k * log_release + np.maximum.accumulate(log_red))
+        last = reduction[-1] if n else last
+
+        gain = (1.0 - reduction).astype(block.dtype, copy=False)
+        out = block * gain
+        return np.clip(out, -ceiling, ceiling) if safety_clip else out
+
+    waiting = []
+    for block in blocks:
+        waiting.append(block)
+        # Emit the oldest block once enough look-ahead has arrived behind it
+        while len(waiting) > 1 and sum(len(b) for b in waiting[1:]) >= attack - 1:
+            yield limit(waiting.pop(0), np.concatenate(waiting))
+    while waiting:
+        yield limit(waiting.pop(0), np.concatenate(waiting) if waiting else np.zeros(0))
+
+def check_limiter(seed=3, ceiling=1.0, eps=1e-9):
+    """
+    Asserts that limit_stream keeps every sample within the ceiling before
+    its safety clip: on synthetic peaks (including one at sample 0, at
+    several block sizes) and on the seeded streaming render.
+    """
+    rng = np.random.RandomState(seed)
+    signal = 0.5 * np.sin(2 * np.pi * 220 * np.arange(SR * 3) / SR)
+    for pos in np.concatenate(([0, 1], rng.randint(0, len(signal) - 30, 30))):
+        signal[pos:pos + 30] += rng.uniform(1, 4) * rng.choice([-1, 1])
+
+    for block_size in (SR, 1000, 37):
+        blocks = (signal[i:i + block_size] for i in range(0, len(signal), block_size))
+        out = np.concatenate(list(limit_stream(blocks, ceiling, safety_clip=False)))
+        assert len(out) == len(signal)
+        assert np.max(np.abs(out)) <= ceiling + eps, f"block {block_size}: peak {np.max(np.abs(out))}"
+
+    cfg = RenderConfig(total_minutes=0.5, seed=seed)
+    peak = max(np.max(np.abs(b)) for b in limit_stream(render_stream(cfg), ceiling, cfg.sr, safety_clip=False))
+    assert peak <= ceiling + eps, f"render: peak {peak} before the safety clip"
+    print(f"[CHECK OK] limiter stays within {ceiling} before clipping (render peak {peak:.12f}).")
+
+def write_wav_stream(filename, blocks, scale=1.0, cfg=None):
+    """
+    Writes float blocks to a mono WAV (cfg.export_format) as they arrive.
+    """
+    cfg = cfg or DEFAULT_CONFIG
+    with WavWriter(filename, cfg.sr, cfg.export_format, cfg.dither, cfg.seed) as writer:
+        for block in blocks:
+            writer.write(block * float(scale))
+
+def main_streaming(normalize="peak", cfg=None):
+    """
+    Constant-memory version of main().
+    normalize="peak": two passes with the same seed, first one only measures.
+    normalize="limiter": one pass through limit_stream.
+    """
+    cfg = cfg or DEFAULT_CONFIG
+    print(f"Streaming {cfg.total_minutes} minute Qaraami Masterpiece ({normalize})...")
+    filename = cfg.filename
+
+    if normalize == "peak":
+        # The second pass must replay the exact same randomness
+        if cfg.seed is None:
+            cfg = cfg.replace(seed=random.randrange(2**32))
+        print("   -> Pass 1: Measuring Peak...")
+        max_val = max(np.max(np.abs(b)) for b in render_stream(cfg))
+        scale = 1.0 / max_val if max_val > 0 else 1.0
+        print("   -> Pass 2: Writing...")
+        write_wav_stream(filename, render_stream(cfg), scale, cfg)
+    elif normalize == "limiter":
+        write_wav_stream(filename, limit_stream(render_stream(cfg), sr=cfg.sr), cfg=cfg)
+    else:
+        raise ValueError(f"Unknown normalize mode '{normalize}'. Use 'peak' or 'limiter'")
+
     print(f"DONE! File saved as: {filename}")
+    return filename
+
+# --- 6. BENCHMARK ---
+
+def benchmark_oscillators(duration=1.5, repeats=20):
+    """
+    Times the sin and wavetable plucks over the whole scale (cache bypassed)
+    and reports the worst-case error of the wavetable against sin.
+    """
+    scale = [52, 55, 57, 60, 62, 64, 67, 69, 72, 74, 76]
+    freqs = [440.0 * (2 ** ((m - 69) / 12)) for m in scale]
+
+    timings = {}
+    for name, render_fn in (("sin", _render_oud_pluck), ("wavetable", _render_oud_pluck_wavetable)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for freq in freqs:
+                render_fn(freq, duration)
+        timings[name] = time.perf_counter() - start
+        n_total = repeats * len(freqs) * int(SR * duration)
+        print(f"   [{name:>9}] {n_total / timings[name]:,.0f} samples/sec")
+
+    max_err = max(np.max(np.abs(_render_oud_pluck(f, duration) - _render_oud_pluck_wavetable(f, duration)))
+                  for f in freqs)
+    print(f"   Speedup: {timings['sin'] / timings['wavetable']:.1f}x")
+    print(f"   Max abs error: {max_err:.2e} (bound {WAVETABLE_ERROR_BOUND:.2e})")
+    return max_err
+
+def compare_dtypes(total_minutes=0.5, seed=7):
+    """
+    Renders the same seeded piece in float64 and float32 and quantifies the
+    difference: max abs error, error level in dB, and where it sits against
+    the 16-bit and 24-bit quantization steps.
+    """
+    renders = {}
+    for dtype in ("float64", "float32"):
+        cfg = RenderConfig(total_minutes=total_minutes, seed=seed, dtype=dtype)
+        start = time.perf_counter()
+        renders[dtype] = np.concatenate(list(render_stream(cfg)))
+        elapsed = time.perf_counter() - start
+        print(f"   [{dtype}] {elapsed:.2f}s, {renders[dtype].nbytes / 1e6:.1f} MB")
+
+    reference = renders["float64"]
+    error = renders["float32"].astype(np.float64) - reference
+    peak = np.max(np.abs(reference))
+    max_err = np.max(np.abs(error)) / peak
+    snr_db = 10 * np.log10(np.sum(reference ** 2) / max(np.sum(error ** 2), 1e-300))
+    print(f"   Max abs error (normalized): {max_err:.2e}")
+    print(f"   float32 vs float64 SNR: {snr_db:.1f} dB")
+    print(f"   16-bit LSB: {1 / 32767:.2e}, 24-bit LSB: {1 / (2 ** 23 - 1):.2e}")
+    return max_err, snr_db
+
+def check_precision(total_minutes=0.5, seed=7):
+    """
+    Assertion version of compare_dtypes: float32 must match float64 within
+    FLOAT32_MAX_ERROR / FLOAT32_MIN_SNR_DB, and int16/int24 export error
+    must stay within its theoretical bounds (audio_io.check_quantization).
+    """
+    max_err, snr_db = compare_dtypes(total_minutes, seed)
+    assert max_err <= FLOAT32_MAX_ERROR, f"float32 error {max_err:.2e} > {FLOAT32_MAX_ERROR:.2e}"
+    assert snr_db >= FLOAT32_MIN_SNR_DB, f"float32 SNR {snr_db:.1f} dB < {FLOAT32_MIN_SNR_DB} dB"
+    check_quantization()
+    print(f"[CHECK OK] float32 within {FLOAT32_MAX_ERROR:.2e} of float64 ({snr_db:.1f} dB SNR).")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--benchmark" in sys.argv:
+        benchmark_oscillators()
+    elif "--compare-dtypes" in sys.argv:
+        compare_dtypes()
+    elif "--check-precision" in sys.argv:
+        check_precision()
+    elif "--check-limiter" in sys.argv:
+        check_limiter()
+    else:
+        cfg = DEFAULT_CONFIG
+        if "--fills" in sys.argv:
+            cfg = cfg.replace(drum_pattern=DHAANTO_PATTERN_WITH_FILLS)
+        if "--stream" in sys.argv:
+            main_streaming("limiter" if "--limiter" in sys.argv else "peak", cfg)
+        else:
+            main(cfg)
\ No newline at end of file
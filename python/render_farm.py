@@ -0,0 +1,82 @@
+import numpy as np
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from qarami_masterpiece import RenderConfig, main_streaming
+
+# ==============================================================================
+# RENDER FARM: MANY QARAAMI VARIATIONS IN PARALLEL
+# Each job is a RenderConfig rendered by the streaming engine in its own process.
+# ==============================================================================
+
+OUTPUT_DIR = "dataset/generated_sets"
+
+def assign_seeds(configs, base_seed=0):
+    """
+    Gives every config without a seed its own deterministic seed.
+    Seeds come from SeedSequence(base_seed).spawn, so job i always gets the
+    same seed for the same base_seed, regardless of worker count or order.
+    """
+    children = np.random.SeedSequence(base_seed).spawn(len(configs))
+    seeded = []
+    for cfg, child in zip(configs, children):
+        if cfg.seed is None:
+            cfg = cfg.replace(seed=int(child.generate_state(1)[0]))
+        seeded.append(cfg)
+    return seeded
+
+def render_job(cfg, normalize="peak"):
+    """Worker entry point: renders one config and returns (filename, seconds)."""
+    start = time.perf_counter()
+    filename = main_streaming(normalize, cfg)
+    return filename, time.perf_counter() - start
+
+def render_farm(configs, workers=None, base_seed=0, normalize="peak"):
+    """
+    Fans the configs out over a process pool.
+    Each worker writes its WAV as soon as it finishes; results are reported
+    in completion order. A failing job is reported and does not stop the rest.
+    """
+    configs = assign_seeds(configs, base_seed)
+    workers = workers or os.cpu_count()
+    print(f"--- RENDER FARM: {len(configs)} jobs on {workers} workers ---")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_job, cfg, normalize): cfg for cfg in configs}
+        for future in as_completed(futures):
+            cfg = futures[future]
+            try:
+                filename, elapsed = future.result()
+                print(f"   [DONE] {filename} (seed={cfg.seed}, {elapsed:.1f}s)")
+                results.append((cfg, filename))
+            except Exception as e:
+                print(f"   [ERROR] {cfg}: {e}")
+
+    return results
+
+def make_variations(n_variations, bpms=(100, 110, 120, 130), total_minutes=2.0):
+    """A spread of tempos and gravity curves to audition."""
+    gravity_curves = [
+        [(0.2, 2), (0.5, 5), (0.8, 9), (1.0, 2)],   # Classic: Low -> High -> Low
+        [(0.3, 5), (0.7, 9), (1.0, 5)],             # Mid-range build
+        [(0.5, 9), (1.0, 2)]                        # Solo first, then settle
+    ]
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    configs = []
+    for i in range(n_variations):
+        bpm = bpms[i % len(bpms)]
+        configs.append(RenderConfig(
+            bpm=bpm,
+            total_minutes=total_minutes,
+            gravity_curve=gravity_curves[i % len(gravity_curves)],
+            filename=os.path.join(OUTPUT_DIR, f"qaraami_{i:03d}_{bpm}bpm.wav")
+        ))
+    return configs
+
+if __name__ == "__main__":
+    n_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    render_farm(make_variations(n_jobs), workers=n_workers)
@@ -0,0 +1,108 @@
+import sqlite3
+import time
+import os
+
+# ==============================================================================
+# RESOLUTION CACHE (PERSISTENT, SQLITE)
+# Used by harvard_scraper.py: remembers catalog ID -> audio URL and
+# NRS link -> media URL across runs, so re-runs only touch the network for
+# new or stale entries. Stale entries are revalidated with conditional
+# requests (ETag / Last-Modified) instead of being re-downloaded and re-parsed.
+# ==============================================================================
+
+RESOLUTION_DB = "dataset/resolution_cache.sqlite"
+POSITIVE_TTL = 30 * 24 * 3600   # found audio: recheck monthly
+NEGATIVE_TTL = 3 * 24 * 3600    # "no audio": recheck sooner, items get digitized
+
+class ResolutionCache:
+    """
+    One row per resolved key: kind ("catalog" or "nrs"), key (component ID or
+    NRS URL), the resolved url (NULL = negative result), HTTP validators and
+    the time it was last confirmed. Network errors are never stored.
+    """
+    def __init__(self, path=RESOLUTION_DB, ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS resolutions (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                url TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )""")
+        self.db.commit()
+
+    def lookup(self, kind, key):
+        """
+        Returns (row, fresh): row is a dict or None; fresh means it can be used
+        without any request. A stale row still carries validators for revalidation.
+        """
+        found = self.db.execute(
+            "SELECT url, etag, last_modified, checked_at FROM resolutions WHERE kind = ? AND key = ?",
+            (kind, key)).fetchone()
+        if found is None:
+            self.misses += 1
+            return None, False
+
+        row = dict(zip(("url", "etag", "last_modified", "checked_at"), found))
+        ttl = self.ttl if row["url"] else self.negative_ttl
+        fresh = time.time() - row["checked_at"] < ttl
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale += 1
+        return row, fresh
+
+    @staticmethod
+    def conditional_headers(row):
+        """If-None-Match / If-Modified-Since for a stale row (empty if it has no validators)."""
+        headers = {}
+        if row and row["etag"]:
+            headers["If-None-Match"] = row["etag"]
+        if row and row["last_modified"]:
+            headers["If-Modified-Since"] = row["last_modified"]
+        return headers
+
+    def store(self, kind, key, url, etag=None, last_modified=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, key, url, etag, last_modified, time.time()))
+        self.db.commit()
+
+    def touch(self, kind, key):
+        """The server answered 304: the cached result is confirmed for another TTL."""
+        self.revalidated += 1
+        self.db.execute("UPDATE resolutions SET checked_at = ? WHERE kind = ? AND key = ?",
+                        (time.time(), kind, key))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def stats(self):
+        total = self.hits + self.stale + self.misses
+        return {
+            "hits": self.hits,
+            "stale": self.stale,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.revalidated) / total if total else 0.0
+        }
+
+    def __repr__(self):
+        s = self.stats()
+        return (f"ResolutionCache({self.path}, hits={s['hits']}, stale={s['stale']} "
+                f"({s['revalidated']} revalidated by 304), "
+                f"misses={s['misses']}, hit_rate={s['hit_rate']:.0%})")
@@ -1,36 +1,171 @@
 import subprocess
+import argparse
 import os
 import glob
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 INPUT_DIR = "dataset/processed_tracks"
 
 OUTPUT_DIR = "dataset/separated_oud"
 
-def separate_sources():
-    # Find all mp3s
-    tracks = glob.glob(os.path.join(INPUT_DIR, "*.mp3"))
-    
+MODEL_NAME = "htdemucs"
+STEM = "other"           # --two-stems: writes other.wav + no_other.wav
+TRACK_EXTENSIONS = ("mp3", "wav", "flac")
+
+# Loaded once per worker process by _init_worker
+_MODEL = None
+_JOBS = 0
+_SEGMENT = None
+
+def stem_dir(track, output_dir=OUTPUT_DIR, model_name=MODEL_NAME):
+    """Where demucs puts a track's stems: <output>/<model>/<track name>/."""
+    name = os.path.splitext(os.path.basename(track))[0]
+    return os.path.join(output_dir, model_name, name)
+
+def has_stems(track, output_dir=OUTPUT_DIR, model_name=MODEL_NAME):
+    folder = stem_dir(track, output_dir, model_name)
+    return all(os.path.exists(os.path.join(folder, f"{name}.wav")) for name in (STEM, f"no_{STEM}"))
+
+def find_tracks(input_dir=INPUT_DIR):
+    # Find all sliced tracks (auto_slicer exports mp3, or lossless wav/flac)
+    return sorted(t for ext in TRACK_EXTENSIONS
+                  for t in glob.glob(os.path.join(input_dir, f"*.{ext}")))
+
+def _init_worker(model_name, jobs, segment, threads):
+    """Process-pool initializer: pays the model load once per worker, not once per track."""
+    global _MODEL, _JOBS, _SEGMENT
+    import torch
+    from demucs.pretrained import get_model
+
+    # Workers split the cores between them instead of each grabbing all of them
+    torch.set_num_threads(threads)
+    _MODEL = get_model(name=model_name)
+    _MODEL.cpu()
+    _MODEL.eval()
+    _JOBS = jobs
+    _SEGMENT = segment
+
+def separate_track(track, output_dir=OUTPUT_DIR, model_name=MODEL_NAME):
+    """
+    Separates one track with the worker's preloaded model, the same way
+    `demucs --two-stems other` does. Returns (track, seconds, audio seconds).
+    """
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import save_audio
+    from demucs.separate import load_track
+
+    start = time.perf_counter()
+    model = _MODEL
+    wav = load_track(track, model.audio_channels, model.samplerate)
+
+    # Normalize like the demucs CLI, separate, then undo the normalization
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+    with torch.no_grad():
+        sources = apply_model(model, wav[None], device="cpu", split=True, overlap=0.25,
+                              progress=False, num_workers=_JOBS, segment=_SEGMENT)[0]
+    sources = sources * ref.std() + ref.mean()
+
+    sources = list(sources)
+    stem = sources.pop(model.sources.index(STEM))
+    rest = torch.zeros_like(stem)
+    for source in sources:
+        rest += source
+
+    folder = stem_dir(track, output_dir, model_name)
+    os.makedirs(folder, exist_ok=True)
+    save_audio(stem, os.path.join(folder, f"{STEM}.wav"), samplerate=model.samplerate)
+    save_audio(rest, os.path.join(folder, f"no_{STEM}.wav"), samplerate=model.samplerate)
+
+    return track, time.perf_counter() - start, wav.shape[-1] / model.samplerate
+
+def separate_sources(workers=1, jobs=0, segment=None, force=False):
+    """
+    Separates every sliced track that does not have stems yet.
+    Tracks are sharded over 'workers' processes, each holding one copy of the
+    model; 'jobs' is demucs' own per-track parallelism (num_workers in
+    apply_model) and 'segment' its chunk length in seconds (lower = less RAM).
+    A failing track is reported and does not stop the rest.
+    """
+    tracks = find_tracks()
+
     if not tracks:
         print("No tracks found! Run auto_slicer.py first.")
+        return []
+
+    todo = tracks if force else [t for t in tracks if not has_stems(t)]
+    print(f"Found {len(tracks)} tracks, {len(tracks) - len(todo)} already separated.")
+    if not todo:
+        return []
+
+    workers = max(1, min(workers, len(todo)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Separating {len(todo)} tracks on {workers} workers ({threads} threads each)...")
+
+    started = time.perf_counter()
+    done = []
+    audio_total = 0.0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(MODEL_NAME, jobs, segment, threads)) as pool:
+        futures = {pool.submit(separate_track, track): track for track in todo}
+        for future in as_completed(futures):
+            track = futures[future]
+            try:
+                _, seconds, audio_seconds = future.result()
+                audio_total += audio_seconds
+                done.append(track)
+                print(f"   [{len(done)}/{len(todo)}] {track}: {seconds:.1f}s "
+                      f"({audio_seconds / seconds:.2f}x realtime)")
+            except Exception as e:
+                print(f"   [ERROR] {track}: {e}")
+
+    elapsed = time.perf_counter() - started
+    print(f"Separated {len(done)}/{len(todo)} tracks in {elapsed:.1f}s "
+          f"({audio_total / max(elapsed, 1e-9):.2f}x realtime overall).")
+    return done
+
+def separate_sources_cli(jobs=0, segment=None, force=False):
+    """
+    Fallback through the demucs CLI: one invocation for all pending tracks,
+    so the model is still loaded only once.
+    """
+    todo = [t for t in find_tracks() if force or not has_stems(t)]
+    if not todo:
+        print("Nothing to separate.")
         return
 
-    print(f"Found {len(tracks)} tracks to process with Demucs.")
-
-    for track in tracks:
-        print(f"--> Separating: {track}")
-        
-        
-       
-        cmd = [
-            "demucs",
-            "-n", "htdemucs", 
-            "--two-stems", "other", 
-            "-o", OUTPUT_DIR,
-            track
-        ]
-        
-        subprocess.run(cmd)
+    cmd = [
+        "demucs",
+        "-n", MODEL_NAME,
+        "--two-stems", STEM,
+        "-o", OUTPUT_DIR,
+        "-j", str(jobs)
+    ]
+    if segment is not None:
+        cmd += ["--segment", str(segment)]
+
+    print(f"--> Separating {len(todo)} tracks in one demucs run...")
+    start = time.perf_counter()
+    result = subprocess.run(cmd + todo)
+    if result.returncode != 0:
+        raise RuntimeError(f"demucs exited with code {result.returncode}")
+    print(f"Done in {time.perf_counter() - start:.1f}s.")
 
 if __name__ == "__main__":
-    separate_sources()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Batch Demucs separation of the sliced tracks.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes, each with its own copy of the model")
+    parser.add_argument("--jobs", type=int, default=0, help="demucs parallel jobs per track")
+    parser.add_argument("--segment", type=float, default=None,
+                        help="demucs segment length in seconds (htdemucs: at most 7.8)")
+    parser.add_argument("--force", action="store_true", help="re-separate tracks that already have stems")
+    parser.add_argument("--cli", action="store_true", help="use one demucs CLI invocation instead")
+    args = parser.parse_args()
+
+    if args.cli:
+        separate_sources_cli(args.jobs, args.segment, args.force)
+    else:
+        separate_sources(args.workers, args.jobs, args.segment, args.force)
@@ -0,0 +1,84 @@
+import numpy as np
+import hashlib
+import json
+import os
+
+# ==============================================================================
+# TRANSCRIPTION CACHE (INCREMENTAL, ON DISK)
+# Used by generate_sheet_music.py so re-runs skip work on unchanged stems.
+# Every stage key chains its parent's key, so changing one parameter only
+# invalidates the stages after it.
+# ==============================================================================
+
+TRANSCRIPTION_CACHE_DIR = "dataset/.transcription_cache"
+
+class TranscriptionCache:
+    """
+    Stores each stage's arrays as <cache_dir>/<content hash>/<stage>-<key>.npz.
+    Writes go through a temp file + os.replace, so parallel workers never
+    see a half-written entry.
+    """
+    def __init__(self, cache_dir=TRANSCRIPTION_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def file_hash(path, chunk_size=1 << 20):
+        """SHA-256 of the file bytes: renaming or touching a stem keeps its entries."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def stage_key(parents, stage, params):
+        """
+        Key for one stage = hash(parent keys, stage name, its own parameters).
+        'parents' is a key string or a list of them (a stage may depend on several).
+        """
+        if isinstance(parents, str):
+            parents = [parents]
+        payload = json.dumps([list(parents), stage, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+    def _path(self, content_hash, stage, key):
+        return os.path.join(self.cache_dir, content_hash, f"{stage}-{key}.npz")
+
+    def load(self, content_hash, stage, key):
+        """Returns the stored arrays as a dict, or None on a miss."""
+        path = self._path(content_hash, stage, key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            # Truncated or corrupt entry: treat as a miss, it will be rewritten
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def save(self, content_hash, stage, key, **arrays):
+        path = self._path(content_hash, stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def __repr__(self):
+        s = self.stats()
+        return (f"TranscriptionCache({self.cache_dir}, hits={s['hits']}, "
+                f"misses={s['misses']}, hit_rate={s['hit_rate']:.0%})")
@@ -1,6 +1,6 @@
-import subprocess
 import os
 import requests
+from download_manager import DownloadManager
 
 # --- CONFIGURATION ---
 HARVARD_DIR = "dataset/harvard_audio"
@@ -9,17 +9,20 @@ YOUTUBE_DIR = "dataset/youtube_downloads"
 os.makedirs(HARVARD_DIR, exist_ok=True)
 os.makedirs(YOUTUBE_DIR, exist_ok=True)
 
-def download_with_ytdlp(url, output_path, is_youtube=False):
+def download_with_ytdlp(url, output_path, is_youtube=False, manager=None):
+    """
+    Queues the download on 'manager' and returns its Future; without one it
+    downloads right away and returns the result dict.
+    """
     print(f"\n--- STARTING DOWNLOAD ---")
     print(f"URL: {url}")
 
-    # base command
-    cmd = ["yt-dlp", url]
-
     if is_youtube:
         # 1. Corrected flag: --no-playlist
         # 2. Ensures high quality mp4 merging
-        cmd += [
+        # yt-dlp names the file from the title itself, so no target filename
+        filename = None
+        args = [
             "-o", os.path.join(output_path, "%(title)s.%(ext)s"),
             "--no-playlist",
             "--format", "bestvideo+bestaudio/best",
@@ -28,20 +31,19 @@ def download_with_ytdlp(url, output_path, is_youtube=False):
     else:
         # For Harvard: use --impersonate to mimic a real browser fingerprint
         # This is often more effective than just a User-Agent string.
-        cmd += [
-            "-o", os.path.join(output_path, "harvard_audio.mp3"),
+        filename = os.path.join(output_path, "harvard_audio.mp3")
+        args = [
             "--impersonate", "chrome",
             "--referer", "https://nrs.lib.harvard.edu/",
             "--no-check-certificate"
         ]
 
-    try:
-        subprocess.run(cmd, check=True)
-        print(f"--- [SUCCESS] Saved to {output_path} ---")
-    except subprocess.CalledProcessError as e:
-        print(f"--- [FAILED] Download error. Check if FFmpeg is installed and yt-dlp is updated. ---")
+    if manager is None:
+        with DownloadManager(workers=1) as manager:
+            return manager.submit(url, filename, args=args).result()
+    return manager.submit(url, filename, args=args)
 
-def process_harvard_link(url):
+def process_harvard_link(url, manager=None):
     """Follows redirects before downloading."""
     session = requests.Session()
     headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)'}
@@ -49,15 +51,20 @@ def process_harvard_link(url):
         response = session.get(url, headers=headers, allow_redirects=True)
         final_url = response.url
         print(f"Resolved Harvard URL: {final_url}")
-        download_with_ytdlp(final_url, HARVARD_DIR, is_youtube=False)
+        return download_with_ytdlp(final_url, HARVARD_DIR, is_youtube=False, manager=manager)
     except Exception as e:
         print(f"Failed to resolve Harvard link: {e}")
 
 if __name__ == "__main__":
-    # 1. Harvard Link
-    h_url = "https://nrs.lib.harvard.edu/urn-3:fhcl.loeb:42390430"
-    process_harvard_link(h_url)
+    # Both downloads run side by side on one manager
+    with DownloadManager(workers=2) as manager:
+        # 1. Harvard Link
+        h_url = "https://nrs.lib.harvard.edu/urn-3:fhcl.loeb:42390430"
+        process_harvard_link(h_url, manager)
+
+        # 2. YouTube Link (Radio/Playlist mix)
+        y_url = "https://www.youtube.com/watch?v=fZJYdJ9yhNQ&list=RDfZJYdJ9yhNQ&start_radio=1"
+        download_with_ytdlp(y_url, YOUTUBE_DIR, is_youtube=True, manager=manager)
 
-    # 2. YouTube Link (Radio/Playlist mix)
-    y_url = "https://www.youtube.com/watch?v=fZJYdJ9yhNQ&list=RDfZJYdJ9yhNQ&start_radio=1"
-    download_with_ytdlp(y_url, YOUTUBE_DIR, is_youtube=True)
\ No newline at end of file
+        manager.wait()
+        manager.report()